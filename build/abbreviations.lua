@@ -0,0 +1,69 @@
+-- Expand the first use of each glossary abbreviation: "МРТ (магнитно-резонансная томография)".
+--
+-- The first uses across the whole book are computed once per render by
+-- scripts/abbreviations.py (run from the pre-render when this filter is listed
+-- in _quarto.yml) and read from the data file here; each chapter only expands
+-- the terms whose first use it contains.
+
+local data_path = ".cache/abbreviations.json"
+
+local function project_dir()
+  if quarto and quarto.project and quarto.project.directory then
+    return quarto.project.directory
+  end
+  return "."
+end
+
+local function load_terms()
+  local f = io.open(project_dir() .. "/" .. data_path, "r")
+  if not f then
+    return {}
+  end
+  local content = f:read("a")
+  f:close()
+  local data = pandoc.json.decode(content, false)
+  return data.terms or {}
+end
+
+local function current_input()
+  if quarto and quarto.doc and quarto.doc.input_file then
+    return quarto.doc.input_file
+  end
+  return PANDOC_STATE.input_files[1] or ""
+end
+
+local function ends_with(text, suffix)
+  return #suffix > 0 and text:sub(-#suffix) == suffix
+end
+
+function Pandoc(doc)
+  local input = current_input()
+  local pending = {}
+  local count = 0
+  for term, info in pairs(load_terms()) do
+    if ends_with(input, info.chapter) then
+      pending[term] = info.expansion
+      count = count + 1
+    end
+  end
+  if count == 0 then
+    return nil
+  end
+
+  doc.blocks = doc.blocks:walk({
+    Str = function(el)
+      local prefix, word, suffix = el.text:match("^(%p*)(.-)(%p*)$")
+      local expansion = word and pending[word]
+      if not expansion then
+        return nil
+      end
+      pending[word] = nil
+      return {
+        pandoc.Str(prefix .. word),
+        pandoc.Space(),
+        pandoc.Str("(" .. expansion .. ")" .. suffix),
+      }
+    end,
+  })
+  return doc
+end
@@ -0,0 +1,300 @@
+// Search loader for the sharded index written by scripts/search_index.py.
+//
+// index.json (pages, documents, stop words, shard names) is fetched on the
+// first search; after that only the shards of the query terms and the
+// snippet blocks of the displayed results are fetched, each once.
+// BookSearch.search(query) resolves to ranked results
+// [{url, title, kind, snippet, score}]. Terms are stemmed with the same
+// Snowball algorithm as scripts/russian_stemmer.py (keep both in sync); the
+// last query word also matches as a prefix, for search-as-you-type.
+//
+// An <input data-book-search> gets a result list rendered after it. The
+// box of build/book-search.html (included in every page by _quarto.yml) is
+// moved into Quarto's sidebar and shown.
+
+(function (root) {
+  "use strict";
+
+  // --- Snowball Russian stemmer (port of scripts/russian_stemmer.py) ---
+
+  var VOWELS = "аеиоуыэюя";
+  var PERFECTIVE_GERUND_1 = ["в", "вши", "вшись"];
+  var PERFECTIVE_GERUND_2 = ["ив", "ивши", "ившись", "ыв", "ывши", "ывшись"];
+  var ADJECTIVE = [
+    "ее", "ие", "ые", "ое", "ими", "ыми", "ей", "ий", "ый", "ой", "ем", "им", "ым", "ом",
+    "его", "ого", "ему", "ому", "их", "ых", "ую", "юю", "ая", "яя", "ою", "ею"
+  ];
+  var PARTICIPLE_1 = ["ем", "нн", "вш", "ющ", "щ"];
+  var PARTICIPLE_2 = ["ивш", "ывш", "ующ"];
+  var REFLEXIVE = ["ся", "сь"];
+  var VERB_1 = [
+    "ла", "на", "ете", "йте", "ли", "й", "л", "ем", "н", "ло", "но", "ет", "ют", "ны", "ть",
+    "ешь", "нно"
+  ];
+  var VERB_2 = [
+    "ила", "ыла", "ена", "ейте", "уйте", "ите", "или", "ыли", "ей", "уй", "ил", "ыл", "им",
+    "ым", "ен", "ило", "ыло", "ено", "ят", "ует", "уют", "ит", "ыт", "ены", "ить", "ыть",
+    "ишь", "ую", "ю"
+  ];
+  var NOUN = [
+    "а", "ев", "ов", "ие", "ье", "е", "иями", "ями", "ами", "еи", "ии", "и", "ией", "ей", "ой",
+    "ий", "й", "иям", "ям", "ием", "ем", "ам", "ом", "о", "у", "ах", "иях", "ях", "ы", "ь",
+    "ию", "ью", "ю", "ия", "ья", "я"
+  ];
+  var SUPERLATIVE = ["ейш", "ейше"];
+  var DERIVATIONAL = ["ост", "ость"];
+
+  function isVowel(ch) {
+    return VOWELS.indexOf(ch) >= 0;
+  }
+
+  function regions(word) {
+    var rv = word.length, r1 = word.length, r2 = word.length, i;
+    for (i = 0; i < word.length; i++) {
+      if (isVowel(word[i])) { rv = i + 1; break; }
+    }
+    for (i = 1; i < word.length; i++) {
+      if (isVowel(word[i - 1]) && !isVowel(word[i])) { r1 = i + 1; break; }
+    }
+    for (i = r1 + 1; i < word.length; i++) {
+      if (isVowel(word[i - 1]) && !isVowel(word[i])) { r2 = i + 1; break; }
+    }
+    return [rv, r2];
+  }
+
+  function endsWith(word, suffix) {
+    return word.length >= suffix.length && word.slice(word.length - suffix.length) === suffix;
+  }
+
+  // Remove the longest of suffixes / afterAYa at or after start, or return null
+  function removeSuffix(word, start, suffixes, afterAYa) {
+    var all = suffixes.concat(afterAYa || []);
+    var best = "";
+    for (var i = 0; i < all.length; i++) {
+      var suffix = all[i];
+      if (suffix.length > best.length && endsWith(word, suffix) && word.length - suffix.length >= start) {
+        best = suffix;
+      }
+    }
+    if (!best) return null;
+    var stem = word.slice(0, word.length - best.length);
+    if (suffixes.indexOf(best) < 0 && !(stem.length > start && "ая".indexOf(stem[stem.length - 1]) >= 0)) {
+      return null;
+    }
+    return stem;
+  }
+
+  function stem(word) {
+    word = word.replace(/ё/g, "е");
+    var r = regions(word), rv = r[0], r2 = r[1], result;
+    if (rv >= word.length) return word;
+
+    // Step 1
+    result = removeSuffix(word, rv, PERFECTIVE_GERUND_2, PERFECTIVE_GERUND_1);
+    if (result === null) {
+      word = removeSuffix(word, rv, REFLEXIVE) || word;
+      result = removeSuffix(word, rv, ADJECTIVE);
+      if (result !== null) {
+        result = removeSuffix(result, rv, PARTICIPLE_2, PARTICIPLE_1) || result;
+      } else {
+        result = removeSuffix(word, rv, VERB_2, VERB_1);
+        if (result === null) result = removeSuffix(word, rv, NOUN);
+      }
+    }
+    if (result !== null) word = result;
+
+    // Step 2
+    if (endsWith(word, "и") && word.length - 1 >= rv) word = word.slice(0, -1);
+
+    // Step 3
+    word = removeSuffix(word, Math.max(r2, rv), DERIVATIONAL) || word;
+
+    // Step 4
+    if (endsWith(word, "нн") && word.length - 2 >= rv) {
+      word = word.slice(0, -1);
+    } else {
+      result = removeSuffix(word, rv, SUPERLATIVE);
+      if (result !== null) {
+        word = endsWith(result, "нн") && result.length - 2 >= rv ? result.slice(0, -1) : result;
+      } else if (endsWith(word, "ь") && word.length - 1 >= rv) {
+        word = word.slice(0, -1);
+      }
+    }
+    return word;
+  }
+
+  // --- Index access ---
+
+  var WORD_PATTERN = /[\p{L}\p{N}_]+/gu;
+
+  function shardName(term, prefixLength) {
+    return Array.from(term).slice(0, prefixLength).map(function (ch) {
+      return ch.codePointAt(0).toString(16).padStart(4, "0");
+    }).join("-");
+  }
+
+  function queryTerms(query, stopWords) {
+    var words = query.toLowerCase().replace(/ё/g, "е").match(WORD_PATTERN) || [];
+    return words.filter(function (word) {
+      return !stopWords.has(word) && (word.length > 1 || /^\d$/.test(word));
+    }).map(stem);
+  }
+
+  function createSearch(base, fetchJson) {
+    var manifest = null;
+    var shards = {};
+    var snippetBlocks = {};
+
+    function loadManifest() {
+      if (!manifest) {
+        manifest = fetchJson(base + "index.json").then(function (data) {
+          data.stopWordSet = new Set(data.stopWords);
+          data.shardSet = new Set(data.shards);
+          return data;
+        });
+      }
+      return manifest;
+    }
+
+    function loadShard(index, name) {
+      if (!index.shardSet.has(name)) return Promise.resolve({});
+      if (!shards[name]) shards[name] = fetchJson(base + "shards/" + name + ".json");
+      return shards[name];
+    }
+
+    function loadSnippets(index, ids) {
+      return Promise.all(ids.map(function (id) {
+        var block = Math.floor(id / index.snippetBlock);
+        if (!snippetBlocks[block]) snippetBlocks[block] = fetchJson(base + "snippets/" + block + ".json");
+        return snippetBlocks[block].then(function (list) { return list[id % index.snippetBlock]; });
+      }));
+    }
+
+    // Postings of a term; the last query term also matches longer stems
+    function postings(shard, term, prefix) {
+      if (!prefix) return shard[term] ? [shard[term]] : [];
+      return Object.keys(shard).filter(function (key) {
+        return key.lastIndexOf(term, 0) === 0;
+      }).map(function (key) { return shard[key]; });
+    }
+
+    function search(query, limit) {
+      limit = limit || 20;
+      return loadManifest().then(function (index) {
+        var terms = queryTerms(query, index.stopWordSet);
+        if (!terms.length) return [];
+        return Promise.all(terms.map(function (term) {
+          return loadShard(index, shardName(term, index.prefix));
+        })).then(function (loaded) {
+          var total = index.documents.length;
+          var scores = {};
+          var matched = {};
+          terms.forEach(function (term, position) {
+            var lists = postings(loaded[position], term, position === terms.length - 1);
+            lists.forEach(function (list) {
+              var idf = Math.log(1 + total / list.length);
+              list.forEach(function (entry) {
+                scores[entry[0]] = (scores[entry[0]] || 0) + entry[1] * idf;
+                matched[entry[0]] = (matched[entry[0]] || 0) | (1 << Math.min(position, 30));
+              });
+            });
+          });
+          // Documents containing all query terms first
+          var all = (1 << Math.min(terms.length, 31)) - 1;
+          var ids = Object.keys(scores).map(Number).sort(function (a, b) {
+            var fullA = matched[a] === all, fullB = matched[b] === all;
+            return fullA !== fullB ? (fullA ? -1 : 1) : scores[b] - scores[a];
+          }).slice(0, limit);
+          return loadSnippets(index, ids).then(function (snippets) {
+            return ids.map(function (id, position) {
+              var doc = index.documents[id];
+              var page = index.pages[doc[0]];
+              var title = doc[3] === "s" && doc[2] ? page[1] + " — " + doc[2] : doc[2] || page[1];
+              return {
+                url: base + "../" + page[0] + (doc[1] ? "#" + doc[1] : ""),
+                title: title,
+                kind: doc[3],
+                snippet: snippets[position],
+                score: scores[id]
+              };
+            });
+          });
+        });
+      });
+    }
+
+    return {search: search, stem: stem};
+  }
+
+  // --- Browser wiring ---
+
+  if (typeof module !== "undefined" && module.exports) {
+    module.exports = {stem: stem, shardName: shardName, createSearch: createSearch};
+    return;
+  }
+
+  var script = document.currentScript;
+  var base = script ? script.src.replace(/[^\/]*$/, "") : "search-index/";
+  var api = createSearch(base, function (url) {
+    return fetch(url).then(function (response) {
+      if (!response.ok) throw new Error(url + ": " + response.status);
+      return response.json();
+    });
+  });
+  root.BookSearch = api;
+
+  function attach(input) {
+    var list = document.createElement("ul");
+    list.className = "book-search-results";
+    input.insertAdjacentElement("afterend", list);
+    var pending = 0;
+    input.addEventListener("keydown", function (event) {
+      if (event.key !== "Escape") return;
+      input.value = "";
+      pending++;
+      list.textContent = "";
+    });
+    input.addEventListener("input", function () {
+      var ticket = ++pending;
+      api.search(input.value).then(function (results) {
+        if (ticket !== pending) return;
+        list.textContent = "";
+        results.forEach(function (result) {
+          var item = document.createElement("li");
+          var link = document.createElement("a");
+          link.href = result.url;
+          link.textContent = result.title;
+          item.appendChild(link);
+          if (result.snippet) {
+            var text = document.createElement("div");
+            text.textContent = result.snippet;
+            item.appendChild(text);
+          }
+          list.appendChild(item);
+        });
+      });
+    });
+  }
+
+  // Place the included box where Quarto's own search box would be
+  function place(input) {
+    var box = input.closest(".book-search");
+    if (!box) return;
+    var sidebar = document.querySelector("#quarto-sidebar .sidebar-menu-container")
+      || document.querySelector("#quarto-sidebar");
+    if (sidebar) sidebar.insertBefore(box, sidebar.firstChild);
+    box.hidden = false;
+  }
+
+  function init() {
+    document.querySelectorAll("input[data-book-search]").forEach(function (input) {
+      place(input);
+      attach(input);
+    });
+  }
+  if (document.readyState === "loading") {
+    document.addEventListener("DOMContentLoaded", init);
+  } else {
+    init();
+  }
+})(typeof window !== "undefined" ? window : this);
@@ -0,0 +1,197 @@
+// Deep-zoom viewer for the tile pyramids written by scripts/deep_zoom.py.
+//
+// Every <img data-dzi="…/tiles/<hash>.dzi"> shows the pyramid's preview in
+// the page. Clicking it opens a full-window viewer: wheel, +/- or pinch to
+// zoom, drag to pan, 0 to fit, Esc to close. For each view the level whose
+// resolution just exceeds the screen is chosen and only the tiles covering
+// the visible part are requested; the preview, stretched underneath, fills
+// in until they arrive.
+
+(function (root) {
+  "use strict";
+
+  var MAX_ZOOM = 4;  // screen pixels per image pixel
+  var descriptors = {};
+
+  function loadDescriptor(url) {
+    if (!descriptors[url]) {
+      descriptors[url] = fetch(url).then(function (response) {
+        return response.text();
+      }).then(function (text) {
+        var xml = new DOMParser().parseFromString(text, "application/xml");
+        var image = xml.getElementsByTagName("Image")[0];
+        var size = xml.getElementsByTagName("Size")[0];
+        var width = Number(size.getAttribute("Width"));
+        var height = Number(size.getAttribute("Height"));
+        return {
+          base: url.replace(/\.dzi$/, "_files/"),
+          tileSize: Number(image.getAttribute("TileSize")),
+          overlap: Number(image.getAttribute("Overlap")),
+          format: image.getAttribute("Format"),
+          width: width,
+          height: height,
+          maxLevel: Math.ceil(Math.log2(Math.max(width, height, 2)))
+        };
+      });
+    }
+    return descriptors[url];
+  }
+
+  function Viewer(dzi, preview) {
+    var overlay = document.createElement("div");
+    overlay.setAttribute("style",
+      "position:fixed;inset:0;z-index:2000;background:#111;overflow:hidden;touch-action:none;cursor:grab");
+    var stage = document.createElement("div");
+    stage.setAttribute("style", "position:absolute;left:0;top:0;transform-origin:0 0");
+    var backdrop = document.createElement("img");
+    backdrop.src = preview;
+    backdrop.setAttribute("style", "position:absolute;left:0;top:0;width:100%;height:100%");
+    stage.appendChild(backdrop);
+    overlay.appendChild(stage);
+    var close = document.createElement("button");
+    close.textContent = "×";
+    close.setAttribute("aria-label", "Закрыть");
+    close.setAttribute("style",
+      "position:absolute;top:8px;right:12px;font-size:28px;color:#fff;background:none;border:0;cursor:pointer");
+    overlay.appendChild(close);
+    document.body.appendChild(overlay);
+
+    var tiles = {};
+    var scale = 1, x = 0, y = 0, minScale = 1;
+    var pointers = {}, lastDistance = 0;
+
+    function fit() {
+      minScale = Math.min(overlay.clientWidth / dzi.width, overlay.clientHeight / dzi.height, 1);
+      scale = minScale;
+      x = (overlay.clientWidth - dzi.width * scale) / 2;
+      y = (overlay.clientHeight - dzi.height * scale) / 2;
+      render();
+    }
+
+    function zoomAt(factor, cx, cy) {
+      var next = Math.max(minScale, Math.min(MAX_ZOOM, scale * factor));
+      x = cx - (cx - x) * next / scale;
+      y = cy - (cy - y) * next / scale;
+      scale = next;
+      render();
+    }
+
+    function render() {
+      stage.style.width = dzi.width + "px";
+      stage.style.height = dzi.height + "px";
+      stage.style.transform = "translate(" + x + "px," + y + "px) scale(" + scale + ")";
+
+      // Level whose pixels are at least as dense as the screen's
+      var level = Math.max(0, Math.min(dzi.maxLevel, dzi.maxLevel + Math.ceil(Math.log2(scale))));
+      var factor = Math.pow(2, dzi.maxLevel - level);  // image pixels per level pixel
+      var size = dzi.tileSize * factor;
+      var left = Math.max(0, Math.floor(-x / scale / size));
+      var top = Math.max(0, Math.floor(-y / scale / size));
+      var right = Math.min(Math.ceil(dzi.width / size), Math.ceil((overlay.clientWidth - x) / scale / size));
+      var bottom = Math.min(Math.ceil(dzi.height / size), Math.ceil((overlay.clientHeight - y) / scale / size));
+
+      var wanted = {};
+      for (var column = left; column < right; column++) {
+        for (var row = top; row < bottom; row++) {
+          var key = level + "/" + column + "_" + row;
+          wanted[key] = true;
+          if (tiles[key]) continue;
+          var tile = document.createElement("img");
+          var offsetX = column ? dzi.overlap : 0;
+          var offsetY = row ? dzi.overlap : 0;
+          tile.style.position = "absolute";
+          tile.style.left = (column * dzi.tileSize - offsetX) * factor + "px";
+          tile.style.top = (row * dzi.tileSize - offsetY) * factor + "px";
+          tile.style.transformOrigin = "0 0";
+          tile.style.transform = "scale(" + factor + ")";
+          tile.draggable = false;
+          tile.src = dzi.base + key + "." + dzi.format;
+          tiles[key] = tile;
+          stage.appendChild(tile);
+        }
+      }
+      // Tiles of other levels or out of view are dropped (and their requests cancelled)
+      Object.keys(tiles).forEach(function (key) {
+        if (!wanted[key]) {
+          tiles[key].removeAttribute("src");
+          stage.removeChild(tiles[key]);
+          delete tiles[key];
+        }
+      });
+    }
+
+    function destroy() {
+      document.removeEventListener("keydown", onKey);
+      window.removeEventListener("resize", fit);
+      overlay.parentNode.removeChild(overlay);
+    }
+
+    function onKey(event) {
+      var cx = overlay.clientWidth / 2, cy = overlay.clientHeight / 2;
+      if (event.key === "Escape") destroy();
+      else if (event.key === "+" || event.key === "=") zoomAt(1.5, cx, cy);
+      else if (event.key === "-") zoomAt(1 / 1.5, cx, cy);
+      else if (event.key === "0") fit();
+    }
+
+    overlay.addEventListener("wheel", function (event) {
+      event.preventDefault();
+      zoomAt(Math.pow(1.0015, -event.deltaY), event.clientX, event.clientY);
+    }, {passive: false});
+    overlay.addEventListener("pointerdown", function (event) {
+      if (event.target === close) return;
+      overlay.setPointerCapture(event.pointerId);
+      pointers[event.pointerId] = {x: event.clientX, y: event.clientY};
+      lastDistance = 0;
+    });
+    overlay.addEventListener("pointermove", function (event) {
+      var previous = pointers[event.pointerId];
+      if (!previous) return;
+      var ids = Object.keys(pointers);
+      pointers[event.pointerId] = {x: event.clientX, y: event.clientY};
+      if (ids.length === 1) {
+        x += event.clientX - previous.x;
+        y += event.clientY - previous.y;
+        render();
+      } else if (ids.length === 2) {
+        var a = pointers[ids[0]], b = pointers[ids[1]];
+        var distance = Math.hypot(a.x - b.x, a.y - b.y);
+        if (lastDistance) zoomAt(distance / lastDistance, (a.x + b.x) / 2, (a.y + b.y) / 2);
+        lastDistance = distance;
+      }
+    });
+    ["pointerup", "pointercancel"].forEach(function (type) {
+      overlay.addEventListener(type, function (event) {
+        delete pointers[event.pointerId];
+        lastDistance = 0;
+      });
+    });
+    close.addEventListener("click", destroy);
+    document.addEventListener("keydown", onKey);
+    window.addEventListener("resize", fit);
+    fit();
+  }
+
+  function attach(image) {
+    image.style.cursor = "zoom-in";
+    image.setAttribute("title", image.getAttribute("title") || "Нажмите, чтобы увеличить");
+    image.addEventListener("click", function (event) {
+      event.preventDefault();
+      loadDescriptor(image.getAttribute("data-dzi")).then(function (dzi) {
+        Viewer(dzi, image.currentSrc || image.src);
+      });
+    });
+  }
+
+  function init() {
+    Array.prototype.forEach.call(document.querySelectorAll("img[data-dzi]"), attach);
+  }
+
+  if (root.document) {
+    if (document.readyState === "loading") {
+      document.addEventListener("DOMContentLoaded", init);
+    } else {
+      init();
+    }
+  }
+})(typeof window !== "undefined" ? window : this);
@@ -0,0 +1,63 @@
+-- Point images at the generated trees for the current output format.
+--
+-- scripts/prepare_images.py writes one raster per export profile into
+-- <export-profiles-dir>/<format>/ and other generated files into
+-- <image-build-dir>/, both mirroring img/ (see styles/config.toml). HTML
+-- keeps its /img/ URLs: the pre-render overlays these trees into _book/img.
+-- Other formats take the file from the format tree, then the build tree,
+-- and fall back to the original path otherwise.
+
+local profiles_dir = "_exports"
+local build_dir = "_build"
+
+local function file_exists(path)
+  local f = io.open(path, "rb")
+  if f then
+    f:close()
+    return true
+  end
+  return false
+end
+
+local function project_dir()
+  if quarto and quarto.project and quarto.project.directory then
+    return quarto.project.directory
+  end
+  return "."
+end
+
+local function Meta(meta)
+  if meta["export-profiles-dir"] then
+    profiles_dir = pandoc.utils.stringify(meta["export-profiles-dir"])
+  end
+  if meta["image-build-dir"] then
+    build_dir = pandoc.utils.stringify(meta["image-build-dir"])
+  end
+end
+
+local function Image(img)
+  if FORMAT:match("html") then
+    return nil
+  end
+  local rel = img.src:match("^[%./]*(img/.+)$")
+  if not rel then
+    return nil
+  end
+  local candidates = {
+    project_dir() .. "/" .. profiles_dir .. "/" .. FORMAT .. "/" .. rel,
+    project_dir() .. "/" .. build_dir .. "/" .. rel,
+  }
+  for _, candidate in ipairs(candidates) do
+    if file_exists(candidate) then
+      img.src = candidate
+      return img
+    end
+  end
+  return nil
+end
+
+-- Meta must run before Image, so use two passes
+return {
+  { Meta = Meta },
+  { Image = Image },
+}
@@ -0,0 +1,126 @@
+// Offline service worker for the HTML book.
+//
+// scripts/fingerprint_assets.py fills in PRECACHE and VERSION and writes the
+// result to _book/service-worker.js:
+//   shell     - pages, site_libs and the search index, cached on install
+//   figures   - content-hashed assets referenced by the pages, cached in the
+//               background after activation
+//   revisions - content hashes of the shell files; unchanged files are copied
+//               from the previous cache instead of being downloaded again
+//
+// Hashed assets never change, so they are served cache-first from a cache
+// that survives new versions. Pages are fetched network-first and fall back
+// to the cache when offline.
+
+const PRECACHE = __PRECACHE__;
+const VERSION = "__VERSION__";
+const SHELL_CACHE = "book-shell-" + VERSION;
+const ASSET_CACHE = "book-assets";
+const REVISIONS_KEY = "__revisions__";
+const HASHED_PATTERN = /\.[0-9a-f]{10}\.[^./]+$/;
+
+function absolute(path) {
+  return new URL(path, self.location).href;
+}
+
+const FIGURES = new Set(PRECACHE.figures.map(absolute));
+
+async function previousShell() {
+  const names = (await caches.keys()).filter(function (name) {
+    return name.indexOf("book-shell-") === 0 && name !== SHELL_CACHE;
+  });
+  for (const name of names) {
+    const cache = await caches.open(name);
+    const response = await cache.match(REVISIONS_KEY);
+    if (response) return {cache: cache, revisions: await response.json()};
+  }
+  return null;
+}
+
+self.addEventListener("install", function (event) {
+  event.waitUntil((async function () {
+    const cache = await caches.open(SHELL_CACHE);
+    const previous = await previousShell();
+    const download = [];
+    for (const path of PRECACHE.shell) {
+      const url = absolute(path);
+      if (previous && previous.revisions[path] === PRECACHE.revisions[path]) {
+        const response = await previous.cache.match(url);
+        if (response) {
+          await cache.put(url, response);
+          continue;
+        }
+      }
+      download.push(url);
+    }
+    await cache.addAll(download);
+    await cache.put(REVISIONS_KEY, new Response(JSON.stringify(PRECACHE.revisions)));
+    await self.skipWaiting();
+  })());
+});
+
+async function cacheFigures() {
+  const cache = await caches.open(ASSET_CACHE);
+  for (const request of await cache.keys()) {
+    if (!FIGURES.has(request.url)) await cache.delete(request);
+  }
+  // One at a time: slow connections stay usable for the pages themselves
+  for (const url of FIGURES) {
+    if (await cache.match(url)) continue;
+    try {
+      const response = await fetch(url);
+      if (response.ok) await cache.put(url, response);
+    } catch (error) {
+      return;  // offline: continue on the next activation
+    }
+  }
+}
+
+self.addEventListener("activate", function (event) {
+  event.waitUntil((async function () {
+    for (const name of await caches.keys()) {
+      if (name.indexOf("book-shell-") === 0 && name !== SHELL_CACHE) await caches.delete(name);
+    }
+    await self.clients.claim();
+  })());
+  cacheFigures();
+});
+
+async function cacheFirst(request, cacheName) {
+  const cached = await caches.match(request, {ignoreSearch: true});
+  if (cached) return cached;
+  const response = await fetch(request);
+  if (response.ok && cacheName) {
+    const cache = await caches.open(cacheName);
+    await cache.put(request, response.clone());
+  }
+  return response;
+}
+
+async function networkFirst(request) {
+  try {
+    const response = await fetch(request);
+    if (response.ok) {
+      const cache = await caches.open(SHELL_CACHE);
+      await cache.put(request, response.clone());
+    }
+    return response;
+  } catch (error) {
+    const cached = await caches.match(request, {ignoreSearch: true});
+    if (cached) return cached;
+    throw error;
+  }
+}
+
+self.addEventListener("fetch", function (event) {
+  const request = event.request;
+  if (request.method !== "GET" || new URL(request.url).origin !== self.location.origin) return;
+  const path = new URL(request.url).pathname;
+  if (request.mode === "navigate" || path.endsWith(".html") || path.endsWith("/")) {
+    event.respondWith(networkFirst(request));
+  } else if (HASHED_PATTERN.test(path)) {
+    event.respondWith(cacheFirst(request, ASSET_CACHE));
+  } else {
+    event.respondWith(cacheFirst(request, null));
+  }
+});
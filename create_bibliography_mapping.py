@@ -100,10 +100,17 @@ def parse_bibliography_qmd(filepath: Path) -> Dict[int, Dict[str, str]]:
 def parse_bibtex(filepath: Path) -> Dict[str, Dict[str, str]]:
     """Parse references.bib to extract BibTeX entries"""
     with open(filepath, 'r', encoding='utf-8') as f:
-        bib_database = bibtexparser.load(f)
+        if hasattr(bibtexparser, 'load'):
+            bib_entries = bibtexparser.load(f).entries
+        else:
+            # bibtexparser 2.x API
+            bib_entries = [
+                {'ID': entry.key, **{field.key: field.value for field in entry.fields}}
+                for entry in bibtexparser.parse_string(f.read()).entries
+            ]
     
     entries = {}
-    for entry in bib_database.entries:
+    for entry in bib_entries:
         key = entry.get('ID', '')
         if not key:
             continue
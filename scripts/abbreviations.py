@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Abbreviation glossary checker.
+
+Parses the glossary chapter (src/Abbrevations.qmd, lines "TERM — expansion")
+and scans every other chapter in a single pass with an Aho–Corasick
+automaton over all terms, so the cost does not grow with the glossary size.
+Matches are leftmost-longest on word boundaries ("ВР-МРТ" is one use of
+ВР-МРТ, not of МРТ). Reports:
+- abbreviations used in the text but missing from the glossary
+  (words or hyphenated parts with at least two capital letters)
+- glossary entries never used
+- the first use of every entry (file:line)
+
+With --filter-data the first uses are written as JSON for
+build/abbreviations.lua, which expands each first use at render time. The
+data is computed once per render by the pre-render, not per chapter.
+
+Usage:
+    python scripts/abbreviations.py
+    python scripts/abbreviations.py --filter-data .cache/abbreviations.json
+"""
+
+import json
+import re
+import sys
+from collections import deque
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from quarto_project import QUARTO_CONFIG, get_chapters, load_quarto_config
+
+GLOSSARY_CHAPTER = "src/Abbrevations.qmd"
+FILTER_NAME = "abbreviations.lua"
+DEFAULT_FILTER_DATA = ".cache/abbreviations.json"
+GLOSSARY_LINE_PATTERN = re.compile(r"^\s*([^\s#].*?)\s+[—–]\s+(.+?)\s*$")
+# Candidate abbreviations: words (or parts of hyphenated words, "МР-сигнал")
+# with at least two capital letters; Roman numerals are not abbreviations
+CANDIDATE_PATTERN = re.compile(r"(?<!\w)(?=(?:\w*[A-ZА-ЯЁ]){2})\w+(?!\w)")
+ROMAN_NUMERAL_PATTERN = re.compile(r"[IVXLC]+")
+FENCE_PATTERN = re.compile(r"^\s*(```|~~~)")
+# Markup whose text is not prose: citations, cross-references, attributes, URLs
+NON_PROSE_PATTERN = re.compile(r"@[\w:.#$%&+?<>~/-]+|\{[^}]*\}|\]\([^)]*\)|<[^>]*>|https?://\S+")
+
+
+class Abbreviation(NamedTuple):
+    term: str
+    expansion: str
+    line: int
+
+
+class Use(NamedTuple):
+    term: str
+    path: str
+    line: int
+    column: int
+
+
+class AhoCorasick:
+    """Multi-pattern string matcher: one pass over the text for all patterns"""
+
+    def __init__(self, patterns):
+        # Node: transitions, failure link, lengths of patterns ending here
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[str]] = [[]]
+        for pattern in patterns:
+            self.add(pattern)
+        self.build()
+
+    def add(self, pattern: str):
+        node = 0
+        for char in pattern:
+            next_node = self.goto[node].get(char)
+            if next_node is None:
+                next_node = len(self.goto)
+                self.goto[node][char] = next_node
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            node = next_node
+        self.output[node].append(pattern)
+
+    def build(self):
+        """Compute failure links breadth-first"""
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                # Children of the root fail back to the root
+                self.fail[child] = target if target != child else 0
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, str]]:
+        """Yield (start, pattern) of every occurrence, overlapping ones included"""
+        node = 0
+        for index, char in enumerate(text):
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            for pattern in self.output[node]:
+                yield index - len(pattern) + 1, pattern
+
+
+def is_boundary(text: str, index: int) -> bool:
+    """True if text[index] does not continue a word (or is outside the text)"""
+    return index < 0 or index >= len(text) or not (text[index].isalnum() or text[index] == "_")
+
+
+def find_terms(automaton: AhoCorasick, text: str) -> List[Tuple[int, str]]:
+    """Leftmost-longest, non-overlapping whole-word matches"""
+    candidates = sorted(
+        (
+            (start, -len(term), term)
+            for start, term in automaton.iter_matches(text)
+            if is_boundary(text, start - 1) and is_boundary(text, start + len(term))
+        )
+    )
+    matches = []
+    position = 0
+    for start, negative_length, term in candidates:
+        if start >= position:
+            matches.append((start, term))
+            position = start - negative_length
+    return matches
+
+
+def parse_glossary(path: str = GLOSSARY_CHAPTER) -> List[Abbreviation]:
+    """Parse "TERM — expansion" lines; "A, B — ..." defines several terms"""
+    abbreviations = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            match = GLOSSARY_LINE_PATTERN.match(line)
+            if not match:
+                continue
+            for term in match.group(1).split(","):
+                term = term.strip()
+                if term:
+                    abbreviations.append(Abbreviation(term, match.group(2), line_number))
+    return abbreviations
+
+
+def prose_lines(path: str) -> Iterator[Tuple[int, str]]:
+    """Yield (line number, text) of a chapter outside code blocks and front matter"""
+    in_fence = None
+    in_front_matter = False
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if line_number == 1 and line.strip() == "---":
+                in_front_matter = True
+                continue
+            if in_front_matter:
+                in_front_matter = line.strip() not in ("---", "...")
+                continue
+            fence = FENCE_PATTERN.match(line)
+            if fence:
+                if in_fence is None:
+                    in_fence = fence.group(1)
+                elif fence.group(1) == in_fence:
+                    in_fence = None
+                continue
+            if in_fence is None:
+                # Blank out markup, keeping columns stable
+                yield line_number, NON_PROSE_PATTERN.sub(lambda m: " " * len(m.group(0)), line)
+
+
+def check_abbreviations(
+    chapters: List[str], glossary: List[Abbreviation], glossary_path: str = GLOSSARY_CHAPTER
+):
+    """Scan chapters, return (first uses, use counts, undefined candidates)"""
+    terms = {abbreviation.term for abbreviation in glossary}
+    automaton = AhoCorasick(terms)
+    first_uses: Dict[str, Use] = {}
+    counts: Dict[str, int] = {term: 0 for term in terms}
+    undefined: Dict[str, List[Use]] = {}
+
+    for chapter in chapters:
+        if chapter == glossary_path or not Path(chapter).is_file():
+            continue
+        for line_number, text in prose_lines(chapter):
+            covered = []
+            for start, term in find_terms(automaton, text):
+                counts[term] += 1
+                covered.append((start, start + len(term)))
+                if term not in first_uses:
+                    first_uses[term] = Use(term, chapter, line_number, start + 1)
+            for match in CANDIDATE_PATTERN.finditer(text):
+                if ROMAN_NUMERAL_PATTERN.fullmatch(match.group(0)) or any(
+                    start <= match.start() < end for start, end in covered
+                ):
+                    continue
+                undefined.setdefault(match.group(0), []).append(
+                    Use(match.group(0), chapter, line_number, match.start() + 1)
+                )
+    return first_uses, counts, undefined
+
+
+def filter_data(glossary: List[Abbreviation], first_uses: Dict[str, Use]) -> Dict:
+    """Data for build/abbreviations.lua: first use of each term and its expansion"""
+    return {
+        "version": 1,
+        "terms": {
+            abbreviation.term: {
+                "expansion": abbreviation.expansion,
+                "chapter": first_uses[abbreviation.term].path,
+            }
+            for abbreviation in glossary
+            if abbreviation.term in first_uses
+        },
+    }
+
+
+def write_filter_data(path, data: Dict):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+
+
+def filter_enabled(quarto_config: Optional[Dict] = None) -> bool:
+    """Check whether build/abbreviations.lua is listed in the Quarto filters"""
+    quarto_config = quarto_config if quarto_config is not None else load_quarto_config()
+    return any(str(f).endswith(FILTER_NAME) for f in quarto_config.get("filters") or [])
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Check abbreviation usage against the glossary")
+    parser.add_argument("--glossary", default=GLOSSARY_CHAPTER, help="Glossary chapter")
+    parser.add_argument(
+        "--filter-data",
+        nargs="?",
+        const=DEFAULT_FILTER_DATA,
+        default=None,
+        help=f"Write first-use data for build/{FILTER_NAME} (default path: {DEFAULT_FILTER_DATA})",
+    )
+    parser.add_argument(
+        "--strict", action="store_true", help="Exit with code 1 on undefined or unused abbreviations"
+    )
+    parser.add_argument("--quiet", action="store_true", help="Only print the summary")
+    args = parser.parse_args()
+
+    if not Path(QUARTO_CONFIG).exists():
+        print(f"Error: {QUARTO_CONFIG} not found. Please run from project root.")
+        sys.exit(1)
+
+    glossary = parse_glossary(args.glossary)
+    first_uses, counts, undefined = check_abbreviations(get_chapters(), glossary, args.glossary)
+    unused = [abbreviation for abbreviation in glossary if counts[abbreviation.term] == 0]
+
+    if not args.quiet:
+        print("First uses:")
+        for abbreviation in glossary:
+            use = first_uses.get(abbreviation.term)
+            if use:
+                print(f"  {abbreviation.term}: {use.path}:{use.line}:{use.column} "
+                      f"({counts[abbreviation.term]} uses)")
+        if unused:
+            print("\nUnused glossary entries:")
+            for abbreviation in unused:
+                print(f"  {args.glossary}:{abbreviation.line}: {abbreviation.term}")
+        if undefined:
+            print("\nAbbreviations missing from the glossary:")
+            for term, uses in sorted(undefined.items(), key=lambda item: -len(item[1])):
+                print(f"  {term}: {uses[0].path}:{uses[0].line}:{uses[0].column} ({len(uses)} uses)")
+
+    print(f"\n{len(glossary)} glossary entries: {len(first_uses)} used, {len(unused)} unused, "
+          f"{len(undefined)} undefined abbreviations")
+
+    if args.filter_data:
+        write_filter_data(args.filter_data, filter_data(glossary, first_uses))
+        print(f"✓ Wrote filter data to {args.filter_data}")
+
+    if args.strict and (unused or undefined):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Batch application of accepted corrections.
+
+A correction is (target text, replacement, source location):
+
+    {"file": "src/Introduction.qmd", "line": 15, "target": "повышением заболевания",
+     "replacement": "повышением риска"}
+
+Corrections come from a JSON/JSONL list or straight from a reviewer report
+(corrections/autocorrection.md, auto_correction.md): lines with
+"old" → "new" under a heading naming the .qmd file, with an optional
+"Строка N" line hint. Lines marked ✅ report edits already made and are
+skipped, so re-running a report is a no-op.
+
+Each file is read once and all its targets are found in a single
+Aho–Corasick pass; the edits are then applied by position in one pass, so
+many edits in one file cost O(n) rather than O(n·k). When a target occurs
+more than once, the occurrence nearest to the line hint is used; without a
+hint it is ambiguous, and a short one-word target ("их") is not located
+without a hint at all, even when it occurs once. A target that no longer
+occurs outside its replacement ("риска" → "риска развития") while the
+replacement does is taken as already applied. Targets
+that no longer occur, ambiguous targets and edits overlapping another edit
+are reported and not applied. Files are
+written atomically; a unified diff of every change is printed.
+
+Usage:
+    python scripts/apply_corrections.py auto_correction.md --dry-run
+    python scripts/apply_corrections.py corrections.json
+"""
+
+import difflib
+import json
+import os
+import re
+import sys
+from bisect import bisect_right
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from abbreviations import AhoCorasick, is_boundary
+from quarto_project import QUARTO_CONFIG
+
+# "old" → "new" (also «old» → «new»)
+REPORT_EDIT_PATTERN = re.compile(r'["«]([^"»]+)["»]\s*(?:→|->)\s*["«]([^"»]*)["»]')
+REPORT_LINE_PATTERN = re.compile(r"Строк[аи]\s+(\d+)")
+REPORT_FILE_PATTERN = re.compile(r"([\w./-]+\.qmd)")
+REPORT_DONE_MARK = "✅"
+# A hint is trusted when the occurrence is within this many lines of it
+LINE_HINT_TOLERANCE = 3
+# Without a line hint a one-word target must be at least this long
+MIN_UNHINTED_LENGTH = 12
+
+
+class Correction(NamedTuple):
+    file: str
+    target: str
+    replacement: str
+    line: Optional[int] = None
+    origin: str = ""
+    # Marked as already made in its report
+    done: bool = False
+
+    def __str__(self):
+        location = f"{self.file}:{self.line}" if self.line else self.file
+        return f'{location}: "{self.target}" → "{self.replacement}"'
+
+
+class Rejected(NamedTuple):
+    correction: Correction
+    reason: str
+
+
+def resolve_file(name: str, base: str = ".") -> Optional[str]:
+    """Map a file name from a report to a project path (reports often omit src/...)"""
+    if Path(base, name).is_file():
+        return Path(name).as_posix()
+    candidates = sorted(Path(base, "src").rglob(Path(name).name))
+    if len(candidates) == 1:
+        return candidates[0].relative_to(base).as_posix()
+    return None
+
+
+def parse_report(path) -> List[Correction]:
+    """Extract "old" → "new" corrections from a markdown reviewer report"""
+    corrections = []
+    current_file = None
+    file_level = 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if line.startswith("#"):
+                # Subheadings ("#### Грамматические ошибки") stay in the file's section
+                level = len(line) - len(line.lstrip("#"))
+                match = REPORT_FILE_PATTERN.search(line)
+                if match:
+                    current_file, file_level = match.group(1), level
+                elif level <= file_level:
+                    current_file = None
+                continue
+            if current_file is None:
+                continue
+            hint = REPORT_LINE_PATTERN.search(line)
+            done = line.lstrip().startswith(REPORT_DONE_MARK)
+            for match in REPORT_EDIT_PATTERN.finditer(line):
+                corrections.append(Correction(
+                    current_file, match.group(1), match.group(2),
+                    int(hint.group(1)) if hint else None, f"{path}:{line_number}", done,
+                ))
+    return corrections
+
+
+def load_corrections(path) -> List[Correction]:
+    """Read corrections from JSON (a list), JSONL or a markdown report"""
+    path = Path(path)
+    if path.suffix == ".md":
+        return parse_report(path)
+    with open(path, "r", encoding="utf-8") as f:
+        if path.suffix == ".jsonl":
+            items = [json.loads(line) for line in f if line.strip()]
+        else:
+            items = json.load(f)
+    return [
+        Correction(item["file"], item["target"], item["replacement"], item.get("line"), f"{path}:{index}")
+        for index, item in enumerate(items, 1)
+    ]
+
+
+def line_starts(text: str) -> List[int]:
+    """Offsets at which each line of text starts"""
+    return [0] + [match.end() for match in re.finditer("\n", text)]
+
+
+def offset_to_line(starts: List[int], offset: int) -> int:
+    return bisect_right(starts, offset)
+
+
+def is_short(target: str) -> bool:
+    """A target too short to be located without a line hint"""
+    return len(target.split()) < 2 and len(target) < MIN_UNHINTED_LENGTH
+
+
+def plan_edits(
+    text: str, corrections: List[Correction]
+) -> Tuple[List[Tuple[int, int, Correction]], List[Rejected], List[Correction]]:
+    """Locate the corrections of one file, return (non-overlapping spans, rejected, already applied)"""
+    occurrences: Dict[str, List[int]] = defaultdict(list)
+    patterns = {c.target for c in corrections} | {c.replacement for c in corrections if c.replacement}
+    for start, target in AhoCorasick(patterns).iter_matches(text):
+        # Whole words only: "их" must not match inside "них"
+        if (not target[0].isalnum() or is_boundary(text, start - 1)) and (
+            not target[-1].isalnum() or is_boundary(text, start + len(target))
+        ):
+            occurrences[target].append(start)
+    starts = line_starts(text)
+
+    spans = []
+    rejected = []
+    applied = []
+    for correction in corrections:
+        # An occurrence inside the replacement ("риска" in "риска развития")
+        # is the edit already made, not a target to replace again
+        replaced = occurrences.get(correction.replacement, [])
+        found = [
+            s for s in occurrences.get(correction.target, [])
+            if not any(r <= s and s + len(correction.target) <= r + len(correction.replacement) for r in replaced)
+        ]
+        if not found:
+            if replaced and (not correction.line or any(
+                abs(offset_to_line(starts, s) - correction.line) <= LINE_HINT_TOLERANCE for s in replaced
+            )):
+                applied.append(correction)
+            else:
+                rejected.append(Rejected(correction, "target not found (text changed)"))
+            continue
+        if not correction.line and is_short(correction.target):
+            rejected.append(Rejected(correction, "target too short to locate without a line hint"))
+            continue
+        if correction.line:
+            distance, start = min((abs(offset_to_line(starts, s) - correction.line), s) for s in found)
+            if len(found) > 1 and distance > LINE_HINT_TOLERANCE:
+                rejected.append(Rejected(correction, f"{len(found)} occurrences, none near line {correction.line}"))
+                continue
+        elif len(found) > 1:
+            lines = ", ".join(str(offset_to_line(starts, s)) for s in found[:5])
+            rejected.append(Rejected(correction, f"ambiguous: {len(found)} occurrences (lines {lines})"))
+            continue
+        else:
+            start = found[0]
+        spans.append((start, start + len(correction.target), correction))
+
+    # Overlapping edits conflict: none of a cluster of overlapping edits is
+    # applied, unless they are all the same edit
+    spans.sort(key=lambda span: (span[0], span[1]))
+    clusters: List[List[Tuple[int, int, Correction]]] = []
+    for span in spans:
+        if clusters and span[0] < max(end for _, end, _ in clusters[-1]):
+            clusters[-1].append(span)
+        else:
+            clusters.append([span])
+
+    accepted = []
+    for cluster in clusters:
+        if len({(start, end, c.replacement) for start, end, c in cluster}) == 1:
+            accepted.append(cluster[0])
+            continue
+        line = offset_to_line(starts, cluster[0][0])
+        for _, _, correction in cluster:
+            others = "; ".join(str(c) for _, _, c in cluster if c is not correction)
+            rejected.append(Rejected(correction, f"conflicts at line {line} with {others}"))
+    return accepted, rejected, applied
+
+
+def apply_edits(text: str, spans: List[Tuple[int, int, Correction]]) -> str:
+    """Apply sorted, non-overlapping spans in one pass"""
+    parts = []
+    position = 0
+    for start, end, correction in spans:
+        parts.append(text[position:start])
+        parts.append(correction.replacement)
+        position = end
+    parts.append(text[position:])
+    return "".join(parts)
+
+
+def write_atomic(path, text: str):
+    """Replace the file content atomically, keeping its permissions"""
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}")
+    with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+        f.write(text)
+    os.chmod(tmp_path, path.stat().st_mode)
+    os.replace(tmp_path, path)
+
+
+def apply_corrections(corrections: List[Correction], dry_run: bool = False, diff: bool = True):
+    """Apply corrections file by file, return (applied count, rejected, already applied)"""
+    by_file: Dict[str, List[Correction]] = defaultdict(list)
+    rejected = []
+    already_applied = [correction for correction in corrections if correction.done]
+    for correction in corrections:
+        if correction.done:
+            continue
+        path = resolve_file(correction.file)
+        if path is None:
+            rejected.append(Rejected(correction, "file not found"))
+        else:
+            by_file[path].append(correction._replace(file=path))
+
+    applied = 0
+    for path, file_corrections in sorted(by_file.items()):
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            text = f.read()
+        spans, file_rejected, file_applied = plan_edits(text, file_corrections)
+        rejected += file_rejected
+        already_applied += file_applied
+        if not spans:
+            continue
+        new_text = apply_edits(text, spans)
+        if diff:
+            sys.stdout.writelines(difflib.unified_diff(
+                text.splitlines(keepends=True), new_text.splitlines(keepends=True),
+                fromfile=f"a/{path}", tofile=f"b/{path}",
+            ))
+        if not dry_run:
+            write_atomic(path, new_text)
+        applied += len(spans)
+    return applied, rejected, already_applied
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Apply accepted corrections to the chapter sources")
+    parser.add_argument("corrections", nargs="+", help="Corrections (.json, .jsonl) or reviewer reports (.md)")
+    parser.add_argument("--dry-run", action="store_true", help="Only show the diff, do not write files")
+    parser.add_argument("--no-diff", action="store_true", help="Do not print the unified diff")
+    args = parser.parse_args()
+
+    if not Path(QUARTO_CONFIG).exists():
+        print(f"Error: {QUARTO_CONFIG} not found. Please run from project root.")
+        sys.exit(1)
+
+    corrections = []
+    for source in args.corrections:
+        corrections += load_corrections(source)
+
+    applied, rejected, already_applied = apply_corrections(
+        corrections, dry_run=args.dry_run, diff=not args.no_diff
+    )
+    for item in rejected:
+        origin = f" [{item.correction.origin}]" if item.correction.origin else ""
+        print(f"❌ {item.correction}: {item.reason}{origin}")
+    verb = "Would apply" if args.dry_run else "Applied"
+    print(f"\n✓ {verb} {applied} of {len(corrections)} corrections, "
+          f"{len(already_applied)} already applied, {len(rejected)} not applied")
+    if rejected:
+        sys.exit(1)
@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+Per-chapter build manifest driven by content hashes.
+
+For every chapter listed in _quarto.yml the manifest records hashes of:
+- the chapter source (.qmd/.md)
+- every image it references (generated exports are tracked through their
+  annotation SVG sources, so re-exporting does not mark chapters dirty)
+- the subset of references.bib entries it cites
+and the labels it defines / references. Shared inputs (_quarto.yml without the
+machine-specific filters, CSL, reference doc, styles/) are hashed once.
+
+A chapter is dirty when its fingerprint changed, its output is missing, or it
+references a label whose defining chapter changed. Any change in shared inputs
+makes the whole book dirty.
+
+Usage:
+    python scripts/build_manifest.py status
+    python scripts/build_manifest.py render            # quarto render <dirty files>
+    python scripts/build_manifest.py restore --cache-dir .ci-cache
+    python scripts/build_manifest.py save --cache-dir .ci-cache
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from config import load_config, Settings
+from image_cache import hash_file, linked_images
+from quarto_project import QUARTO_CONFIG, get_chapters, load_quarto_config
+
+MANIFEST_VERSION = 1
+MANIFEST_NAME = "build-manifest.json"
+QUARTO_STATE_DIR = ".quarto"
+
+IMAGE_REF_PATTERN = re.compile(r'!\[[^\]]*\]\(\s*<?([^)\s>]+)|\bsrc="([^"]+)"')
+LABEL_DEF_PATTERN = re.compile(r"\{#((?:fig|tbl|sec|eq)-[\w-]+)")
+CROSSREF_PATTERN = re.compile(r"@((?:fig|tbl|sec|eq)-[\w-]*\w)")
+CITATION_PATTERN = re.compile(r"(?<![\w.@])@([A-Za-z_][\w:.#$%&+?<>~/-]*)")
+BIB_ENTRY_PATTERN = re.compile(r"^@\w+\s*\{\s*([^,\s]+)\s*,", re.MULTILINE)
+CROSSREF_PREFIXES = ("fig-", "tbl-", "sec-", "eq-")
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_input(path: Path) -> str:
+    """Hash file contents, 'missing' for absent files"""
+    return hash_file(path) if path.is_file() else "missing"
+
+
+def hash_json(value: Any) -> str:
+    return hash_bytes(json.dumps(value, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+
+
+def parse_bib_entries(bib_text: str) -> Dict[str, str]:
+    """Split a BibTeX file into raw entry text keyed by citation key"""
+    entries = {}
+    matches = list(BIB_ENTRY_PATTERN.finditer(bib_text))
+    for index, match in enumerate(matches):
+        end = matches[index + 1].start() if index + 1 < len(matches) else len(bib_text)
+        entries[match.group(1)] = bib_text[match.start():end].strip()
+    return entries
+
+
+def extract_image_refs(text: str) -> List[str]:
+    """Return image paths referenced from markdown image syntax or src attributes"""
+    refs = []
+    for match in IMAGE_REF_PATTERN.finditer(text):
+        ref = (match.group(1) or match.group(2)).split("#")[0].split("?")[0]
+        if ref and "://" not in ref and not ref.startswith("data:"):
+            refs.append(ref)
+    return refs
+
+
+def extract_labels(text: str) -> Set[str]:
+    return set(LABEL_DEF_PATTERN.findall(text))
+
+
+def extract_crossrefs(text: str) -> Set[str]:
+    return set(CROSSREF_PATTERN.findall(text))
+
+
+def extract_citations(text: str) -> Set[str]:
+    keys = set()
+    for key in CITATION_PATTERN.findall(text):
+        key = key.rstrip(".:;,")
+        if key and not key.startswith(CROSSREF_PREFIXES):
+            keys.add(key)
+    return keys
+
+
+def resolve_image_path(ref: str, chapter: str) -> Path:
+    """Resolve an image reference to a project-relative path"""
+    if ref.startswith("/"):
+        return Path(ref.lstrip("/"))
+    return Path(os.path.normpath(Path(chapter).parent / ref))
+
+
+def is_generated_image(path: Path, config: Settings) -> bool:
+    """Check whether an image is produced by prepare_images.py"""
+    stem = path.stem
+    return (
+        stem.endswith(f"_{config.processing.annotated_suffix}")
+        or f"_{config.processing.styled_postfix}" in stem
+    )
+
+
+def image_input_hashes(path: Path, config: Settings) -> Dict[str, str]:
+    """Hash the inputs an image depends on
+
+    Exports depend on the annotation sources of their directory and on every
+    raster those link to, wherever it lives (../staging/tables/image34.png).
+    """
+    if not is_generated_image(path, config) or not path.parent.is_dir():
+        return {path.as_posix(): hash_input(path)}
+
+    patterns = config.processing.annotation_patterns
+    styled = config.processing.styled_postfix
+    nsmap = config.get_nsmap()
+    hashes = {}
+    for source in sorted(path.parent.iterdir()):
+        if (
+            source.suffix == ".svg"
+            and any(pattern in source.name for pattern in patterns)
+            and styled not in source.name
+        ):
+            hashes[source.as_posix()] = hash_input(source)
+            for linked in linked_images(str(source), nsmap):
+                linked = Path(os.path.relpath(linked))
+                hashes[linked.as_posix()] = hash_input(linked)
+    return hashes
+
+
+def shared_inputs_hash(quarto_config: Dict[str, Any]) -> str:
+    """Hash inputs shared by every chapter"""
+    # setup_crossref.py rewrites filters per machine, so only the project's
+    # own (Lua) filter files are hashed
+    portable_config = {key: value for key, value in quarto_config.items() if key != "filters"}
+    parts = {QUARTO_CONFIG: hash_json(portable_config)}
+
+    extra_files = [quarto_config.get("csl")]
+    extra_files += [
+        f for f in quarto_config.get("filters") or []
+        if isinstance(f, str) and not os.path.isabs(f)
+    ]
+    docx = (quarto_config.get("format") or {}).get("docx") or {}
+    extra_files.append(docx.get("reference-doc"))
+    for name in filter(None, extra_files):
+        parts[name] = hash_input(Path(name))
+
+    styles_dir = Path("styles")
+    if styles_dir.is_dir():
+        for style_file in sorted(styles_dir.rglob("*")):
+            if style_file.is_file():
+                parts[style_file.as_posix()] = hash_input(style_file)
+
+    return hash_json(parts)
+
+
+def chapter_record(
+    chapter: str, bib_entries: Dict[str, str], config: Settings
+) -> Dict[str, Any]:
+    """Compute the manifest record of a single chapter"""
+    path = Path(chapter)
+    text = path.read_text(encoding="utf-8") if path.is_file() else ""
+
+    images: Dict[str, str] = {}
+    for ref in extract_image_refs(text):
+        images.update(image_input_hashes(resolve_image_path(ref, chapter), config))
+
+    cited = sorted(extract_citations(text) & bib_entries.keys())
+    bibliography = hash_json([bib_entries[key] for key in cited])
+
+    record = {
+        "source": hash_input(path),
+        "images": dict(sorted(images.items())),
+        "bibliography": bibliography,
+        "labels": sorted(extract_labels(text)),
+        "refs": sorted(extract_crossrefs(text)),
+    }
+    record["fingerprint"] = hash_json(
+        [record["source"], record["images"], record["bibliography"]]
+    )
+    return record
+
+
+def compute_manifest(config: Optional[Settings] = None) -> Dict[str, Any]:
+    """Compute the manifest for the current state of the project"""
+    config = config or load_config()
+    quarto_config = load_quarto_config()
+
+    bib_entries: Dict[str, str] = {}
+    bibliography = quarto_config.get("bibliography")
+    bib_files = bibliography if isinstance(bibliography, list) else [bibliography]
+    for bib_file in filter(None, bib_files):
+        if Path(bib_file).is_file():
+            bib_entries.update(parse_bib_entries(Path(bib_file).read_text(encoding="utf-8")))
+
+    return {
+        "version": MANIFEST_VERSION,
+        "shared": shared_inputs_hash(quarto_config),
+        "chapters": {
+            chapter: chapter_record(chapter, bib_entries, config)
+            for chapter in get_chapters(quarto_config)
+        },
+    }
+
+
+def manifest_path(config: Optional[Settings] = None) -> Path:
+    config = config or load_config()
+    return Path(config.cache.cache_dir) / MANIFEST_NAME
+
+
+def load_manifest(path: Path) -> Optional[Dict[str, Any]]:
+    if not path.exists():
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Warning: Ignoring unreadable manifest {path}: {e}")
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def save_manifest(manifest: Dict[str, Any], path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def chapter_output_path(chapter: str, output_dir: str) -> Path:
+    return Path(output_dir) / Path(chapter).with_suffix(".html")
+
+
+def find_dirty_chapters(
+    current: Dict[str, Any],
+    previous: Optional[Dict[str, Any]],
+    output_dir: Optional[str] = None,
+) -> Dict[str, str]:
+    """Return dirty chapters mapped to the reason they need rendering"""
+    chapters = current["chapters"]
+    if previous is None:
+        return {chapter: "no previous manifest" for chapter in chapters}
+    if previous.get("shared") != current["shared"]:
+        return {chapter: "shared inputs changed" for chapter in chapters}
+
+    old_chapters = previous.get("chapters", {})
+    dirty: Dict[str, str] = {}
+    changed_labels: Set[str] = set()
+
+    for chapter, record in chapters.items():
+        old = old_chapters.get(chapter)
+        if old is None:
+            dirty[chapter] = "new chapter"
+        elif old.get("fingerprint") != record["fingerprint"]:
+            dirty[chapter] = "content changed"
+        elif output_dir and not chapter_output_path(chapter, output_dir).exists():
+            dirty[chapter] = "output missing"
+        else:
+            continue
+        old_labels = set(old.get("labels", [])) if old else set()
+        changed_labels |= old_labels ^ set(record["labels"])
+
+    # Labels that were added, removed or moved must be re-resolved by referrers
+    for chapter in list(old_chapters.keys() - chapters.keys()):
+        changed_labels |= set(old_chapters[chapter].get("labels", []))
+
+    if changed_labels:
+        for chapter, record in chapters.items():
+            if chapter not in dirty and changed_labels.intersection(record["refs"]):
+                dirty[chapter] = "references changed labels"
+
+    return dirty
+
+
+def render(files: Optional[List[str]], quarto: str = "quarto") -> int:
+    """Run quarto render for the given files (None renders the whole book)"""
+    args = [quarto, "render"] + (files or [])
+    print(" ".join(args))
+    return subprocess.call(args)
+
+
+def copy_entries(names: Iterable[str], source_dir: Path, dest_dir: Path):
+    """Copy files/directories by name from source_dir to dest_dir"""
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    for name in names:
+        source = source_dir / name
+        dest = dest_dir / name
+        if source.is_dir():
+            shutil.copytree(source, dest, dirs_exist_ok=True)
+        elif source.is_file():
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(source, dest)
+        else:
+            continue
+        print(f"✓ Copied {source} to {dest}")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Content-hash build manifest for the book")
+    parser.add_argument(
+        "command",
+        choices=["status", "render", "update", "save", "restore"],
+        help="status: list dirty chapters; render: render dirty chapters and update "
+             "the manifest; update: record current state; save/restore: CI cache",
+    )
+    parser.add_argument("--cache-dir", default=None, help="CI cache directory for save/restore")
+    parser.add_argument("--quarto", default="quarto", help="Quarto executable")
+    parser.add_argument("--config", default="config.toml", help="Configuration TOML file name")
+    args = parser.parse_args()
+
+    if not Path(QUARTO_CONFIG).exists():
+        print(f"Error: {QUARTO_CONFIG} not found. Please run from project root.")
+        sys.exit(1)
+
+    config = load_config(args.config)
+    path = manifest_path(config)
+    output_dir = (load_quarto_config().get("project") or {}).get("output-dir", "_book")
+
+    if args.command in ("save", "restore"):
+        if not args.cache_dir:
+            parser.error(f"{args.command} requires --cache-dir")
+        cache_dir = Path(args.cache_dir)
+        # Partial renders need the previous outputs and Quarto's xref state
+        build_state = [output_dir, QUARTO_STATE_DIR]
+        if args.command == "save":
+            copy_entries([MANIFEST_NAME], path.parent, cache_dir)
+            copy_entries(build_state, Path("."), cache_dir)
+        else:
+            copy_entries([MANIFEST_NAME], cache_dir, path.parent)
+            copy_entries(build_state, cache_dir, Path("."))
+        return
+
+    current = compute_manifest(config)
+    previous = load_manifest(path)
+    dirty = find_dirty_chapters(current, previous, output_dir)
+
+    if args.command == "update":
+        save_manifest(current, path)
+        print(f"✓ Manifest updated: {path}")
+        return
+
+    if args.command == "status":
+        if not dirty:
+            print("All chapters are up to date")
+        for chapter, reason in dirty.items():
+            print(f"{chapter}: {reason}")
+        return
+
+    if not dirty:
+        print("All chapters are up to date, nothing to render")
+        return
+
+    full_render = len(dirty) == len(current["chapters"])
+    print(f"Rendering {'all' if full_render else len(dirty)} of {len(current['chapters'])} chapters")
+    for chapter, reason in dirty.items():
+        print(f"  {chapter}: {reason}")
+
+    returncode = render(None if full_render else list(dirty), quarto=args.quarto)
+    if returncode != 0:
+        print(f"❌ quarto render failed with return code: {returncode}")
+        sys.exit(returncode)
+
+    # The render may have regenerated inputs (setup_crossref, exports): re-hash
+    save_manifest(compute_manifest(config), path)
+    print(f"✓ Manifest updated: {path}")
+
+
+if __name__ == "__main__":
+    main()
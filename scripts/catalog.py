@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+"""
+SQLite catalog of the book's assets (<cache_dir>/catalog.sqlite).
+
+The catalog records, for every tracked file, its size, mtime and hash, plus
+facts extracted from it:
+- images: pixel dimensions
+- annotation SVGs: element ids, tags and the layer they belong to, linked rasters
+- chapters: referenced images, defined labels, cross-references, citations
+- bibliography: citation keys
+- build outputs recorded by prepare_images.py (output_manifest.py), with the
+  hashes their inputs had at export time
+
+update() only re-reads files whose size or mtime changed, so lookups after
+an update cost an indexed query instead of a rescan of the tree.
+
+Usage:
+    python scripts/catalog.py update
+    python scripts/catalog.py uses img/anatomy/fig1/image1_annotated.png
+    python scripts/catalog.py stale
+    python scripts/catalog.py element image1
+    python scripts/catalog.py cites smith2020
+    python scripts/catalog.py stats
+"""
+
+import os
+import sqlite3
+import sys
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from lxml import etree
+from PIL import Image
+
+from build_manifest import (
+    BIB_ENTRY_PATTERN,
+    extract_citations,
+    extract_crossrefs,
+    extract_image_refs,
+    extract_labels,
+    resolve_image_path,
+)
+from config import load_config, Settings
+from discovery import AnnotationMatcher, make_discovery_index
+from image_cache import hash_file, linked_images
+from output_manifest import load_inputs, load_outputs, output_manifest_path
+from quarto_project import QUARTO_CONFIG, get_chapters, load_quarto_config
+
+CATALOG_FILE = "catalog.sqlite"
+SCHEMA_VERSION = 2
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".gif", ".webp", ".tif", ".tiff", ".bmp"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_kind ON files(kind);
+CREATE TABLE IF NOT EXISTS image_sizes (
+    path TEXT PRIMARY KEY REFERENCES files(path) ON DELETE CASCADE,
+    width INTEGER,
+    height INTEGER
+);
+CREATE TABLE IF NOT EXISTS svg_elements (
+    svg TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+    element_id TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    layer TEXT
+);
+CREATE INDEX IF NOT EXISTS svg_elements_svg ON svg_elements(svg);
+CREATE INDEX IF NOT EXISTS svg_elements_id ON svg_elements(element_id);
+CREATE INDEX IF NOT EXISTS svg_elements_layer ON svg_elements(layer);
+CREATE TABLE IF NOT EXISTS svg_links (
+    svg TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+    image TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS svg_links_svg ON svg_links(svg);
+CREATE INDEX IF NOT EXISTS svg_links_image ON svg_links(image);
+CREATE TABLE IF NOT EXISTS chapter_images (
+    chapter TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+    image TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chapter_images_chapter ON chapter_images(chapter);
+CREATE INDEX IF NOT EXISTS chapter_images_image ON chapter_images(image);
+CREATE TABLE IF NOT EXISTS chapter_labels (
+    chapter TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+    label TEXT NOT NULL,
+    is_definition INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chapter_labels_chapter ON chapter_labels(chapter);
+CREATE INDEX IF NOT EXISTS chapter_labels_label ON chapter_labels(label);
+CREATE TABLE IF NOT EXISTS citations (
+    chapter TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+    key TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS citations_chapter ON citations(chapter);
+CREATE INDEX IF NOT EXISTS citations_key ON citations(key);
+CREATE TABLE IF NOT EXISTS bib_entries (
+    bib TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+    key TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS bib_entries_bib ON bib_entries(bib);
+CREATE INDEX IF NOT EXISTS bib_entries_key ON bib_entries(key);
+CREATE TABLE IF NOT EXISTS outputs (
+    source TEXT NOT NULL,
+    output TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outputs_source ON outputs(source);
+CREATE INDEX IF NOT EXISTS outputs_output ON outputs(output);
+CREATE TABLE IF NOT EXISTS output_inputs (
+    source TEXT NOT NULL,
+    input TEXT NOT NULL,
+    sha256 TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS output_inputs_source ON output_inputs(source);
+"""
+
+
+def svg_elements(svg_path, nsmap: Dict[str, str]) -> List[Tuple[str, str, Optional[str]]]:
+    """Return (id, tag, layer label) of every element with an id"""
+    label_attr = f"{{{nsmap['inkscape']}}}label"
+    groupmode_attr = f"{{{nsmap['inkscape']}}}groupmode"
+    elements = []
+    layers: List[Optional[str]] = []
+    for event, element in etree.iterparse(svg_path, events=("start", "end"), huge_tree=True):
+        if event == "end":
+            layers.pop()
+            element.clear(keep_tail=True)
+            continue
+        layer = layers[-1] if layers else None
+        if element.get(groupmode_attr) == "layer":
+            layer = element.get(label_attr) or element.get("id")
+        layers.append(layer)
+        element_id = element.get("id")
+        if element_id and isinstance(element.tag, str):
+            elements.append((element_id, etree.QName(element).localname, layer))
+    return elements
+
+
+def project_path(path: str) -> str:
+    """Normalise a path (or a site-absolute /img/... reference) to project-relative POSIX"""
+    if path.startswith("/") and not os.path.exists(path):
+        path = path.lstrip("/")
+    return Path(os.path.relpath(path)).as_posix()
+
+
+def image_size(path) -> Tuple[Optional[int], Optional[int]]:
+    try:
+        with Image.open(path) as image:
+            return image.size
+    except (OSError, SyntaxError):
+        return None, None
+
+
+class Catalog:
+    """Incrementally updated SQLite catalog of project assets"""
+
+    def __init__(self, db_path, config: Optional[Settings] = None):
+        self.db_path = Path(db_path)
+        self.config = config or load_config()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.db_path)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self.reset()
+
+    def reset(self):
+        """Drop all tables and recreate the schema"""
+        tables = [
+            row[0] for row in self.connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            )
+        ]
+        with self.connection:
+            for table in tables:
+                self.connection.execute(f"DROP TABLE IF EXISTS {table}")
+            self.connection.executescript(SCHEMA)
+            self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Update
+
+    def tracked_files(self) -> Dict[str, str]:
+        """Return {project-relative path: kind} of the files to catalog"""
+        quarto_config = load_quarto_config()
+        files = {chapter: "chapter" for chapter in get_chapters(quarto_config)}
+
+        bibliography = quarto_config.get("bibliography")
+        for bib_file in bibliography if isinstance(bibliography, list) else [bibliography]:
+            if bib_file:
+                files[bib_file] = "bib"
+
+        image_folder = self.config.processing.default_folder
+        matcher = AnnotationMatcher.from_config(self.config)
+        index = make_discovery_index(self.config)
+        for relative_path in index.scan(image_folder):
+            path = Path(os.path.relpath(os.path.join(image_folder, relative_path))).as_posix()
+            if matcher.match(relative_path)[0]:
+                files[path] = "annotation"
+            elif Path(path).suffix.lower() == ".svg":
+                files[path] = "svg"
+            elif Path(path).suffix.lower() in IMAGE_SUFFIXES:
+                files[path] = "image"
+        return files
+
+    def update(self) -> Dict[str, int]:
+        """Bring the catalog up to date, return counts of changed/removed files"""
+        tracked = self.tracked_files()
+        known = {
+            path: (size, mtime_ns)
+            for path, size, mtime_ns in self.connection.execute(
+                "SELECT path, size, mtime_ns FROM files"
+            )
+        }
+        changed = 0
+        with self.connection:
+            for path in known.keys() - tracked.keys():
+                self.connection.execute("DELETE FROM files WHERE path = ?", (path,))
+
+            for path, kind in tracked.items():
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    if path in known:
+                        self.connection.execute("DELETE FROM files WHERE path = ?", (path,))
+                    continue
+                if known.get(path) == (stat.st_size, stat.st_mtime_ns):
+                    continue
+                self.index_file(path, kind, stat)
+                changed += 1
+
+            manifest_path = output_manifest_path(self.config)
+            self.connection.execute("DELETE FROM outputs")
+            self.connection.executemany(
+                "INSERT INTO outputs (source, output) VALUES (?, ?)",
+                [
+                    (source, output)
+                    for source, outputs in load_outputs(manifest_path).items()
+                    for output in outputs
+                ],
+            )
+            self.connection.execute("DELETE FROM output_inputs")
+            self.connection.executemany(
+                "INSERT INTO output_inputs (source, input, sha256) VALUES (?, ?, ?)",
+                [
+                    (source, input_path, sha256)
+                    for source, hashes in load_inputs(manifest_path).items()
+                    for input_path, sha256 in hashes.items()
+                ],
+            )
+        return {"tracked": len(tracked), "changed": changed,
+                "removed": len(known.keys() - tracked.keys())}
+
+    def index_file(self, path: str, kind: str, stat: os.stat_result):
+        """(Re)extract the facts of one file, replacing its previous rows"""
+        execute = self.connection.execute
+        execute("DELETE FROM files WHERE path = ?", (path,))
+        execute(
+            "INSERT INTO files (path, kind, size, mtime_ns, sha256) VALUES (?, ?, ?, ?, ?)",
+            (path, kind, stat.st_size, stat.st_mtime_ns, hash_file(path)),
+        )
+
+        if kind == "image":
+            execute(
+                "INSERT INTO image_sizes (path, width, height) VALUES (?, ?, ?)",
+                (path, *image_size(path)),
+            )
+        elif kind in ("annotation", "svg"):
+            try:
+                elements = svg_elements(path, self.config.get_nsmap())
+                links = linked_images(path, self.config.get_nsmap())
+            except etree.XMLSyntaxError as e:
+                print(f"Warning: cannot parse {path}: {e}")
+                elements, links = [], []
+            self.connection.executemany(
+                "INSERT INTO svg_elements (svg, element_id, tag, layer) VALUES (?, ?, ?, ?)",
+                [(path, *element) for element in elements],
+            )
+            self.connection.executemany(
+                "INSERT INTO svg_links (svg, image) VALUES (?, ?)",
+                [(path, project_path(link)) for link in links],
+            )
+        elif kind == "chapter":
+            text = Path(path).read_text(encoding="utf-8")
+            images = {resolve_image_path(ref, path).as_posix() for ref in extract_image_refs(text)}
+            self.connection.executemany(
+                "INSERT INTO chapter_images (chapter, image) VALUES (?, ?)",
+                [(path, image) for image in sorted(images)],
+            )
+            self.connection.executemany(
+                "INSERT INTO chapter_labels (chapter, label, is_definition) VALUES (?, ?, ?)",
+                [(path, label, 1) for label in sorted(extract_labels(text))]
+                + [(path, label, 0) for label in sorted(extract_crossrefs(text))],
+            )
+            self.connection.executemany(
+                "INSERT INTO citations (chapter, key) VALUES (?, ?)",
+                [(path, key) for key in sorted(extract_citations(text))],
+            )
+        elif kind == "bib":
+            text = Path(path).read_text(encoding="utf-8")
+            self.connection.executemany(
+                "INSERT INTO bib_entries (bib, key) VALUES (?, ?)",
+                [(path, key) for key in BIB_ENTRY_PATTERN.findall(text)],
+            )
+
+    # Queries
+
+    def files(self, kind: str) -> List[str]:
+        rows = self.connection.execute("SELECT path FROM files WHERE kind = ? ORDER BY path", (kind,))
+        return [row[0] for row in rows]
+
+    def images(self) -> List[Tuple[str, str, int, Optional[int], Optional[int]]]:
+        """Return (path, sha256, size, width, height) of every raster image"""
+        rows = self.connection.execute(
+            "SELECT f.path, f.sha256, f.size, s.width, s.height FROM files f "
+            "LEFT JOIN image_sizes s ON s.path = f.path WHERE f.kind = 'image' ORDER BY f.path"
+        )
+        return rows.fetchall()
+
+    def chapters_using_image(self, image: str) -> List[str]:
+        """Chapters that reference image (project-relative path)"""
+        rows = self.connection.execute(
+            "SELECT DISTINCT chapter FROM chapter_images WHERE image = ? ORDER BY chapter", (project_path(image),)
+        )
+        return [row[0] for row in rows]
+
+    def images_of_chapters(self, chapters: Iterable[str]) -> Set[str]:
+        chapters = [project_path(chapter) for chapter in chapters]
+        if not chapters:
+            return set()
+        rows = self.connection.execute(
+            f"SELECT image FROM chapter_images WHERE chapter IN ({','.join('?' * len(chapters))})",
+            chapters,
+        )
+        return {row[0] for row in rows}
+
+    def image_dirs_for_chapters(self, chapters: Iterable[str]) -> Set[str]:
+        """Directories holding the images referenced by the given chapters"""
+        return {Path(image).parent.as_posix() for image in self.images_of_chapters(chapters)}
+
+    def linked_images(self, svg: str) -> List[str]:
+        """Rasters linked from an SVG (project-relative paths)"""
+        rows = self.connection.execute(
+            "SELECT image FROM svg_links WHERE svg = ? ORDER BY image", (project_path(svg),)
+        )
+        return [row[0] for row in rows]
+
+    def changed_inputs(self, source: str) -> Optional[List[str]]:
+        """Inputs of source whose hash differs from the one recorded at export
+
+        None if no hashes were recorded (outputs written before inputs were
+        recorded). Hashes are compared rather than mtimes: outputs restored
+        from the image cache keep their old mtime.
+        """
+        rows = self.connection.execute(
+            "SELECT i.input, i.sha256, f.sha256 FROM output_inputs i "
+            "LEFT JOIN files f ON f.path = i.input WHERE i.source = ? ORDER BY i.input",
+            (source,),
+        ).fetchall()
+        if not rows:
+            return None
+        changed = []
+        for input_path, recorded, current in rows:
+            if current is None and os.path.isfile(input_path):
+                current = hash_file(input_path)
+            if current != recorded:
+                changed.append(input_path)
+        return changed
+
+    def stale_outputs(self) -> List[Tuple[str, str, str]]:
+        """Return (source, output, reason) for outputs missing or exported from other inputs"""
+        stale = []
+        rows = self.connection.execute(
+            "SELECT o.source, o.output, f.path FROM outputs o "
+            "LEFT JOIN files f ON f.path = o.source ORDER BY o.source, o.output"
+        )
+        reasons: Dict[str, Optional[str]] = {}
+        for source, output, known in rows:
+            if source not in reasons:
+                changed = self.changed_inputs(source)
+                if known is None and not os.path.isfile(source):
+                    reasons[source] = "source no longer exists"
+                elif changed is None:
+                    reasons[source] = "no input hashes recorded"
+                elif changed:
+                    reasons[source] = f"changed since export: {', '.join(changed)}"
+                else:
+                    reasons[source] = None
+            if reasons[source]:
+                stale.append((source, output, reasons[source]))
+            elif not os.path.exists(output):
+                stale.append((source, output, "output missing"))
+        return stale
+
+    def find_element(self, element_id: str) -> List[Tuple[str, str, Optional[str]]]:
+        """Return (svg, tag, layer) of elements with the given id"""
+        rows = self.connection.execute(
+            "SELECT svg, tag, layer FROM svg_elements WHERE element_id = ? ORDER BY svg",
+            (element_id,),
+        )
+        return rows.fetchall()
+
+    def citing_chapters(self, key: str) -> List[str]:
+        rows = self.connection.execute(
+            "SELECT DISTINCT chapter FROM citations WHERE key = ? ORDER BY chapter", (key,)
+        )
+        return [row[0] for row in rows]
+
+    def stats(self) -> Dict[str, int]:
+        counts = dict(self.connection.execute("SELECT kind, COUNT(*) FROM files GROUP BY kind"))
+        for table in ("svg_elements", "svg_links", "chapter_images", "citations", "bib_entries", "outputs"):
+            counts[table] = self.connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        return counts
+
+
+def catalog_path(config: Settings) -> Path:
+    return Path(config.cache.cache_dir) / CATALOG_FILE
+
+
+def open_catalog(config: Optional[Settings] = None, update: bool = True) -> Catalog:
+    """Open the project catalog, brought up to date unless update is False"""
+    config = config or load_config()
+    catalog = Catalog(catalog_path(config), config)
+    if update:
+        catalog.update()
+    return catalog
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Query the project asset catalog")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("update", help="Update the catalog and print counts")
+    uses = subparsers.add_parser("uses", help="Chapters that reference an image")
+    uses.add_argument("image")
+    subparsers.add_parser("stale", help="Build outputs missing or exported from other inputs")
+    element = subparsers.add_parser("element", help="SVG files defining an element id")
+    element.add_argument("element_id")
+    cites = subparsers.add_parser("cites", help="Chapters citing a bibliography key")
+    cites.add_argument("key")
+    subparsers.add_parser("stats", help="Number of catalogued files and facts")
+    parser.add_argument("--config", default="config.toml", help="Configuration TOML file name")
+    args = parser.parse_args()
+
+    if not Path(QUARTO_CONFIG).exists():
+        print(f"Error: {QUARTO_CONFIG} not found. Please run from project root.")
+        sys.exit(1)
+
+    config = load_config(args.config)
+    with Catalog(catalog_path(config), config) as catalog:
+        counts = catalog.update()
+        if args.command == "update":
+            print(f"✓ Catalog {catalog.db_path}: {counts['tracked']} files, "
+                  f"{counts['changed']} updated, {counts['removed']} removed")
+        elif args.command == "uses":
+            chapters = catalog.chapters_using_image(args.image)
+            print("\n".join(chapters) if chapters else f"No chapter references {args.image}")
+        elif args.command == "stale":
+            stale = catalog.stale_outputs()
+            for source, output, reason in stale:
+                print(f"{output}: {reason} ({source})")
+            print(f"{len(stale)} stale outputs")
+            if stale:
+                sys.exit(1)
+        elif args.command == "element":
+            for svg, tag, layer in catalog.find_element(args.element_id):
+                print(f"{svg}: <{tag}> in layer {layer or '-'}")
+        elif args.command == "cites":
+            chapters = catalog.citing_chapters(args.key)
+            print("\n".join(chapters) if chapters else f"No chapter cites {args.key}")
+        elif args.command == "stats":
+            for name, count in sorted(catalog.stats().items()):
+                print(f"{name}: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,119 @@
 #!/usr/bin/env python3
-import os
+"""
+Remove the files generated by the image pipeline.
+
+prepare_images.py records every file it writes (see output_manifest.py);
+this script deletes exactly those files in a single pass, without walking
+img/. Annotation sources, the rasters they link to (looked up in the
+catalog, see catalog.py) and files tracked by git are never deleted, even
+if recorded (with build_dir = "" an id-only export imageN.png could be
+recorded under the name of its source raster).
+"""
 import sys
 from pathlib import Path
 
-def clean_generated_files():
-    """Remove all generated styled SVG and PNG files from the source img directory"""
-    img_folder = Path('./img')
-    
-    if not img_folder.exists():
-        print(f"Image folder not found: {img_folder}")
+from catalog import open_catalog
+from config import load_config
+from discovery import AnnotationMatcher
+from output_manifest import load_inputs, load_outputs, output_manifest_path, save_outputs, tracked_files
+
+
+def remove_empty_dirs(directories, stop_at: Path):
+    """Remove directories left empty, walking up to (not including) stop_at"""
+    for directory in sorted(directories, key=lambda d: len(d.parts), reverse=True):
+        while directory != stop_at and stop_at in directory.parents:
+            try:
+                directory.rmdir()
+            except OSError:
+                break
+            directory = directory.parent
+
+
+def clean_generated_files(dry_run: bool = False):
+    """Remove all recorded outputs of the image pipeline"""
+    config = load_config()
+    manifest_path = output_manifest_path(config)
+    sources = load_outputs(manifest_path)
+    if not sources:
+        print(f"No generated files recorded in {manifest_path}")
         return
-    
-    patterns_to_remove = [
-        '*_styled.svg',
-        '*_styled.png',
-        '*with_context.png',
-        '*with_context.png',
-        'annotation_styled.png',
-        'annotation_mri_styled.png',
-        'annotation_ct_styled.png',
-        'annotatiom_mri_styled.png'
-    ]
-    
+
+    matcher = AnnotationMatcher.from_config(config)
+    image_root = Path(config.processing.default_folder).resolve()
+    # Trees that only hold generated files
+    generated_roots = [Path(config.export.profiles_dir).resolve()]
+    if config.build_dir:
+        generated_roots.append(Path(config.build_dir).resolve())
+    project_root = Path.cwd().resolve()
+    protected = set(tracked_files(project_root))
+    with open_catalog(config) as catalog:
+        for source in sources:
+            protected.update(Path(path).resolve() for path in catalog.linked_images(source))
+
     removed_count = 0
-    
-    # Find and remove generated files
-    for pattern in patterns_to_remove:
-        for file_path in img_folder.rglob(pattern):
-            try:
-                file_path.unlink()
-                print(f"Removed: {file_path}")
-                removed_count += 1
-            except Exception as e:
-                print(f"Error removing {file_path}: {e}")
-    
-    print(f"\n✓ Removed {removed_count} generated files from source directories")
+    touched_dirs = set()
+    # Outputs still on disk (skipped or not removable) stay recorded
+    remaining = {}
+    for source, outputs in sources.items():
+        for output in outputs:
+            path = Path(output).resolve()
+            if project_root not in path.parents:
+                print(f"Skipping path outside the project: {output}")
+                remaining.setdefault(source, []).append(output)
+                continue
+            if image_root in path.parents and matcher.match(path.relative_to(image_root).as_posix())[0]:
+                print(f"Skipping annotation source: {output}")
+                remaining.setdefault(source, []).append(output)
+                continue
+            if path in protected:
+                print(f"Skipping source file: {output}")
+                remaining.setdefault(source, []).append(output)
+                continue
+            if not path.exists():
+                continue
+            if dry_run:
+                print(f"Would remove: {output}")
+            else:
+                try:
+                    path.unlink()
+                    print(f"Removed: {output}")
+                except OSError as e:
+                    print(f"Error removing {output}: {e}")
+                    remaining.setdefault(source, []).append(output)
+                    continue
+                touched_dirs.add(path.parent)
+            removed_count += 1
+
+    if dry_run:
+        print(f"\n{removed_count} generated files would be removed")
+        return
+
+    for root in generated_roots:
+        remove_empty_dirs(
+            {d for d in touched_dirs if d == root or root in d.parents}, root.parent
+        )
+    inputs = load_inputs(manifest_path)
+    save_outputs(
+        manifest_path, remaining,
+        {source: hashes for source, hashes in inputs.items() if source in remaining},
+    )
+    print(f"\n✓ Removed {removed_count} generated files")
+    if remaining:
+        print(f"{sum(map(len, remaining.values()))} files kept in {manifest_path}")
+
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Remove files generated by prepare_images.py")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Only list the files that would be removed"
+    )
+    args = parser.parse_args()
+
     # Ensure we're in the project root
     if not Path('_quarto.yml').exists():
         print("Error: _quarto.yml not found. Please run this script from the project root directory.")
         sys.exit(1)
-    
-    clean_generated_files()
\ No newline at end of file
+
+    clean_generated_files(dry_run=args.dry_run)
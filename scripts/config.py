@@ -1,8 +1,10 @@
 """Configuration module for image processing using pydantic-settings"""
 
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Literal, Optional
 from pathlib import Path
-from pydantic import BaseModel, Field
+import os
+import re
+from pydantic import BaseModel, Field, field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 import tomli
 
@@ -12,6 +14,9 @@ class InkscapeConfig(BaseModel):
     executable: str = "inkscape"
     default_dpi: int = 300
     default_export_format: str = "png"
+    # Seconds before a hung export is killed, and how many times it is retried
+    timeout: float = 120
+    retries: int = 2
 
 
 class ProcessingConfig(BaseModel):
@@ -26,15 +31,75 @@ class ProcessingConfig(BaseModel):
         "annotation_anal_canal.svg"
          
     ])
+    # Globs on paths relative to default_folder, e.g. "anatomy/**"
+    include_globs: List[str] = Field(default_factory=list)
+    exclude_globs: List[str] = Field(default_factory=list)
     styled_postfix: str = "styled"
     annotated_suffix: str = "annotated"
     max_processes: int = 16
 
 
+class ExportProfile(BaseModel):
+    """Export target: raster resolution and output tree for one Quarto format"""
+    name: str
+    dpi: int
+    # Write to <profiles_dir>/<name>/ instead of next to the source SVG
+    separate_tree: bool = True
+
+
 class ExportConfig(BaseModel):
     """Export configuration"""
     export_with_context: bool = True
     export_id_only: bool = True
+    # "composite" (PNG): blend an overlay-only render over the render of the
+    # image alone instead of a full with-context render; "render": full render
+    context_mode: Literal["render", "composite"] = "composite"
+    profiles_dir: str = "_exports"
+    profiles: List[ExportProfile] = Field(default_factory=list)
+
+    @field_validator("profiles", mode="before")
+    @classmethod
+    def parse_profile_strings(cls, value):
+        """Accept the short "html@144dpi" form for profiles"""
+        profiles = []
+        for item in value or []:
+            if isinstance(item, str):
+                match = re.fullmatch(r"\s*([\w-]+)@(\d+)(?:dpi)?\s*", item)
+                if not match:
+                    raise ValueError(f"Invalid export profile {item!r}, expected name@DPIdpi")
+                item = {"name": match.group(1), "dpi": int(match.group(2))}
+            profiles.append(item)
+        return profiles
+
+
+class CacheConfig(BaseModel):
+    """Build cache configuration"""
+    cache_dir: str = ".cache"
+    image_cache: bool = True
+
+    def get_image_cache_dir(self) -> Optional[str]:
+        """Directory of the image export cache, None if disabled"""
+        if not self.image_cache:
+            return None
+        return str(Path(self.cache_dir) / "images")
+
+
+class BudgetConfig(BaseModel):
+    """Page-weight budgets of the rendered book (page_weight.py)"""
+    baseline: str = "build/page-weight-baseline.json"
+    # A page regresses when it grows by more than this share of its baseline weight
+    max_growth: float = 0.10
+    # Absolute limits in KB, 0 disables the check
+    max_page_kb: int = 0
+    max_asset_kb: int = 500
+    on_regression: Literal["warn", "fail"] = "warn"
+
+
+class DeepZoomConfig(BaseModel):
+    """Deep-zoom tile pyramids of the HTML book (deep_zoom.py)"""
+    # Besides figures marked .zoomable, tile every figure whose long side
+    # has at least this many pixels, 0 disables
+    min_size: int = 0
 
 
 class StyleConfig(BaseModel):
@@ -51,6 +116,13 @@ class Settings(BaseSettings):
     inkscape: InkscapeConfig = Field(default_factory=InkscapeConfig)
     processing: ProcessingConfig = Field(default_factory=ProcessingConfig)
     export: ExportConfig = Field(default_factory=ExportConfig)
+    cache: CacheConfig = Field(default_factory=CacheConfig)
+    budget: BudgetConfig = Field(default_factory=BudgetConfig)
+    deep_zoom: DeepZoomConfig = Field(default_factory=DeepZoomConfig)
+    # Directory receiving generated files, mirroring the project layout
+    # (img/a/annotation.svg -> <build_dir>/img/a/annotation_styled.svg).
+    # Empty: generated files are written next to their sources
+    build_dir: str = ""
     style_defaults: Dict[str, Dict[str, Any]] = Field(default_factory=dict)
     namespaces: Dict[str, str] = Field(default_factory=dict)
     
@@ -84,6 +156,19 @@ class Settings(BaseSettings):
         }
         return self.namespaces or default_namespaces
     
+    def get_output_dir(self, source_path) -> str:
+        """Directory receiving the files generated from source_path"""
+        source_dir = os.path.dirname(os.path.abspath(source_path))
+        if not self.build_dir:
+            return source_dir
+        return os.path.join(os.path.abspath(self.build_dir), os.path.relpath(source_dir))
+
+    def get_export_profiles(self) -> List[ExportProfile]:
+        """Get export profiles, a single default_dpi export next to the sources if none configured"""
+        if self.export.profiles:
+            return self.export.profiles
+        return [ExportProfile(name="default", dpi=self.inkscape.default_dpi, separate_tree=False)]
+
     def get_default_styles(self) -> Dict[str, Dict[str, Any]]:
         """Get default styles with fallback values"""
         if self.style_defaults:
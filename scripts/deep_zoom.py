@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Deep-zoom tile pyramids for high-resolution figures of the HTML book (post-render).
+
+Figures marked with the class zoomable (`![...](img.png){.zoomable}`, on
+the image or its figure) and every figure whose long side reaches min_size
+pixels ([deep_zoom] in styles/config.toml, or --min-size) get a DZI pyramid:
+
+    tiles/<hash>.dzi            descriptor (tile size, overlap, format, size)
+    tiles/<hash>_files/<level>/<column>_<row>.<jpg|png>
+    tiles/<hash>_preview.<jpg|png>
+
+<hash> is the content hash of the image, so pyramids are built once and
+reused from <cache_dir>/tiles across renders. Levels are built top-down,
+each one downsampled from the level above rather than from the original.
+
+The page then loads the preview (at most PREVIEW_SIZE px) instead of the
+full image; build/deep-zoom.js (copied to tiles/deep-zoom.js and added to
+the page) opens a pan/zoom viewer on click that fetches only the tiles in
+view at the level matching the zoom. Runs before fingerprint_assets.py.
+
+Usage (run by Quarto as post-render; standalone after quarto render):
+    python scripts/deep_zoom.py
+    python scripts/deep_zoom.py --min-size 2000
+"""
+
+import hashlib
+import math
+import os
+import re
+import shutil
+import sys
+from pathlib import Path, PurePosixPath
+from typing import Dict, Optional, Set
+from xml.sax.saxutils import quoteattr
+
+from lxml import html as lxml_html
+from PIL import Image
+
+from config import load_config
+from fingerprint_assets import resolve_reference
+from quarto_project import QUARTO_CONFIG, load_quarto_config, post_render_enabled
+
+TILES_DIR = "tiles"
+VIEWER_SOURCE = "build/deep-zoom.js"
+VIEWER_NAME = "deep-zoom.js"
+ZOOM_CLASS = "zoomable"
+TILE_SIZE = 254
+TILE_OVERLAP = 1
+PREVIEW_SIZE = 1024
+JPEG_QUALITY = 88
+HASH_LENGTH = 12
+IMAGE_TAG_PATTERN = re.compile(r"<img\b[^>]*>", re.IGNORECASE)
+SRC_PATTERN = re.compile(r"""\bsrc\s*=\s*(["'])(.*?)\1""", re.IGNORECASE)
+DZI_PATTERN = re.compile(r"""\bdata-dzi\s*=\s*["'](?:[^"']*/)?([0-9a-f]+)\.dzi["']""")
+
+
+def image_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    # Tiling parameters are part of the pyramid's identity
+    digest.update(f"{TILE_SIZE}/{TILE_OVERLAP}/{PREVIEW_SIZE}/{JPEG_QUALITY}".encode())
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+def build_pyramid(image_path: Path, target: Path, name: str) -> str:
+    """Write <name>.dzi, <name>_files/ and the preview into target; returns the preview file name"""
+    with Image.open(image_path) as source:
+        has_alpha = source.mode in ("RGBA", "LA", "PA") or "transparency" in source.info
+        image = source.convert("RGBA" if has_alpha else "RGB")
+    tile_format = "png" if has_alpha else "jpg"
+    save_options = {"optimize": True} if has_alpha else {"quality": JPEG_QUALITY, "optimize": True}
+
+    width, height = image.size
+    max_level = math.ceil(math.log2(max(width, height))) if max(width, height) > 1 else 0
+    files_dir = target / f"{name}_files"
+    preview = None
+    level_image = image
+    for level in range(max_level, -1, -1):
+        scale = 2 ** (max_level - level)
+        size = (max(1, math.ceil(width / scale)), max(1, math.ceil(height / scale)))
+        if level_image.size != size:
+            # Each level from the one above: a 2×2 box filter per step
+            level_image = level_image.resize(size, Image.Resampling.BOX)
+        level_dir = files_dir / str(level)
+        level_dir.mkdir(parents=True, exist_ok=True)
+        for column in range(math.ceil(size[0] / TILE_SIZE)):
+            for row in range(math.ceil(size[1] / TILE_SIZE)):
+                left = max(column * TILE_SIZE - TILE_OVERLAP, 0)
+                top = max(row * TILE_SIZE - TILE_OVERLAP, 0)
+                right = min((column + 1) * TILE_SIZE + TILE_OVERLAP, size[0])
+                bottom = min((row + 1) * TILE_SIZE + TILE_OVERLAP, size[1])
+                level_image.crop((left, top, right, bottom)).save(
+                    level_dir / f"{column}_{row}.{tile_format}", **save_options
+                )
+        if preview is None and max(size) <= PREVIEW_SIZE:
+            preview = f"{name}_preview.{tile_format}"
+            level_image.save(target / preview, **save_options)
+
+    (target / f"{name}.dzi").write_text(
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" '
+        f'TileSize="{TILE_SIZE}" Overlap="{TILE_OVERLAP}" Format="{tile_format}">'
+        f'<Size Width="{width}" Height="{height}"/></Image>\n',
+        encoding="utf-8",
+    )
+    return preview
+
+
+def cached_pyramid(image_path: Path, cache_dir: Path) -> Optional[str]:
+    """Content hash of the image, with its pyramid built into cache_dir if missing"""
+    name = image_hash(image_path)
+    if not (cache_dir / f"{name}.dzi").exists():
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_dir = cache_dir / f".tmp-{name}-{os.getpid()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir()
+        build_pyramid(image_path, tmp_dir, name)
+        for entry in sorted(tmp_dir.iterdir(), key=lambda p: p.suffix == ".dzi"):
+            # The descriptor last: its presence marks a complete pyramid
+            os.replace(entry, cache_dir / entry.name)
+        tmp_dir.rmdir()
+    return name
+
+
+def selected_sources(page: Path, min_size: int, output_dir: Path) -> Set[str]:
+    """src values of the page's images to tile"""
+    tree = lxml_html.parse(str(page), parser=lxml_html.HTMLParser(encoding="utf-8"))
+    relative_page = PurePosixPath(page.relative_to(output_dir).as_posix())
+    selected = set()
+    for element in tree.iter("img"):
+        src = element.get("src") or ""
+        if element.get("data-dzi") is not None or not src:
+            continue
+        marked = any(
+            ZOOM_CLASS in (ancestor.get("class") or "").split()
+            for ancestor in [element, *element.iterancestors()]
+        )
+        if not marked and not min_size:
+            continue
+        target = resolve_reference(src, relative_page)
+        if target is None or not (output_dir / target).is_file():
+            continue
+        if not marked:
+            try:
+                with Image.open(output_dir / target) as image:
+                    marked = max(image.size) >= min_size
+            except OSError:
+                continue
+        if marked:
+            selected.add(src)
+    return selected
+
+
+def tile_page(page: Path, output_dir: Path, cache_dir: Path, min_size: int, used: Set[str]) -> int:
+    """Point the selected images of a page at their previews and pyramids; returns their number"""
+    text = page.read_text(encoding="utf-8")
+    # Figures tiled by an earlier run keep their pyramids
+    used.update(DZI_PATTERN.findall(text))
+    sources = selected_sources(page, min_size, output_dir)
+    if not sources:
+        return 0
+    relative_page = PurePosixPath(page.relative_to(output_dir).as_posix())
+    tiles_href = Path(os.path.relpath(output_dir / TILES_DIR, page.parent)).as_posix()
+    names: Dict[str, str] = {}
+    for src in sources:
+        names[src] = cached_pyramid(output_dir / resolve_reference(src, relative_page), cache_dir)
+        used.add(names[src])
+
+    def rewrite(match):
+        tag = match.group(0)
+        src_match = SRC_PATTERN.search(tag)
+        if src_match is None or src_match.group(2) not in names or "data-dzi" in tag:
+            return tag
+        name = names[src_match.group(2)]
+        preview = next(cache_dir.glob(f"{name}_preview.*")).name
+        tag = tag[:src_match.start()] + f'src="{tiles_href}/{preview}"' + tag[src_match.end():]
+        return tag[:4] + f" data-dzi={quoteattr(f'{tiles_href}/{name}.dzi')}" + tag[4:]
+
+    text = IMAGE_TAG_PATTERN.sub(rewrite, text)
+    if VIEWER_NAME not in text and "</body>" in text:
+        text = text.replace("</body>", f'<script src="{tiles_href}/{VIEWER_NAME}" defer></script>\n</body>', 1)
+    page.write_text(text, encoding="utf-8")
+    return len(sources)
+
+
+def deep_zoom(output_dir: Path, cache_dir: Path, min_size: int = 0) -> Optional[int]:
+    """Tile the selected figures of every page; None without HTML pages"""
+    pages = sorted(
+        page for page in output_dir.rglob("*.html")
+        if "site_libs" not in page.relative_to(output_dir).parts
+    )
+    if not pages:
+        return None
+    used: Set[str] = set()
+    count = sum(tile_page(page, output_dir, cache_dir, min_size, used) for page in pages)
+
+    tiles_dir = output_dir / TILES_DIR
+    if used:
+        tiles_dir.mkdir(exist_ok=True)
+        shutil.copyfile(VIEWER_SOURCE, tiles_dir / VIEWER_NAME)
+        for name in used:
+            for entry in cache_dir.glob(f"{name}*"):
+                destination = tiles_dir / entry.name
+                if destination.exists():
+                    continue
+                if entry.is_dir():
+                    shutil.copytree(entry, destination)
+                else:
+                    shutil.copy2(entry, destination)
+    # Pyramids of figures no longer tiled
+    if tiles_dir.is_dir():
+        for entry in tiles_dir.iterdir():
+            if entry.name != VIEWER_NAME and entry.name.split("_")[0].split(".")[0] not in used:
+                shutil.rmtree(entry) if entry.is_dir() else entry.unlink()
+    print(f"✓ Deep zoom: {count} figures on {len(pages)} pages, {len(used)} pyramids in {tiles_dir}")
+    return count
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build deep-zoom tile pyramids of selected figures")
+    parser.add_argument(
+        "--output-dir",
+        default=None,
+        help="Rendered book (default: $QUARTO_PROJECT_OUTPUT_DIR or project.output-dir)",
+    )
+    parser.add_argument(
+        "--min-size",
+        type=int,
+        default=None,
+        help=f"Also tile figures whose long side has at least this many pixels, 0: only .{ZOOM_CLASS} "
+             "(default: [deep_zoom] min_size)",
+    )
+    args = parser.parse_args()
+
+    if not Path(QUARTO_CONFIG).exists():
+        print(f"Error: {QUARTO_CONFIG} not found. Please run from project root.")
+        sys.exit(1)
+
+    if not post_render_enabled(__file__):
+        print(f"Skipping {Path(__file__).name} (not in fast-preview.post-render)")
+        sys.exit(0)
+
+    output_dir = Path(
+        args.output_dir
+        or os.environ.get("QUARTO_PROJECT_OUTPUT_DIR")
+        or (load_quarto_config().get("project") or {}).get("output-dir", "_book")
+    )
+    config = load_config()
+    min_size = config.deep_zoom.min_size if args.min_size is None else args.min_size
+    cache_dir = Path(config.cache.cache_dir) / TILES_DIR
+    if deep_zoom(output_dir, cache_dir, min_size) is None:
+        print(f"No HTML pages in {output_dir}, no tiles built")
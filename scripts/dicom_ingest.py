@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""
+Import key images from anonymised DICOM series into the img/ layout.
+
+Instead of screenshots of a viewer, figures can be made from the series
+themselves with consistent size and windowing:
+
+- the source folder is scanned in a process pool (headers only) and the
+  files are grouped by series and sorted by slice position
+- the chosen slices of each series are windowed with a preset, for the
+  whole stack at once: fixed centre/width in Hounsfield units for CT, or
+  percentiles of the series for MRI, which has no absolute scale
+- uncompressed pixel data is memory-mapped straight from the files, so
+  only the chosen slices are ever read; compressed transfer syntaxes fall
+  back to pydicom's decoder
+- slices are resampled to square pixels (PixelSpacing), scaled to --size
+  and written as 8-bit grayscale PNGs (no metadata chunks)
+- no DICOM tag is copied except a whitelist of acquisition parameters
+  (series.json), so names, IDs, dates and institutions never reach img/;
+  series flagged BurnedInAnnotation are refused
+- a stub annotation_<mri|ct>.svg embeds the slices side by side with empty
+  layers to draw on; prepare_images.py picks it up like any annotation
+
+Requires the optional dependency pydicom (pip install ".[dicom]").
+
+Usage:
+    python scripts/dicom_ingest.py ~/cases/case12 --list
+    python scripts/dicom_ingest.py ~/cases/case12 --target img/staging/case12 \\
+        --series 3 --slices 12,14-16 --preset t2
+"""
+
+import json
+import multiprocessing
+import os
+import re
+import sys
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from config import load_config
+from quarto_project import QUARTO_CONFIG
+
+try:
+    import pydicom
+    from pydicom.errors import InvalidDicomError
+except ImportError:  # optional dependency, checked in main
+    pydicom = None
+
+DEFAULT_SIZE = 512
+DEFAULT_LAYERS = ("tumor", "lymph_node", "mesorectal_fascia")
+SERIES_METADATA = "series.json"
+# Acquisition parameters safe to keep; everything else is dropped
+KEPT_TAGS = (
+    "Modality", "SeriesDescription", "ProtocolName", "BodyPartExamined", "SequenceName",
+    "MagneticFieldStrength", "RepetitionTime", "EchoTime", "SliceThickness", "SpacingBetweenSlices",
+    "PixelSpacing", "KVP", "ConvolutionKernel", "ImageOrientationPatient", "Rows", "Columns",
+)
+MODALITY_SUFFIXES = {"MR": "mri", "CT": "ct"}
+SLICES_PATTERN = re.compile(r"^\s*(\d+)\s*(?:-\s*(\d+))?\s*$")
+
+
+class Preset(NamedTuple):
+    description: str
+    # Fixed window in rescaled units (CT), or None to use percentiles
+    center: Optional[float] = None
+    width: Optional[float] = None
+    # Percentiles of the series mapped to black and white (MRI)
+    low: float = 0.5
+    high: float = 99.5
+    gamma: float = 1.0
+
+
+PRESETS = {
+    "t2": Preset("MRI T2: series percentiles 0.5–99.5", low=0.5, high=99.5),
+    "dwi": Preset("MRI DWI (high b): percentiles 1–99.8, gamma 0.8 to lift the background", low=1, high=99.8, gamma=0.8),
+    "adc": Preset("MRI ADC map: percentiles 1–99", low=1, high=99),
+    "ct-soft-tissue": Preset("CT soft tissue: W 400 / L 40 HU", center=40, width=400),
+    "ct-abdomen": Preset("CT abdomen (narrow): W 350 / L 50 HU", center=50, width=350),
+    "ct-bone": Preset("CT bone: W 1800 / L 400 HU", center=400, width=1800),
+    "dicom": Preset("Window stored in the DICOM header (first slice)"),
+}
+
+
+class SliceHeader(NamedTuple):
+    path: str
+    series_uid: str
+    series_number: int
+    instance_number: int
+    position: float  # along the slice normal
+    modality: str
+    description: str
+    burned_in: bool
+
+
+def read_header(path: str) -> Optional[SliceHeader]:
+    """Pool worker: header of one DICOM file with pixel data, None otherwise"""
+    try:
+        ds = pydicom.dcmread(path, stop_before_pixels=True)
+    except (InvalidDicomError, OSError, ValueError):
+        return None
+    if "Rows" not in ds or "SeriesInstanceUID" not in ds:
+        return None
+    position = 0.0
+    if "ImagePositionPatient" in ds and "ImageOrientationPatient" in ds:
+        orientation = np.array(ds.ImageOrientationPatient, dtype=float)
+        normal = np.cross(orientation[:3], orientation[3:])
+        position = float(np.dot(normal, np.array(ds.ImagePositionPatient, dtype=float)))
+    return SliceHeader(
+        path,
+        str(ds.SeriesInstanceUID),
+        int(ds.get("SeriesNumber") or 0),
+        int(ds.get("InstanceNumber") or 0),
+        position,
+        str(ds.get("Modality", "")),
+        str(ds.get("SeriesDescription", "")),
+        str(ds.get("BurnedInAnnotation", "")).upper() == "YES",
+    )
+
+
+def scan_series(source: Path, processes: int = 0) -> Dict[int, List[SliceHeader]]:
+    """Series of a folder by series number, slices ordered by position"""
+    paths = [str(path) for path in sorted(source.rglob("*")) if path.is_file()]
+    processes = processes or min(len(paths), multiprocessing.cpu_count(), 8)
+    if processes > 1:
+        with multiprocessing.Pool(processes=processes) as pool:
+            headers = pool.map(read_header, paths, chunksize=16)
+    else:
+        headers = [read_header(path) for path in paths]
+
+    by_uid: Dict[str, List[SliceHeader]] = defaultdict(list)
+    for header in headers:
+        if header is not None:
+            by_uid[header.series_uid].append(header)
+    series = {}
+    for slices in sorted(by_uid.values(), key=lambda s: (s[0].series_number, s[0].series_uid)):
+        slices.sort(key=lambda h: (h.position, h.instance_number))
+        number = slices[0].series_number
+        while number in series:
+            number += 1000
+        series[number] = slices
+    return series
+
+
+def pixel_data(path: str) -> Tuple[np.ndarray, "pydicom.Dataset"]:
+    """Pixels of a single-frame file, memory-mapped when stored uncompressed"""
+    with open(path, "rb") as f:
+        ds = pydicom.dcmread(f, stop_before_pixels=True)
+        offset = f.tell()
+    syntax = ds.file_meta.TransferSyntaxUID
+    bits = int(ds.BitsAllocated)
+    if (
+        syntax.is_encapsulated or not syntax.is_little_endian
+        or int(ds.get("SamplesPerPixel", 1)) != 1 or bits not in (8, 16)
+    ):
+        full = pydicom.dcmread(path)
+        return np.asarray(full.pixel_array), ds
+    # Skip the (7FE0,0010) element header: tag + length, plus VR and reserved bytes when explicit
+    offset += 8 if syntax.is_implicit_VR else 12
+    dtype = np.dtype(f"<{'i' if int(ds.PixelRepresentation) else 'u'}{bits // 8}")
+    pixels = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(int(ds.Rows), int(ds.Columns)))
+    return pixels, ds
+
+
+def parse_slices(spec: str, count: int) -> List[int]:
+    """1-based slice numbers ("12,14-16", "middle", "all") -> 0-based indices"""
+    if spec == "all":
+        return list(range(count))
+    if spec == "middle":
+        return [count // 2]
+    indices = []
+    for part in spec.split(","):
+        match = SLICES_PATTERN.match(part)
+        if not match:
+            raise ValueError(f"invalid slice range '{part}'")
+        first = int(match.group(1))
+        last = int(match.group(2) or first)
+        indices += [index - 1 for index in range(first, last + 1)]
+    invalid = [index + 1 for index in indices if not 0 <= index < count]
+    if invalid:
+        raise ValueError(f"series has {count} slices, no slice {invalid[0]}")
+    return sorted(set(indices))
+
+
+def window(stack: np.ndarray, preset: Preset, header_window: Optional[Tuple[float, float]] = None) -> np.ndarray:
+    """Map a stack of rescaled slices to 8-bit with a window preset"""
+    if preset.center is not None:
+        low, high = preset.center - preset.width / 2, preset.center + preset.width / 2
+    elif header_window is not None and preset is PRESETS["dicom"]:
+        center, width = header_window
+        low, high = center - width / 2, center + width / 2
+    else:
+        low, high = np.percentile(stack, [preset.low, preset.high])
+    scaled = np.clip((stack - low) / max(high - low, 1e-6), 0, 1)
+    if preset.gamma != 1.0:
+        scaled **= preset.gamma
+    return (scaled * 255 + 0.5).astype(np.uint8)
+
+
+def first_value(value) -> Optional[float]:
+    """First number of a (possibly multi-valued) window attribute"""
+    if hasattr(value, "__len__") and not isinstance(value, str):
+        value = value[0] if len(value) else None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def kept_metadata(ds) -> Dict:
+    kept = {}
+    for keyword in KEPT_TAGS:
+        value = ds.get(keyword)
+        if value is None or value == "":
+            continue
+        kept[keyword] = [float(v) for v in value] if keyword in ("PixelSpacing", "ImageOrientationPatient") else (
+            value if isinstance(value, (int, float)) else str(value)
+        )
+    return kept
+
+
+def export_series(job) -> Tuple[int, List[str], Optional[str]]:
+    """Pool worker: window, resample and write the chosen slices of one series"""
+    number, slices, indices, target, preset_name, size, prefix = job
+    try:
+        datasets = []
+        stack = []
+        for index in indices:
+            pixels, ds = pixel_data(slices[index].path)
+            slope = float(ds.get("RescaleSlope", 1) or 1)
+            intercept = float(ds.get("RescaleIntercept", 0) or 0)
+            stack.append(pixels.astype(np.float32) * slope + intercept)
+            datasets.append(ds)
+        if len({frame.shape for frame in stack}) > 1:
+            return number, [], "slices of different matrix size"
+        stack = np.stack(stack)
+        header_window = None
+        if "WindowCenter" in datasets[0] and "WindowWidth" in datasets[0]:
+            header_window = (first_value(datasets[0].WindowCenter), first_value(datasets[0].WindowWidth))
+        images = window(stack, PRESETS[preset_name], header_window)
+
+        # Square pixels: scale by PixelSpacing (row, column spacing), then fit the long side to size
+        row_spacing, column_spacing = [float(v) for v in datasets[0].get("PixelSpacing", [1, 1])]
+        height_mm, width_mm = images.shape[1] * row_spacing, images.shape[2] * column_spacing
+        scale = size / max(height_mm, width_mm)
+        output_size = (max(1, round(width_mm * scale)), max(1, round(height_mm * scale)))
+
+        target.mkdir(parents=True, exist_ok=True)
+        written = []
+        for image, index, header in zip(images, indices, (slices[i] for i in indices)):
+            name = f"{prefix}{index + 1:03d}.png"
+            Image.fromarray(image, mode="L").resize(output_size, Image.Resampling.LANCZOS).save(target / name, optimize=True)
+            written.append(name)
+
+        metadata = kept_metadata(datasets[0])
+        metadata.update({
+            "SeriesNumber": number,
+            "preset": preset_name,
+            "slices": {name: index + 1 for name, index in zip(written, indices)},
+            "output_size": list(output_size),
+        })
+        with open(target / SERIES_METADATA, "w", encoding="utf-8") as f:
+            json.dump(metadata, f, ensure_ascii=False, indent=1)
+        return number, written, None
+    except Exception as e:
+        return number, [], f"{type(e).__name__}: {e}"
+
+
+def write_stub_svg(path: Path, images: Sequence[Tuple[str, Tuple[int, int]]], layers: Sequence[str]):
+    """Inkscape document with the images side by side in "Слой 1" and empty drawing layers"""
+    gap = 10
+    width = sum(size[0] for _, size in images) + gap * (len(images) - 1)
+    height = max(size[1] for _, size in images)
+    image_elements = []
+    x = 0
+    for index, (name, (image_width, image_height)) in enumerate(images, start=1):
+        image_elements.append(
+            f'    <image id="image{index}" x="{x}" y="0" width="{image_width}" height="{image_height}" '
+            f'preserveAspectRatio="none" xlink:href="{name}" />'
+        )
+        x += image_width + gap
+    layer_elements = [
+        f'  <g inkscape:groupmode="layer" id="layer{index}" inkscape:label="{name}" />'
+        for index, name in enumerate(layers, start=2)
+    ]
+    path.write_text(
+        '<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n'
+        f'<svg width="{width}" height="{height}" viewBox="0 0 {width} {height}" version="1.1" id="svg1"\n'
+        '   xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape"\n'
+        '   xmlns:sodipodi="http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd"\n'
+        '   xmlns:xlink="http://www.w3.org/1999/xlink"\n'
+        '   xmlns="http://www.w3.org/2000/svg">\n'
+        '  <g inkscape:groupmode="layer" id="layer1" inkscape:label="Слой 1" sodipodi:insensitive="true">\n'
+        + "\n".join(image_elements) + "\n  </g>\n"
+        + "\n".join(layer_elements) + "\n</svg>\n",
+        encoding="utf-8",
+    )
+
+
+def print_series(series: Dict[int, List[SliceHeader]]):
+    for number, slices in series.items():
+        flags = "  ❌ burned-in annotation" if any(h.burned_in for h in slices) else ""
+        print(f"{number:5d}  {slices[0].modality:3s} {len(slices):4d} slices  {slices[0].description}{flags}")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Import key images from DICOM series into img/")
+    parser.add_argument("source", help="Folder with the anonymised DICOM files of a case")
+    parser.add_argument("--list", action="store_true", help="Only list the series found")
+    parser.add_argument("--target", help="Output folder below img/ (e.g. img/staging/case12)")
+    parser.add_argument("--series", type=int, nargs="+", help="Series numbers to import (default: all)")
+    parser.add_argument("--slices", default="middle", help='1-based slices: "12,14-16", "middle" or "all"')
+    parser.add_argument("--preset", choices=sorted(PRESETS), help="Window preset (default: t2 for MR, ct-soft-tissue for CT)")
+    parser.add_argument("--size", type=int, default=DEFAULT_SIZE, help=f"Long side in pixels (default: {DEFAULT_SIZE})")
+    parser.add_argument("--layers", nargs="*", default=list(DEFAULT_LAYERS), help="Empty layers of the stub SVG")
+    parser.add_argument("--no-svg", action="store_true", help="Do not write the stub annotation SVG")
+    parser.add_argument("--force", action="store_true", help="Overwrite an existing annotation SVG")
+    parser.add_argument("--config", default="config.toml", help="Configuration TOML file name")
+    args = parser.parse_args()
+
+    if not Path(QUARTO_CONFIG).exists():
+        print(f"Error: {QUARTO_CONFIG} not found. Please run from project root.")
+        sys.exit(1)
+    if pydicom is None:
+        print('Error: pydicom is not installed. Install the optional dependency: pip install ".[dicom]"')
+        sys.exit(1)
+
+    config = load_config(args.config)
+    series = scan_series(Path(args.source))
+    if not series:
+        print(f"No DICOM images in {args.source}")
+        sys.exit(1)
+    if args.list or not args.target:
+        print_series(series)
+        if not args.list:
+            print("\nChoose --target (and --series/--slices) to import")
+        return
+
+    target = Path(args.target)
+    image_folder = Path(config.processing.default_folder).resolve()
+    if image_folder not in target.resolve().parents:
+        print(f"Error: --target must be below {config.processing.default_folder}")
+        sys.exit(1)
+
+    jobs = []
+    for number in args.series or list(series):
+        if number not in series:
+            print(f"Error: no series {number}; see --list")
+            sys.exit(1)
+        slices = series[number]
+        if any(header.burned_in for header in slices):
+            print(f"❌ Series {number} has burned-in annotation (possible PHI in pixels), skipped")
+            continue
+        try:
+            indices = parse_slices(args.slices, len(slices))
+        except ValueError as e:
+            print(f"Error: series {number}: {e}")
+            sys.exit(1)
+        preset = args.preset or ("ct-soft-tissue" if slices[0].modality == "CT" else "t2")
+        series_target = target if len(args.series or series) == 1 else target / f"series{number}"
+        jobs.append((number, slices, indices, series_target, preset, args.size, "slice"))
+
+    processes = min(len(jobs), multiprocessing.cpu_count(), config.processing.max_processes or 8)
+    if processes > 1:
+        with multiprocessing.Pool(processes=processes) as pool:
+            results = pool.map(export_series, jobs)
+    else:
+        results = [export_series(job) for job in jobs]
+
+    failed = False
+    for (number, slices, _, series_target, preset, _, _), (_, written, error) in zip(jobs, results):
+        if error:
+            print(f"❌ Series {number}: {error}")
+            failed = True
+            continue
+        print(f"✓ Series {number}: {len(written)} slices ({preset}) → {series_target}")
+        if args.no_svg or not written:
+            continue
+        suffix = MODALITY_SUFFIXES.get(slices[0].modality, slices[0].modality.lower() or "image")
+        svg_path = series_target / f"annotation_{suffix}.svg"
+        if svg_path.exists() and not args.force:
+            print(f"  {svg_path} exists, not overwritten (--force)")
+            continue
+        images = []
+        for name in written:
+            with Image.open(series_target / name) as image:
+                images.append((name, image.size))
+        write_stub_svg(svg_path, images, args.layers)
+        print(f"  ✓ {svg_path}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
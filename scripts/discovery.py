@@ -0,0 +1,182 @@
+"""
+Annotation file discovery with a persistent directory index.
+
+Which files are annotation sources is decided by AnnotationMatcher: the
+substring patterns of processing.annotation_patterns, compiled into one
+regular expression, plus the include/exclude globs. Generated files
+(containing styled_postfix) are never sources.
+
+The directory listing is kept in <cache_dir>/discovery-index.json together
+with each directory's mtime. A directory whose mtime is unchanged is not
+listed again, so a rescan costs one stat per directory plus a listing of
+the directories that actually changed. Only names matter for discovery,
+and adding, removing or renaming a file always updates the directory mtime.
+"""
+
+import fnmatch
+import json
+import os
+import re
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import Settings
+
+INDEX_VERSION = 1
+DISCOVERY_INDEX_FILE = "discovery-index.json"
+# Directories modified this recently may change again within the same
+# mtime tick, so their listing is not trusted on the next run
+RACY_WINDOW_NS = 2_000_000_000
+
+
+def compile_globs(globs: Iterable[str]) -> Optional[re.Pattern]:
+    """Compile glob patterns into a single regular expression, None if empty"""
+    globs = list(globs)
+    if not globs:
+        return None
+    return re.compile("|".join(f"(?:{fnmatch.translate(glob)})" for glob in globs))
+
+
+class AnnotationMatcher:
+    """Decide whether a file below the image folder is an annotation source"""
+
+    def __init__(
+        self,
+        patterns: Iterable[str],
+        generated_marker: str,
+        include_globs: Iterable[str] = (),
+        exclude_globs: Iterable[str] = (),
+    ):
+        self.patterns = list(patterns)
+        self.pattern_regex = re.compile("|".join(re.escape(p) for p in self.patterns) or "(?!)")
+        self.generated_marker = generated_marker
+        self.include_globs = list(include_globs)
+        self.exclude_globs = list(exclude_globs)
+        self.include_regex = compile_globs(self.include_globs)
+        self.exclude_regex = compile_globs(self.exclude_globs)
+
+    @classmethod
+    def from_config(cls, config: Settings) -> "AnnotationMatcher":
+        return cls(
+            config.processing.annotation_patterns,
+            config.processing.styled_postfix,
+            config.processing.include_globs,
+            config.processing.exclude_globs,
+        )
+
+    def match(self, relative_path: str) -> Tuple[bool, str]:
+        """Return (selected, reason) for a path relative to the image folder"""
+        name = relative_path.rsplit("/", 1)[-1]
+        if not name.endswith(".svg"):
+            return False, "not an SVG file"
+        if self.generated_marker and self.generated_marker in name:
+            return False, f"generated file (contains '{self.generated_marker}')"
+        pattern = self.pattern_regex.search(name)
+        if pattern is None:
+            return False, "matches no annotation pattern"
+        if self.exclude_regex is not None and self.exclude_regex.match(relative_path):
+            glob = next(g for g in self.exclude_globs if fnmatch.fnmatchcase(relative_path, g))
+            return False, f"excluded by glob '{glob}'"
+        if self.include_regex is not None and not self.include_regex.match(relative_path):
+            return False, "not matched by include_globs"
+        return True, f"matches pattern '{pattern.group(0)}'"
+
+
+class DiscoveryIndex:
+    """Directory listings below an image folder, keyed by directory mtime
+
+    Without index_path nothing is persisted and every scan lists the tree.
+    """
+
+    def __init__(self, index_path=None):
+        self.index_path = Path(index_path) if index_path else None
+        self.base = None
+        self.dirs: Dict[str, Dict] = {}
+        self.rescanned = 0
+        self.load()
+
+    def load(self):
+        if self.index_path is None:
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return
+        if data.get("version") == INDEX_VERSION:
+            self.base = data.get("base")
+            self.dirs = data.get("dirs", {})
+
+    def save(self):
+        if self.index_path is None:
+            return
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.index_path.with_name(f".{self.index_path.name}.{os.getpid()}")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"version": INDEX_VERSION, "base": self.base, "dirs": self.dirs},
+                f, ensure_ascii=False,
+            )
+        os.replace(tmp_path, self.index_path)
+
+    def scan(self, base_folder) -> List[str]:
+        """Return all files below base_folder as relative POSIX paths"""
+        base = os.path.abspath(base_folder)
+        previous = self.dirs if self.base == base else {}
+        started_ns = time.time_ns()
+        self.base = base
+        self.dirs = {}
+        self.rescanned = 0
+
+        files = []
+        pending = [""]
+        while pending:
+            relative_dir = pending.pop()
+            full_dir = os.path.join(base, relative_dir)
+            try:
+                mtime_ns = os.stat(full_dir).st_mtime_ns
+            except OSError:
+                continue
+
+            record = previous.get(relative_dir)
+            if record is None or record["mtime_ns"] is None or record["mtime_ns"] != mtime_ns:
+                record = self.list_dir(full_dir, mtime_ns, started_ns)
+                self.rescanned += 1
+            self.dirs[relative_dir] = record
+
+            prefix = f"{relative_dir}/" if relative_dir else ""
+            files.extend(prefix + name for name in record["files"])
+            pending.extend(prefix + name for name in reversed(record["dirs"]))
+
+        if self.dirs != previous or self.rescanned:
+            self.save()
+        return sorted(files)
+
+    @staticmethod
+    def list_dir(full_dir: str, mtime_ns: int, started_ns: int) -> Dict:
+        files, dirs = [], []
+        with os.scandir(full_dir) as entries:
+            for entry in entries:
+                (dirs if entry.is_dir() else files).append(entry.name)
+        return {
+            "mtime_ns": mtime_ns if mtime_ns < started_ns - RACY_WINDOW_NS else None,
+            "files": sorted(files),
+            "dirs": sorted(dirs),
+        }
+
+
+def discover(
+    base_folder, matcher: AnnotationMatcher, index: Optional[DiscoveryIndex] = None
+) -> List[Tuple[str, bool, str]]:
+    """Return (path, selected, reason) for every file below base_folder"""
+    if index is None:
+        index = DiscoveryIndex()
+    return [
+        (os.path.join(base_folder, *relative_path.split("/")), *matcher.match(relative_path))
+        for relative_path in index.scan(base_folder)
+    ]
+
+
+def make_discovery_index(config: Settings) -> DiscoveryIndex:
+    return DiscoveryIndex(Path(config.cache.cache_dir) / DISCOVERY_INDEX_FILE)
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Asset fingerprinting and offline precache manifest for the HTML book (post-render).
+
+GitHub Pages serves files under stable names with a short max-age, so
+browsers re-validate every image on each visit. This step renames static
+assets in the output directory to content-hashed names
+(fig1.png -> fig1.3f2a9c0d1e.png), rewrites the references in the HTML
+pages (and in SVGs, which embed rasters by relative href) and writes a
+service worker that serves hashed assets cache-first:
+
+- index/chapter pages, site_libs and the search index are precached when the
+  service worker installs, so the book works offline after the first load
+- figures referenced by the pages are cached in the background afterwards
+- pages are fetched network-first, so a new render is picked up online
+
+Downloads (.docx, .pdf) keep a copy under their stable name for external
+links. The original → hashed names are recorded in asset-manifest.json, so
+the pre-render image sync stays incremental (see prepare_images_prerender.py)
+and running the step twice changes nothing.
+
+Usage (run by Quarto as post-render; standalone after quarto render):
+    python scripts/fingerprint_assets.py
+    python scripts/fingerprint_assets.py --output-dir _book --no-service-worker
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+from pathlib import Path, PurePosixPath
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import quote, unquote, urlsplit
+
+from quarto_project import QUARTO_CONFIG, load_quarto_config, post_render_enabled
+
+ASSET_MANIFEST = "asset-manifest.json"
+SERVICE_WORKER_SOURCE = "build/service-worker.js"
+SERVICE_WORKER_NAME = "service-worker.js"
+HASH_LENGTH = 10
+FINGERPRINT_SUFFIXES = {".png", ".jpg", ".jpeg", ".gif", ".webp", ".avif", ".svg", ".docx", ".pdf"}
+# Downloads are also linked from outside the site: keep the stable name too
+DOWNLOAD_SUFFIXES = {".docx", ".pdf"}
+# Trees whose file names are fixed by their loaders
+UNHASHED_DIRS = {"site_libs", "search-index"}
+# Already content-addressed and fetched on demand (deep_zoom.py): neither renamed nor precached
+ON_DEMAND_DIRS = {"tiles"}
+FINGERPRINTED_PATTERN = re.compile(rf"\.[0-9a-f]{{{HASH_LENGTH}}}\.[^./]+$")
+# URL-valued attributes and CSS url() in HTML and SVG
+REFERENCE_PATTERN = re.compile(
+    r"""((?:src|href|xlink:href|data-src|poster)\s*=\s*)(["'])(.*?)\2|(url\(\s*)(["']?)([^"')]+)\5\s*\)|(srcset\s*=\s*)(["'])(.*?)\8""",
+    re.IGNORECASE,
+)
+REGISTER_MARKER = 'id="book-service-worker"'
+
+
+def content_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+def fingerprinted_name(name: str, digest: str) -> str:
+    stem, dot, suffix = name.rpartition(".")
+    return f"{stem}.{digest}.{suffix}" if dot else f"{name}.{digest}"
+
+
+def load_asset_manifest(output_dir) -> Tuple[Dict[str, str], Dict[str, List[int]]]:
+    """Original → fingerprinted paths (relative to output_dir) of the last run,
+    and the [size, mtime_ns] each original had when it was fingerprinted"""
+    try:
+        with open(Path(output_dir) / ASSET_MANIFEST, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}, {}
+    return data.get("assets", {}), data.get("stats", {})
+
+
+def save_asset_manifest(output_dir: Path, assets: Dict[str, str], stats: Dict[str, List[int]]):
+    path = output_dir / ASSET_MANIFEST
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "version": 1,
+                "assets": dict(sorted(assets.items())),
+                "stats": {original: stats[original] for original in sorted(assets) if original in stats},
+            },
+            f, ensure_ascii=False, indent=1,
+        )
+    os.replace(tmp_path, path)
+
+
+def is_asset(relative: PurePosixPath) -> bool:
+    return (
+        relative.suffix.lower() in FINGERPRINT_SUFFIXES
+        and not (UNHASHED_DIRS | ON_DEMAND_DIRS).intersection(relative.parts[:-1])
+        and not FINGERPRINTED_PATTERN.search(relative.name)
+    )
+
+
+def resolve_reference(url: str, document: PurePosixPath) -> Optional[PurePosixPath]:
+    """Output-relative path a local URL in document points to, None for external URLs"""
+    parts = urlsplit(url)
+    if parts.scheme or parts.netloc or not parts.path or url.startswith(("#", "data:")):
+        return None
+    path = unquote(parts.path)
+    base = PurePosixPath("/") if path.startswith("/") else PurePosixPath("/") / document.parent
+    resolved = []
+    for part in (base / path.lstrip("/")).parts[1:]:
+        if part == "..":
+            if not resolved:
+                return None
+            resolved.pop()
+        elif part != ".":
+            resolved.append(part)
+    return PurePosixPath(*resolved) if resolved else None
+
+
+def rewrite_references(text: str, document: PurePosixPath, assets: Dict[str, str], used: Set[str]) -> str:
+    """Point local references of a document at the fingerprinted assets"""
+
+    def rewrite_url(url: str) -> str:
+        target = resolve_reference(url.strip(), document)
+        if target is None:
+            return url
+        hashed = assets.get(target.as_posix())
+        if hashed is None:
+            if target.as_posix() in assets.values():
+                used.add(target.as_posix())
+            return url
+        used.add(hashed)
+        # Replace only the file name, keeping the URL's own encoding, query and fragment
+        parts = urlsplit(url.strip())
+        directory, _, name = parts.path.rpartition("/")
+        new_name = quote(PurePosixPath(hashed).name) if "%" in name else PurePosixPath(hashed).name
+        new_path = f"{directory}/{new_name}" if directory or parts.path.startswith("/") else new_name
+        return parts._replace(path=new_path).geturl()
+
+    def replace(match):
+        if match.group(1):
+            return f"{match.group(1)}{match.group(2)}{rewrite_url(match.group(3))}{match.group(2)}"
+        if match.group(4):
+            return f"{match.group(4)}{match.group(5)}{rewrite_url(match.group(6))}{match.group(5)})"
+        candidates = ", ".join(
+            " ".join([rewrite_url(item.split()[0])] + item.split()[1:])
+            for item in match.group(9).split(",") if item.strip()
+        )
+        return f"{match.group(7)}{match.group(8)}{candidates}{match.group(8)}"
+
+    return REFERENCE_PATTERN.sub(replace, text)
+
+
+def fingerprint(output_dir: Path, paths: Iterable[Path], assets: Dict[str, str]) -> int:
+    """Rename paths to hashed names, updating assets; returns the number of changed assets"""
+    changed = 0
+    for path in paths:
+        relative = path.relative_to(output_dir).as_posix()
+        hashed = path.with_name(fingerprinted_name(path.name, content_hash(path)))
+        hashed_relative = hashed.relative_to(output_dir).as_posix()
+        previous = assets.get(relative)
+        if previous != hashed_relative:
+            if previous:
+                (output_dir / previous).unlink(missing_ok=True)
+            changed += 1
+        if path.suffix.lower() not in DOWNLOAD_SUFFIXES:
+            os.replace(path, hashed)
+        elif not hashed.exists():
+            shutil.copy2(path, hashed)
+        assets[relative] = hashed_relative
+    return changed
+
+
+def register_service_worker(page: Path, output_dir: Path):
+    """Add the service worker registration to a page (once)"""
+    text = page.read_text(encoding="utf-8")
+    if REGISTER_MARKER in text or "</body>" not in text:
+        return
+    url = Path(os.path.relpath(output_dir / SERVICE_WORKER_NAME, page.parent)).as_posix()
+    script = (
+        f'<script {REGISTER_MARKER}>if ("serviceWorker" in navigator) '
+        f'navigator.serviceWorker.register("{url}");</script>\n'
+    )
+    page.write_text(text.replace("</body>", script + "</body>", 1), encoding="utf-8")
+
+
+def write_service_worker(output_dir: Path, shell, figures, revisions: Dict[str, str]):
+    """Generate the service worker with its precache lists from build/service-worker.js"""
+    template = Path(SERVICE_WORKER_SOURCE).read_text(encoding="utf-8")
+    precache = {"shell": sorted(shell), "figures": sorted(figures), "revisions": revisions}
+    version = hashlib.sha256(json.dumps(precache, sort_keys=True).encode()).hexdigest()[:HASH_LENGTH]
+    text = template.replace("__PRECACHE__", json.dumps(precache, ensure_ascii=False)).replace(
+        "__VERSION__", version
+    )
+    (output_dir / SERVICE_WORKER_NAME).write_text(text, encoding="utf-8")
+    return version
+
+
+def fingerprint_assets(output_dir: Path, service_worker: bool = True) -> Optional[int]:
+    """Fingerprint assets and rewrite the pages of output_dir; None without HTML pages"""
+    pages = sorted(output_dir.rglob("*.html"))
+    if not pages:
+        return None
+
+    assets, stats = load_asset_manifest(output_dir)
+    assets = {original: hashed for original, hashed in assets.items() if (output_dir / hashed).exists()}
+    candidates = [
+        path for path in output_dir.rglob("*")
+        if path.is_file() and is_asset(PurePosixPath(path.relative_to(output_dir).as_posix()))
+    ]
+    # Before SVGs are rewritten: the image sync compares these with the sources
+    for path in candidates:
+        stat = path.stat()
+        stats[path.relative_to(output_dir).as_posix()] = [stat.st_size, stat.st_mtime_ns]
+    # Rasters and downloads first: SVGs embed them and are hashed after rewriting
+    renamed = fingerprint(output_dir, [p for p in candidates if p.suffix.lower() != ".svg"], assets)
+    unused: Set[str] = set()
+    for svg in (p for p in candidates if p.suffix.lower() == ".svg"):
+        relative = PurePosixPath(svg.relative_to(output_dir).as_posix())
+        text = svg.read_text(encoding="utf-8", errors="surrogateescape")
+        new_text = rewrite_references(text, relative, assets, unused)
+        if new_text != text:
+            svg.write_text(new_text, encoding="utf-8", errors="surrogateescape")
+    renamed += fingerprint(output_dir, [p for p in candidates if p.suffix.lower() == ".svg"], assets)
+
+    figures: Set[str] = set()
+    for page in pages:
+        relative = PurePosixPath(page.relative_to(output_dir).as_posix())
+        text = page.read_text(encoding="utf-8")
+        new_text = rewrite_references(text, relative, assets, figures)
+        if new_text != text:
+            page.write_text(new_text, encoding="utf-8")
+    save_asset_manifest(output_dir, assets, stats)
+
+    if service_worker:
+        for page in pages:
+            register_service_worker(page, output_dir)
+        shell = [page.relative_to(output_dir).as_posix() for page in pages]
+        for directory in UNHASHED_DIRS:
+            shell += [
+                path.relative_to(output_dir).as_posix()
+                for path in (output_dir / directory).rglob("*") if path.is_file()
+            ]
+        shell += [name for name in ("search.json",) if (output_dir / name).exists()]
+        # Unhashed files are re-fetched when their content changes
+        revisions = {path: content_hash(output_dir / path) for path in shell}
+        version = write_service_worker(output_dir, shell, figures, revisions)
+        print(f"✓ Service worker {version}: {len(shell)} files precached, {len(figures)} figures cached in background")
+
+    print(f"✓ Fingerprinted {renamed} new or changed assets ({len(assets)} recorded in {output_dir / ASSET_MANIFEST})")
+    return renamed
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fingerprint static assets and write the precache service worker")
+    parser.add_argument(
+        "--output-dir",
+        default=None,
+        help="Rendered book (default: $QUARTO_PROJECT_OUTPUT_DIR or project.output-dir)",
+    )
+    parser.add_argument("--no-service-worker", action="store_true", help="Only fingerprint assets")
+    args = parser.parse_args()
+
+    if not Path(QUARTO_CONFIG).exists():
+        print(f"Error: {QUARTO_CONFIG} not found. Please run from project root.")
+        sys.exit(1)
+
+    if not post_render_enabled(__file__):
+        print(f"Skipping {Path(__file__).name} (not in fast-preview.post-render)")
+        sys.exit(0)
+
+    output_dir = Path(
+        args.output_dir
+        or os.environ.get("QUARTO_PROJECT_OUTPUT_DIR")
+        or (load_quarto_config().get("project") or {}).get("output-dir", "_book")
+    )
+    if fingerprint_assets(output_dir, service_worker=not args.no_service_worker) is None:
+        print(f"No HTML pages in {output_dir}, assets not fingerprinted")
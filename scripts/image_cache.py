@@ -0,0 +1,290 @@
+"""
+Portable content-addressed cache for generated annotation images.
+
+Every processed annotation SVG gets an entry keyed by a hash of everything
+its outputs depend on: the SVG's project-relative path (outputs are
+restored to paths derived from it) and content, the raster images it
+links, the resolved styles, the export settings and the Inkscape version.
+Layout:
+
+    <cache_dir>/tool-version                 last Inkscape version seen
+    <cache_dir>/entries/<key>/meta.json      source, outputs and their hashes
+    <cache_dir>/entries/<key>/<n>-<name>     output files
+
+Outputs are recorded by project-relative path, since export profiles write
+them outside the source directory (see ExportConfig.profiles).
+
+Entries are written to a temporary directory and renamed into place, so
+parallel workers and interrupted runs never leave half-written entries.
+A restore touches meta.json, whose mtime is the entry's last use: pruning
+by age or total size drops the least recently used entries first.
+The directory can be restored/saved as-is by CI (actions/cache).
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+from lxml import etree
+
+from config import Settings
+
+CACHE_FORMAT = 4
+META_FILE = "meta.json"
+TOOL_VERSION_FILE = "tool-version"
+
+
+def hash_file(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_tool_version(executable: str) -> Optional[str]:
+    """Return `inkscape --version` output, None if Inkscape is not available"""
+    try:
+        result = subprocess.run(
+            [executable, "--version"], capture_output=True, text=True, timeout=60
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip().splitlines()[0] if result.stdout.strip() else None
+
+
+def linked_images(svg_path, nsmap: Dict[str, str]) -> List[str]:
+    """Return existing raster files linked from <image> elements of an SVG"""
+    svg_dir = os.path.dirname(os.path.abspath(svg_path))
+    href_attrs = [f"{{{nsmap['xlink']}}}href", "href"]
+    linked = []
+    for _, element in etree.iterparse(
+        svg_path, events=("end",), tag=f"{{{nsmap['svg']}}}image", huge_tree=True
+    ):
+        for attr in href_attrs:
+            href = element.attrib.get(attr, "")
+            if href and not href.startswith("data:"):
+                path = os.path.join(svg_dir, href)
+                if os.path.isfile(path):
+                    linked.append(path)
+        element.clear()
+    return sorted(set(linked))
+
+
+class ImageCache:
+    """Content-addressed cache directory for annotation outputs"""
+
+    def __init__(
+        self,
+        cache_dir,
+        inkscape_executable: str = "inkscape",
+        tool_version: Optional[str] = None,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.entries_dir = self.cache_dir / "entries"
+        self.inkscape_executable = inkscape_executable
+        self._tool_version = tool_version
+
+    @property
+    def tool_version(self) -> str:
+        """Installed Inkscape version, or the one recorded in the cache
+
+        Falling back to the recorded version lets a fully cached run proceed
+        on a machine where Inkscape is not installed at all.
+        """
+        if self._tool_version is None:
+            self._tool_version = (
+                get_tool_version(self.inkscape_executable)
+                or self.recorded_tool_version()
+                or "unknown"
+            )
+        return self._tool_version
+
+    def recorded_tool_version(self) -> Optional[str]:
+        path = self.cache_dir / TOOL_VERSION_FILE
+        if path.exists():
+            return path.read_text(encoding="utf-8").strip() or None
+        return None
+
+    def compute_key(
+        self, svg_path, config: Settings, styles: Dict[str, Dict[str, Any]]
+    ) -> str:
+        """Hash all inputs that determine the outputs of an annotation file"""
+        nsmap = config.get_nsmap()
+        svg_dir = os.path.dirname(os.path.abspath(svg_path))
+        parts = {
+            "format": CACHE_FORMAT,
+            "source": Path(os.path.relpath(os.path.abspath(svg_path))).as_posix(),
+            "svg": hash_file(svg_path),
+            "linked": {
+                os.path.relpath(path, svg_dir): hash_file(path)
+                for path in linked_images(svg_path, nsmap)
+            },
+            "styles": styles,
+            "inkscape": config.inkscape.model_dump(exclude={"executable"}),
+            "export": config.export.model_dump(),
+            "names": [config.processing.styled_postfix, config.processing.annotated_suffix],
+            "build_dir": config.build_dir,
+            "tool_version": self.tool_version,
+        }
+        encoded = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def entry_dir(self, key: str) -> Path:
+        return self.entries_dir / key
+
+    def read_meta(self, key: str) -> Optional[Dict[str, Any]]:
+        meta_path = self.entry_dir(key) / META_FILE
+        if not meta_path.exists():
+            return None
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def has(self, key: str) -> bool:
+        return self.read_meta(key) is not None
+
+    def restore(self, key: str, svg_path) -> Optional[List[str]]:
+        """Copy cached outputs of svg_path back into place, None on cache miss"""
+        meta = self.read_meta(key)
+        if meta is None or meta.get("format") != CACHE_FORMAT:
+            return None
+
+        entry = self.entry_dir(key)
+        restored = []
+        for output in meta["outputs"]:
+            cached_file = entry / output["file"]
+            if not cached_file.is_file():
+                return None
+            target = os.path.abspath(output["path"])
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copy2(cached_file, target)
+            restored.append(target)
+        os.utime(entry / META_FILE)
+        return restored
+
+    def store(self, key: str, svg_path, outputs: Iterable[str]):
+        """Store outputs produced for svg_path under key"""
+        if self.has(key):
+            return
+
+        existing = [path for path in outputs if os.path.isfile(path)]
+        if not existing:
+            return
+
+        self.entries_dir.mkdir(parents=True, exist_ok=True)
+        tmp_dir = self.entries_dir / f".tmp-{key}-{os.getpid()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir()
+
+        output_records = []
+        for index, path in enumerate(existing):
+            name = f"{index}-{os.path.basename(path)}"
+            shutil.copy2(path, tmp_dir / name)
+            output_records.append(
+                {"path": os.path.relpath(path), "file": name, "sha256": hash_file(path)}
+            )
+
+        meta = {
+            "format": CACHE_FORMAT,
+            "key": key,
+            "source": os.path.relpath(os.path.abspath(svg_path)),
+            "tool_version": self.tool_version,
+            "created": time.time(),
+            "outputs": output_records,
+        }
+        with open(tmp_dir / META_FILE, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=1)
+
+        try:
+            os.rename(tmp_dir, self.entry_dir(key))
+        except OSError:
+            # Another worker stored the same key first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        if self.tool_version != "unknown":
+            (self.cache_dir / TOOL_VERSION_FILE).write_text(self.tool_version, encoding="utf-8")
+
+    def iter_keys(self) -> List[str]:
+        if not self.entries_dir.exists():
+            return []
+        return sorted(p.name for p in self.entries_dir.iterdir() if not p.name.startswith("."))
+
+    def verify(self, remove_corrupt: bool = False) -> List[str]:
+        """Check every entry against its recorded hashes, return corrupt keys"""
+        corrupt = []
+        for key in self.iter_keys():
+            meta = self.read_meta(key)
+            ok = meta is not None and meta.get("format") == CACHE_FORMAT
+            if ok:
+                for output in meta["outputs"]:
+                    cached_file = self.entry_dir(key) / output["file"]
+                    if not cached_file.is_file() or hash_file(cached_file) != output["sha256"]:
+                        ok = False
+                        break
+            if not ok:
+                corrupt.append(key)
+                if remove_corrupt:
+                    shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+
+        # Leftovers of interrupted writes
+        if remove_corrupt and self.entries_dir.exists():
+            for tmp_dir in self.entries_dir.glob(".tmp-*"):
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        return corrupt
+
+    def last_used(self, key: str) -> float:
+        try:
+            return (self.entry_dir(key) / META_FILE).stat().st_mtime
+        except OSError:
+            return 0.0
+
+    def entry_size(self, key: str) -> int:
+        return sum(path.stat().st_size for path in self.entry_dir(key).iterdir() if path.is_file())
+
+    def prune(
+        self,
+        live_keys: Iterable[str],
+        max_age_days: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+    ) -> List[str]:
+        """Remove entries not in live_keys, then the least recently used ones
+
+        Entries not used for max_age_days are removed, and while the cache
+        holds more than max_bytes the least recently used entry goes first.
+        Returns the removed keys.
+        """
+        live = set(live_keys)
+        now = time.time()
+        removed = []
+        kept = []
+        for key in self.iter_keys():
+            used = self.last_used(key)
+            expired = max_age_days is not None and now - used > max_age_days * 86400
+            if key not in live or expired:
+                removed.append(key)
+            else:
+                kept.append((used, key))
+
+        if max_bytes is not None:
+            kept.sort()
+            sizes = {key: self.entry_size(key) for _, key in kept}
+            total = sum(sizes.values())
+            for _, key in kept:
+                if total <= max_bytes:
+                    break
+                total -= sizes[key]
+                removed.append(key)
+
+        for key in removed:
+            shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+        return removed
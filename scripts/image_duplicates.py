@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""
+Exact and near-duplicate detection for the raster images below img/.
+
+Duplicates are copied to _book, shipped and sometimes linked into annotation
+SVGs (and exported) more than once. This script finds them in three steps:
+
+- exact duplicates: files with the same SHA-256 (taken from the catalog,
+  see catalog.py)
+- perceptual hashes: 64-bit dHash (gradient of a 9×8 thumbnail) and pHash
+  (low frequencies of the DCT of a 32×32 thumbnail), computed for a whole
+  batch of thumbnails at once with NumPy. Thumbnails are decoded in parallel;
+  hashes are cached in <cache_dir>/image-hashes.json by content hash, so only
+  new or changed files are decoded
+- near duplicates: pHash neighbours within --threshold bits, found with a
+  BK-tree and confirmed by the dHash distance
+
+Each group is cross-checked with the chapters (![](...) references) and
+annotation SVGs (<image href>) that use its files. The suggested canonical
+file is the largest, then the most referenced, then the one with the
+cleanest name; the others are marked "delete" (unreferenced) or "relink".
+
+Usage:
+    python scripts/image_duplicates.py
+    python scripts/image_duplicates.py --threshold 4 --json duplicates.json
+    python scripts/image_duplicates.py --strict   # exit 1 if duplicates exist
+"""
+
+import json
+import multiprocessing
+import os
+import re
+import sys
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from catalog import open_catalog
+from config import load_config, Settings
+from image_cache import linked_images
+from quarto_project import QUARTO_CONFIG
+
+HASH_CACHE_FILE = "image-hashes.json"
+HASH_CACHE_VERSION = 1
+HASH_SIZE = 8
+PHASH_SIZE = 32
+DEFAULT_THRESHOLD = 6
+# Names produced by accidental copies: "Image62..PNG", "image62 (1).png", "image62 copy.png"
+MESSY_NAME_PATTERN = re.compile(r"\.\.|\(\d+\)|\bcopy\b|[A-Z]", re.IGNORECASE)
+
+
+class ImageInfo(NamedTuple):
+    path: str
+    sha256: str
+    size: int
+    width: int
+    height: int
+    references: Tuple[str, ...]
+
+    @property
+    def pixels(self) -> int:
+        return self.width * self.height
+
+
+class DuplicateGroup(NamedTuple):
+    kind: str  # "exact" or "near"
+    images: List[ImageInfo]  # canonical first
+    distance: int  # largest pHash distance to the canonical file
+
+    @property
+    def redundant_bytes(self) -> int:
+        return sum(image.size for image in self.images[1:])
+
+
+def thumbnails(path: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """Pool worker: grayscale 9×8 and 32×32 thumbnails, None if unreadable"""
+    try:
+        with Image.open(path) as image:
+            image.draft("L", (PHASH_SIZE * 4, PHASH_SIZE * 4))
+            gray = image.convert("L")
+    except (OSError, SyntaxError, ValueError):
+        return None
+    small = gray.resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS)
+    large = gray.resize((PHASH_SIZE, PHASH_SIZE), Image.Resampling.LANCZOS)
+    return np.asarray(small, dtype=np.float32), np.asarray(large, dtype=np.float32)
+
+
+def dct_matrix(n: int) -> np.ndarray:
+    """Orthonormal DCT-II matrix: dct(x) = D @ x"""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.sqrt(2 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+def pack_bits(bits: np.ndarray) -> List[int]:
+    """(n, 64) booleans -> n 64-bit integers"""
+    packed = np.packbits(bits.reshape(len(bits), -1), axis=1)
+    return [int(value) for value in packed.view(">u8").ravel()]
+
+
+def dhash_batch(small: np.ndarray) -> List[int]:
+    """dHash of a stack of 9×8 thumbnails: is each pixel brighter than its left neighbour"""
+    return pack_bits(small[:, :, 1:] > small[:, :, :-1])
+
+
+def phash_batch(large: np.ndarray) -> List[int]:
+    """pHash of a stack of 32×32 thumbnails: low DCT frequencies above their median"""
+    matrix = dct_matrix(PHASH_SIZE)
+    low = (matrix @ large @ matrix.T)[:, :HASH_SIZE, :HASH_SIZE].reshape(len(large), -1)
+    # The DC term only encodes brightness: leave it out of the median
+    median = np.median(low[:, 1:], axis=1, keepdims=True)
+    return pack_bits(low > median)
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class HashCache:
+    """Perceptual hashes keyed by file content hash"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.hashes: Dict[str, List[int]] = {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return
+        if data.get("version") == HASH_CACHE_VERSION:
+            self.hashes = {
+                sha256: [int(dhash, 16), int(phash, 16)]
+                for sha256, (dhash, phash) in data.get("hashes", {}).items()
+            }
+
+    def save(self, keep: Iterable[str]):
+        keep = set(keep)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": HASH_CACHE_VERSION,
+                    "hashes": {
+                        sha256: [f"{dhash:016x}", f"{phash:016x}"]
+                        for sha256, (dhash, phash) in sorted(self.hashes.items()) if sha256 in keep
+                    },
+                },
+                f, indent=1,
+            )
+        os.replace(tmp_path, self.path)
+
+
+def compute_hashes(images: List[ImageInfo], cache: HashCache, processes: int = 0) -> Dict[str, Tuple[int, int]]:
+    """(dHash, pHash) per path; decodes only content not yet in the cache"""
+    missing = {}
+    for image in images:
+        if image.sha256 not in cache.hashes:
+            missing.setdefault(image.sha256, image.path)
+    if missing:
+        paths = list(missing.values())
+        processes = processes or min(len(paths), multiprocessing.cpu_count(), 8)
+        if processes > 1:
+            with multiprocessing.Pool(processes=processes) as pool:
+                results = pool.map(thumbnails, paths, chunksize=4)
+        else:
+            results = [thumbnails(path) for path in paths]
+        decoded = []
+        for (sha256, path), result in zip(missing.items(), results):
+            if result is None:
+                print(f"Warning: cannot decode {path}")
+            else:
+                decoded.append((sha256, result))
+        if decoded:
+            small = np.stack([result[0] for _, result in decoded])
+            large = np.stack([result[1] for _, result in decoded])
+            for (sha256, _), dhash, phash in zip(decoded, dhash_batch(small), phash_batch(large)):
+                cache.hashes[sha256] = [dhash, phash]
+    return {
+        image.path: tuple(cache.hashes[image.sha256])
+        for image in images if image.sha256 in cache.hashes
+    }
+
+
+class BKTree:
+    """Burkhard–Keller tree over 64-bit hashes with the Hamming metric"""
+
+    def __init__(self):
+        # Node: [hash, items, {distance: child}]
+        self.root = None
+
+    def add(self, value: int, item):
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def query(self, value: int, radius: int) -> List[Tuple[int, object]]:
+        """(distance, item) of everything within radius of value"""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= radius:
+                found.extend((distance, item) for item in node[1])
+            # Triangle inequality: only children at |d - distance| <= radius can match
+            for child_distance, child in node[2].items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        return found
+
+
+def image_references(catalog, config: Settings) -> Dict[str, List[str]]:
+    """Project-relative image path -> chapters and SVGs that reference it"""
+    references: Dict[str, List[str]] = defaultdict(list)
+    for chapter in catalog.files("chapter"):
+        for image in catalog.images_of_chapters([chapter]):
+            references[image].append(chapter)
+    nsmap = config.get_nsmap()
+    for svg in catalog.files("annotation") + catalog.files("svg"):
+        try:
+            linked = linked_images(svg, nsmap)
+        except Exception as e:
+            print(f"Warning: cannot parse {svg}: {e}")
+            continue
+        for path in linked:
+            references[Path(os.path.relpath(path)).as_posix()].append(svg)
+    return references
+
+
+def canonical_key(image: ImageInfo):
+    messy = len(MESSY_NAME_PATTERN.findall(Path(image.path).name.replace(Path(image.path).suffix, "")))
+    messy += Path(image.path).suffix != Path(image.path).suffix.lower()
+    return (-image.pixels, -len(image.references), messy, len(image.path), image.path)
+
+
+def find_duplicates(
+    images: List[ImageInfo], hashes: Dict[str, Tuple[int, int]], threshold: int = DEFAULT_THRESHOLD
+) -> List[DuplicateGroup]:
+    """Group exact duplicates, then near duplicates among the distinct contents"""
+    by_content: Dict[str, List[ImageInfo]] = defaultdict(list)
+    for image in images:
+        by_content[image.sha256].append(image)
+
+    groups = []
+    representatives = []
+    for members in by_content.values():
+        members.sort(key=canonical_key)
+        if len(members) > 1:
+            groups.append(DuplicateGroup("exact", members, 0))
+        if members[0].path in hashes:
+            representatives.append(members[0])
+
+    # Union-find over distinct contents whose hashes are within threshold
+    parent = {image.path: image.path for image in representatives}
+
+    def find(path):
+        while parent[path] != path:
+            parent[path] = parent[parent[path]]
+            path = parent[path]
+        return path
+
+    tree = BKTree()
+    for image in representatives:
+        tree.add(hashes[image.path][1], image.path)
+    for image in representatives:
+        dhash, phash = hashes[image.path]
+        for _, other in tree.query(phash, threshold):
+            if other != image.path and hamming(dhash, hashes[other][0]) <= threshold * 2:
+                parent[find(other)] = find(image.path)
+
+    clusters: Dict[str, List[ImageInfo]] = defaultdict(list)
+    for image in representatives:
+        clusters[find(image.path)].append(image)
+    for members in clusters.values():
+        if len(members) < 2:
+            continue
+        members.sort(key=canonical_key)
+        canonical_phash = hashes[members[0].path][1]
+        distance = max(hamming(canonical_phash, hashes[image.path][1]) for image in members[1:])
+        groups.append(DuplicateGroup("near", members, distance))
+
+    groups.sort(key=lambda group: (-group.redundant_bytes, group.images[0].path))
+    return groups
+
+
+def collect_images(config: Settings) -> List[ImageInfo]:
+    with open_catalog(config) as catalog:
+        references = image_references(catalog, config)
+        return [
+            ImageInfo(path, sha256, size, width or 0, height or 0, tuple(sorted(references.get(path, []))))
+            for path, sha256, size, width, height in catalog.images()
+        ]
+
+
+def print_report(groups: List[DuplicateGroup]):
+    for group in groups:
+        title = "Exact duplicates" if group.kind == "exact" else f"Near duplicates (pHash distance ≤ {group.distance})"
+        print(f"\n{title}, {group.redundant_bytes / 1024:.0f} KB redundant:")
+        for index, image in enumerate(group.images):
+            marker = "✓" if index == 0 else " "
+            used = f"used by {', '.join(image.references)}" if image.references else "unreferenced"
+            action = "" if index == 0 else (" → relink" if image.references else " → delete")
+            print(f"  {marker} {image.path}  {image.width}×{image.height}  {used}{action}")
+
+
+def to_json(groups: List[DuplicateGroup]) -> List[Dict]:
+    return [
+        {
+            "kind": group.kind,
+            "distance": group.distance,
+            "canonical": group.images[0].path,
+            "redundant_bytes": group.redundant_bytes,
+            "files": [
+                {
+                    "path": image.path,
+                    "size": image.size,
+                    "width": image.width,
+                    "height": image.height,
+                    "references": list(image.references),
+                }
+                for image in group.images
+            ],
+        }
+        for group in groups
+    ]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Find exact and near-duplicate images")
+    parser.add_argument(
+        "--threshold",
+        type=int,
+        default=DEFAULT_THRESHOLD,
+        help=f"Maximum pHash distance in bits of near duplicates (default: {DEFAULT_THRESHOLD}, 0 disables)",
+    )
+    parser.add_argument("--json", default=None, help="Also write the groups to this JSON file")
+    parser.add_argument("--strict", action="store_true", help="Exit with code 1 if duplicates exist")
+    parser.add_argument("--config", default="config.toml", help="Configuration TOML file name")
+    args = parser.parse_args()
+
+    if not Path(QUARTO_CONFIG).exists():
+        print(f"Error: {QUARTO_CONFIG} not found. Please run from project root.")
+        sys.exit(1)
+
+    config = load_config(args.config)
+    images = collect_images(config)
+    cache = HashCache(Path(config.cache.cache_dir) / HASH_CACHE_FILE)
+    hashes = compute_hashes(images, cache)
+    cache.save(image.sha256 for image in images)
+
+    groups = find_duplicates(images, hashes if args.threshold else {}, args.threshold)
+    print_report(groups)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(to_json(groups), f, ensure_ascii=False, indent=1)
+
+    redundant = sum(group.redundant_bytes for group in groups)
+    exact = sum(len(group.images) - 1 for group in groups if group.kind == "exact")
+    near = sum(len(group.images) - 1 for group in groups if group.kind == "near")
+    print(f"\n{'✓' if not groups else '⚠️'} {len(images)} images: {exact} exact and {near} near duplicates, "
+          f"{redundant / 1024 / 1024:.1f} MB redundant")
+    if groups and args.strict:
+        sys.exit(1)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Generate the fast "text-only" preview profile (_quarto-fast.yml) from _quarto.yml.
+
+Quarto merges a profile into _quarto.yml and concatenates arrays instead of
+replacing them, so the profile holds only additions: it never repeats
+book.chapters, filters or project.post-render of the main configuration.
+Preview levels:
+
+- images: full    - run the complete image pre-render (default)
+- images: cached  - reuse exports already present in img/, never call Inkscape
+- images: skip    - do not touch images at all during pre-render
+- --strip-figures - drop all images with build/remove_images.lua (appended
+                    to the filters of _quarto.yml)
+- --chapters      - render only the selected chapters (index.qmd is always
+                    kept) through project.render, which _quarto.yml does not set
+- --post-render   - post-render steps to keep, none by default: the other
+                    scripts exit early (quarto_project.post_render_enabled)
+
+Usage:
+    python scripts/make_fast_profile.py --images skip --strip-figures
+    quarto render --profile fast
+"""
+
+import re
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import yaml
+
+from quarto_project import QUARTO_CONFIG, flatten_chapters, load_quarto_config
+
+PROFILE_NAME = "fast"
+PROFILE_SECTION = "fast-preview"
+IMAGE_MODES = ("full", "cached", "skip")
+STRIP_FIGURES_FILTER = "build/remove_images.lua"
+POST_RENDER_SCRIPT_PATTERN = re.compile(r"\bscripts/(\w+\.py)\b")
+
+
+def filter_chapters(entries: List[Any], selected: List[str]) -> List[Any]:
+    """Keep only selected chapters, dropping parts that become empty"""
+    result = []
+    for entry in entries:
+        if isinstance(entry, str):
+            if entry in selected or entry == "index.qmd":
+                result.append(entry)
+        elif isinstance(entry, dict) and "chapters" in entry:
+            chapters = filter_chapters(entry["chapters"], selected)
+            if chapters:
+                part = dict(entry)
+                part["chapters"] = chapters
+                result.append(part)
+        elif isinstance(entry, dict) and entry.get("file") in selected:
+            result.append(entry)
+    return result
+
+
+def post_render_scripts(config: Dict[str, Any]) -> List[str]:
+    """Names of the scripts run by project.post-render of the main configuration"""
+    steps = (config.get("project") or {}).get("post-render") or []
+    if isinstance(steps, str):
+        steps = [steps]
+    return [name for step in steps for name in POST_RENDER_SCRIPT_PATTERN.findall(step)]
+
+
+def build_fast_profile(
+    config: Dict[str, Any],
+    images: str = "full",
+    strip_figures: bool = False,
+    chapters: Optional[List[str]] = None,
+    post_render: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """Build the fast profile: only the settings Quarto merges into the main configuration"""
+    if images not in IMAGE_MODES:
+        raise ValueError(f"Unknown image mode: {images}")
+
+    known_steps = post_render_scripts(config)
+    unknown = [name for name in post_render or [] if name not in known_steps]
+    if unknown:
+        raise ValueError(f"Post-render steps not found in {QUARTO_CONFIG}: {', '.join(unknown)}")
+
+    # Image handling and post-render steps are decided by the scripts
+    # themselves: they read the fast-preview section of the active profile
+    # (see quarto_project.py).
+    profile: Dict[str, Any] = {
+        PROFILE_SECTION: {
+            "images": images,
+            "strip-figures": strip_figures,
+            "post-render": list(post_render or []),
+        }
+    }
+
+    if strip_figures and STRIP_FIGURES_FILTER not in (config.get("filters") or []):
+        profile["filters"] = [STRIP_FIGURES_FILTER]
+
+    if chapters:
+        book = config.get("book") or {}
+        known = set(flatten_chapters(book.get("chapters", [])))
+        unknown = [chapter for chapter in chapters if chapter not in known]
+        if unknown:
+            raise ValueError(f"Chapters not found in {QUARTO_CONFIG}: {', '.join(unknown)}")
+
+        selected = flatten_chapters(filter_chapters(book.get("chapters", []), chapters))
+        profile[PROFILE_SECTION]["chapters"] = selected
+        profile["project"] = {"render": list(selected)}
+
+    return profile
+
+
+def write_profile(profile: Dict[str, Any], output_path: Path):
+    """Write the generated profile with a do-not-edit header"""
+    header = (
+        f"# Generated by scripts/make_fast_profile.py from {QUARTO_CONFIG}.\n"
+        f"# Do not edit by hand: re-run the generator instead.\n"
+    )
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write(header)
+        yaml.dump(profile, f, default_flow_style=False, allow_unicode=True, sort_keys=False)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate _quarto-fast.yml from _quarto.yml")
+    parser.add_argument(
+        "--images",
+        choices=IMAGE_MODES,
+        default="cached",
+        help="Image pre-render mode (default: cached)",
+    )
+    parser.add_argument(
+        "--strip-figures",
+        action="store_true",
+        help=f"Remove all images from the output using {STRIP_FIGURES_FILTER}",
+    )
+    parser.add_argument(
+        "--chapters",
+        nargs="+",
+        default=None,
+        help="Render only these chapters (paths as listed in _quarto.yml)",
+    )
+    parser.add_argument(
+        "--post-render",
+        nargs="*",
+        default=[],
+        metavar="SCRIPT",
+        help="Post-render scripts to keep, e.g. search_index.py (default: none)",
+    )
+    parser.add_argument("--config", default=QUARTO_CONFIG, help="Source Quarto config")
+    parser.add_argument(
+        "--output", default=f"_quarto-{PROFILE_NAME}.yml", help="Generated profile path"
+    )
+    args = parser.parse_args()
+
+    if not Path(args.config).exists():
+        print(f"Error: {args.config} not found. Please run from project root.")
+        sys.exit(1)
+
+    config = load_quarto_config(args.config)
+    try:
+        profile = build_fast_profile(
+            config,
+            images=args.images,
+            strip_figures=args.strip_figures,
+            chapters=args.chapters,
+            post_render=args.post_render,
+        )
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    write_profile(profile, Path(args.output))
+    print(f"✓ Generated {args.output} (images: {args.images}, "
+          f"strip figures: {args.strip_figures}, "
+          f"chapters: {len(args.chapters) if args.chapters else 'all'}, "
+          f"post-render: {', '.join(args.post_render) or 'none'})")
+    print(f"Render with: quarto render --profile {PROFILE_NAME}")
+
+
+if __name__ == "__main__":
+    main()
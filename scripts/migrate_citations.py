@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Migrate numeric citations to pandoc citations.
+
+Chapters written against the static src/Bibliography.qmd cite by number:
+"[12]", "[3, 5–7]". This script rewrites them to pandoc citations
+("[@key]", "[@a; @b; @c; @d]") using the number → key table of
+bibliography-mapping.md, or computes the table with the matcher of
+create_bibliography_mapping.py (--compute). All chapters are scanned once
+with a single compiled pattern; ranges are expanded. A citation containing
+a number without a key is left unchanged and reported.
+
+Once no numeric citations are left, citeproc produces the bibliography from
+references.bib and src/Bibliography.qmd is not needed in the build.
+
+Usage:
+    python scripts/migrate_citations.py --dry-run
+    python scripts/migrate_citations.py
+    python scripts/migrate_citations.py --compute
+"""
+
+import difflib
+import os
+import re
+import sys
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from apply_corrections import write_atomic
+from quarto_project import QUARTO_CONFIG, get_chapters
+
+MAPPING_FILE = "bibliography-mapping.md"
+NUMBERED_BIBLIOGRAPHY = "src/Bibliography.qmd"
+REFERENCES = "references.bib"
+MAPPING_ROW_PATTERN = re.compile(r"^\|\s*(\d+)\s*\|\s*@?([^|\s]+(?: [^|\s]+)*)\s*\|")
+# [12], [3, 5–7], [1-3; 8]; not links "[1](...)", footnote labels "[1]:" or spans "[1]{...}"
+NUMERIC_CITATION_PATTERN = re.compile(
+    r"(?<![\]\w^])\[(\s*\d+(?:\s*[-–—]\s*\d+)?(?:\s*[,;]\s*\d+(?:\s*[-–—]\s*\d+)?)*\s*)\](?![(\[{:])"
+)
+RANGE_PATTERN = re.compile(r"(\d+)\s*[-–—]\s*(\d+)")
+FENCE_PATTERN = re.compile(r"^\s*(```|~~~)")
+# Longer "ranges" are more likely page numbers or typos than citations
+MAX_RANGE = 50
+
+
+class Unmapped(NamedTuple):
+    path: str
+    line: int
+    citation: str
+    numbers: List[int]
+
+
+def load_mapping(path=MAPPING_FILE) -> Dict[int, str]:
+    """Read number → key from bibliography-mapping.md ("NOT FOUND" rows are skipped)"""
+    mapping = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            match = MAPPING_ROW_PATTERN.match(line)
+            if match and match.group(2) != "NOT FOUND":
+                mapping[int(match.group(1))] = match.group(2)
+    return mapping
+
+
+def compute_mapping(bibliography=NUMBERED_BIBLIOGRAPHY, references=REFERENCES) -> Dict[int, str]:
+    """Match the numbered bibliography against references.bib with create_bibliography_mapping.py"""
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    from create_bibliography_mapping import match_entries, parse_bibliography_qmd, parse_bibtex
+
+    matches = match_entries(parse_bibliography_qmd(Path(bibliography)), parse_bibtex(Path(references)))
+    return {number: key for number, key, _, _ in matches if key}
+
+
+def expand_numbers(citation: str) -> Optional[List[int]]:
+    """"3, 5–7" -> [3, 5, 6, 7]; None if a range is reversed or too long"""
+    numbers = []
+    for part in re.split(r"[,;]", citation):
+        part = part.strip()
+        match = RANGE_PATTERN.fullmatch(part)
+        if match:
+            first, last = int(match.group(1)), int(match.group(2))
+            if not 0 < last - first <= MAX_RANGE:
+                return None
+            numbers.extend(range(first, last + 1))
+        else:
+            numbers.append(int(part))
+    return numbers
+
+
+def migrate_text(text: str, mapping: Dict[int, str], path: str = "") -> Tuple[str, int, List[Unmapped]]:
+    """Rewrite the numeric citations of a chapter, return (text, rewritten count, unmapped)"""
+    lines = text.splitlines(keepends=True)
+    rewritten = 0
+    unmapped = []
+    in_fence = None
+    for index, line in enumerate(lines):
+        fence = FENCE_PATTERN.match(line)
+        if fence:
+            if in_fence is None:
+                in_fence = fence.group(1)
+            elif fence.group(1) == in_fence:
+                in_fence = None
+            continue
+        if in_fence is not None or "[" not in line:
+            continue
+
+        def replace(match):
+            nonlocal rewritten
+            numbers = expand_numbers(match.group(1))
+            if numbers is None:
+                return match.group(0)
+            missing = [number for number in numbers if number not in mapping]
+            if missing:
+                unmapped.append(Unmapped(path, index + 1, match.group(0), missing))
+                return match.group(0)
+            rewritten += 1
+            # Several numbers may map to the same key
+            keys = list(dict.fromkeys(mapping[number] for number in numbers))
+            return "[" + "; ".join(f"@{key}" for key in keys) + "]"
+
+        lines[index] = NUMERIC_CITATION_PATTERN.sub(replace, line)
+    return "".join(lines), rewritten, unmapped
+
+
+def migrate_chapters(chapters: List[str], mapping: Dict[int, str], dry_run: bool = False):
+    """Migrate all chapters, return (rewritten count, unmapped)"""
+    total = 0
+    unmapped = []
+    for chapter in chapters:
+        if not Path(chapter).is_file() or Path(chapter).as_posix() == NUMBERED_BIBLIOGRAPHY:
+            continue
+        with open(chapter, "r", encoding="utf-8", newline="") as f:
+            text = f.read()
+        new_text, rewritten, chapter_unmapped = migrate_text(text, mapping, chapter)
+        unmapped += chapter_unmapped
+        if not rewritten:
+            continue
+        sys.stdout.writelines(difflib.unified_diff(
+            text.splitlines(keepends=True), new_text.splitlines(keepends=True),
+            fromfile=f"a/{chapter}", tofile=f"b/{chapter}",
+        ))
+        if not dry_run:
+            write_atomic(chapter, new_text)
+        total += rewritten
+    return total, unmapped
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Rewrite numeric citations to pandoc citations")
+    parser.add_argument("--mapping", default=MAPPING_FILE, help="Number → key table")
+    parser.add_argument(
+        "--compute", action="store_true",
+        help=f"Compute the mapping from {NUMBERED_BIBLIOGRAPHY} and {REFERENCES} instead of reading it",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="Only show the diff, do not write files")
+    args = parser.parse_args()
+
+    if not Path(QUARTO_CONFIG).exists():
+        print(f"Error: {QUARTO_CONFIG} not found. Please run from project root.")
+        sys.exit(1)
+
+    mapping = compute_mapping() if args.compute else load_mapping(args.mapping)
+    print(f"Loaded {len(mapping)} numbered references")
+
+    chapters = get_chapters()
+    rewritten, unmapped = migrate_chapters(chapters, mapping, dry_run=args.dry_run)
+    for item in unmapped:
+        numbers = ", ".join(str(number) for number in item.numbers)
+        print(f"❌ {item.path}:{item.line}: {item.citation}: no key for {numbers}")
+
+    verb = "Would rewrite" if args.dry_run else "Rewrote"
+    print(f"\n✓ {verb} {rewritten} numeric citations, {len(unmapped)} left unmapped")
+    if NUMBERED_BIBLIOGRAPHY in chapters:
+        print(f"Note: {NUMBERED_BIBLIOGRAPHY} is still listed in {QUARTO_CONFIG}; "
+              "once no numeric citations remain it can be removed (citeproc builds the list)")
+    if unmapped:
+        sys.exit(1)
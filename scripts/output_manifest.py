@@ -0,0 +1,110 @@
+"""
+Record of every file written by the image pipeline.
+
+prepare_images.py stores the outputs of each annotation source in
+<cache_dir>/image-outputs.json (project-relative paths):
+
+    {"version": 1,
+     "sources": {"img/a/annotation.svg": ["img/a/annotation_styled.svg", ...]},
+     "inputs": {"img/a/annotation.svg": {"img/a/annotation.svg": "<sha256>",
+                                         "img/a/image1.png": "<sha256>"}}}
+
+clean_generated_images.py deletes exactly these files. "inputs" holds the
+hashes of the SVG and its linked rasters at export time: catalog.py compares
+them to decide staleness, since outputs restored from the image cache keep
+the mtime they had when cached. Partial runs merge their sources into the
+existing record. Files tracked by git are sources:
+the pipeline neither overwrites nor deletes them.
+"""
+
+import json
+import os
+import subprocess
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from config import Settings
+from image_cache import hash_file, linked_images
+
+OUTPUT_MANIFEST_VERSION = 1
+OUTPUT_MANIFEST_FILE = "image-outputs.json"
+
+
+@lru_cache(maxsize=None)
+def tracked_files(project_root: Path) -> FrozenSet[Path]:
+    """Files tracked by git, empty outside a repository or without git"""
+    try:
+        result = subprocess.run(
+            ["git", "ls-files", "-z"], cwd=project_root, capture_output=True, timeout=60
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return frozenset()
+    if result.returncode != 0:
+        return frozenset()
+    return frozenset(
+        (project_root / name).resolve()
+        for name in result.stdout.decode("utf-8", "surrogateescape").split("\0") if name
+    )
+
+
+def output_manifest_path(config: Settings) -> Path:
+    return Path(config.cache.cache_dir) / OUTPUT_MANIFEST_FILE
+
+
+def load_record(path) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+    if data.get("version") != OUTPUT_MANIFEST_VERSION:
+        return {}
+    return data
+
+
+def load_outputs(path) -> Dict[str, List[str]]:
+    """Return recorded outputs by source, empty if there is no valid record"""
+    return load_record(path).get("sources", {})
+
+
+def load_inputs(path) -> Dict[str, Dict[str, str]]:
+    """Return {source: {input: sha256}} hashed at export time, empty if not recorded"""
+    return load_record(path).get("inputs", {})
+
+
+def save_outputs(path, sources: Dict[str, List[str]], inputs: Optional[Dict[str, Dict[str, str]]] = None):
+    """Write the record atomically"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "version": OUTPUT_MANIFEST_VERSION,
+                "sources": dict(sorted(sources.items())),
+                "inputs": dict(sorted((inputs or {}).items())),
+            },
+            f, ensure_ascii=False, indent=1,
+        )
+    os.replace(tmp_path, path)
+
+
+def input_hashes(source, nsmap: Dict[str, str]) -> Dict[str, str]:
+    """Hashes of an annotation SVG and the rasters it links, by project-relative path"""
+    return {
+        Path(os.path.relpath(input_path)).as_posix(): hash_file(input_path)
+        for input_path in [source, *linked_images(source, nsmap)]
+    }
+
+
+def record_outputs(path, results: Iterable[Tuple[str, List[str]]], nsmap: Dict[str, str]):
+    """Merge (source, outputs) pairs into the record, with the current input hashes"""
+    record = load_record(path)
+    sources = record.get("sources", {})
+    inputs = record.get("inputs", {})
+    for source, outputs in results:
+        key = Path(os.path.relpath(source)).as_posix()
+        sources[key] = sorted({Path(os.path.relpath(output)).as_posix() for output in outputs})
+        inputs[key] = input_hashes(source, nsmap)
+    save_outputs(path, sources, inputs)
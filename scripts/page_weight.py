@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Page-weight report and budget gate for the rendered book (post-render).
+
+Walks the HTML pages of the output directory, resolves the images, scripts
+and styles each page loads (and the rasters embedded in its SVGs) and
+estimates the bytes transferred on a first visit: text assets gzipped as
+GitHub Pages serves them, binary assets as they are.
+
+The weights are compared with the baseline JSON and the budgets of
+[budget] in styles/config.toml:
+- a page growing by more than max_growth of its baseline weight regresses;
+  the assets responsible (new or grown) are named
+- pages above max_page_kb and assets above max_asset_kb are reported
+
+Content hashes in file names (fingerprint_assets.py) are ignored when
+comparing with the baseline. With on_regression = "fail" (or --fail) the
+script exits with code 1 on any problem.
+
+Usage:
+    python scripts/page_weight.py                     # report and check
+    python scripts/page_weight.py --update-baseline   # accept current weights
+"""
+
+import gzip
+import json
+import os
+import sys
+from pathlib import Path, PurePosixPath
+from typing import Dict, List, NamedTuple
+
+from lxml import etree
+from lxml import html as lxml_html
+
+from config import load_config, BudgetConfig
+from fingerprint_assets import FINGERPRINTED_PATTERN, resolve_reference
+from quarto_project import QUARTO_CONFIG, load_quarto_config, post_render_enabled
+
+BASELINE_VERSION = 1
+COMPRESSED_SUFFIXES = {".html", ".css", ".js", ".svg", ".json", ".xml", ".txt"}
+# Elements and attributes a browser fetches when the page loads
+PAGE_RESOURCES = (
+    ("img", "src"),
+    ("script", "src"),
+    ("link", "href"),
+    ("source", "src"),
+    ("video", "poster"),
+    ("object", "data"),
+    ("embed", "src"),
+)
+LOADED_LINK_RELS = {"stylesheet", "icon", "preload", "modulepreload"}
+XLINK_HREF = "{http://www.w3.org/1999/xlink}href"
+
+
+class PageWeight(NamedTuple):
+    page: str
+    html: int
+    assets: Dict[str, int]
+
+    @property
+    def total(self) -> int:
+        return self.html + sum(self.assets.values())
+
+
+class Problem(NamedTuple):
+    page: str
+    message: str
+
+    def __str__(self):
+        return f"{self.page}: {self.message}"
+
+
+def stable_name(path: str) -> str:
+    """Asset path without the content hash, for comparisons across renders"""
+    return FINGERPRINTED_PATTERN.sub(lambda m: "." + m.group(0).rsplit(".", 1)[1], path)
+
+
+class WeightAnalyzer:
+    """Estimates transferred bytes, caching per asset"""
+
+    def __init__(self, output_dir: Path):
+        self.output_dir = output_dir
+        self.sizes: Dict[str, int] = {}
+        self.embedded: Dict[str, List[str]] = {}
+
+    def transferred(self, relative: str) -> int:
+        if relative not in self.sizes:
+            path = self.output_dir / relative
+            if path.suffix.lower() in COMPRESSED_SUFFIXES:
+                self.sizes[relative] = len(gzip.compress(path.read_bytes(), compresslevel=6))
+            else:
+                self.sizes[relative] = path.stat().st_size
+        return self.sizes[relative]
+
+    def svg_images(self, relative: str) -> List[str]:
+        """Rasters an SVG asset embeds by (relative) href"""
+        if relative not in self.embedded:
+            images = []
+            try:
+                tree = etree.parse(str(self.output_dir / relative))
+                for element in tree.iter("{http://www.w3.org/2000/svg}image"):
+                    href = element.get("href") or element.get(XLINK_HREF) or ""
+                    target = resolve_reference(href, PurePosixPath(relative))
+                    if target is not None and (self.output_dir / target).is_file():
+                        images.append(target.as_posix())
+            except (etree.XMLSyntaxError, OSError):
+                pass
+            self.embedded[relative] = images
+        return self.embedded[relative]
+
+    def page_weight(self, page: Path) -> PageWeight:
+        relative_page = PurePosixPath(page.relative_to(self.output_dir).as_posix())
+        tree = lxml_html.parse(str(page), parser=lxml_html.HTMLParser(encoding="utf-8"))
+        assets: Dict[str, int] = {}
+        for tag, attribute in PAGE_RESOURCES:
+            for element in tree.iter(tag):
+                if tag == "link" and not LOADED_LINK_RELS.intersection((element.get("rel") or "").lower().split()):
+                    continue
+                target = resolve_reference(element.get(attribute) or "", relative_page)
+                if target is None or not (self.output_dir / target).is_file():
+                    continue
+                target = target.as_posix()
+                assets[target] = self.transferred(target)
+                if target.endswith(".svg") and tag in ("img", "object", "embed"):
+                    for image in self.svg_images(target):
+                        assets[image] = self.transferred(image)
+        return PageWeight(relative_page.as_posix(), self.transferred(relative_page.as_posix()), assets)
+
+
+def analyze(output_dir: Path) -> List[PageWeight]:
+    analyzer = WeightAnalyzer(output_dir)
+    pages = sorted(
+        page for page in output_dir.rglob("*.html")
+        if "site_libs" not in page.relative_to(output_dir).parts
+    )
+    return [analyzer.page_weight(page) for page in pages]
+
+
+def to_baseline(weights: List[PageWeight]) -> Dict:
+    return {
+        "version": BASELINE_VERSION,
+        "pages": {
+            weight.page: {
+                "total": weight.total,
+                "html": weight.html,
+                "assets": {stable_name(path): size for path, size in sorted(weight.assets.items())},
+            }
+            for weight in weights
+        },
+    }
+
+
+def load_baseline(path) -> Dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+    return data.get("pages", {}) if data.get("version") == BASELINE_VERSION else {}
+
+
+def check_budgets(weights: List[PageWeight], baseline: Dict, budget: BudgetConfig) -> List[Problem]:
+    """Regressions against the baseline and absolute budget violations"""
+    problems = []
+    oversized = set()
+    for weight in weights:
+        if budget.max_page_kb and weight.total > budget.max_page_kb * 1024:
+            problems.append(Problem(
+                weight.page, f"{weight.total / 1024:.0f} KB exceeds the page budget of {budget.max_page_kb} KB"
+            ))
+        for path, size in weight.assets.items():
+            if budget.max_asset_kb and size > budget.max_asset_kb * 1024 and path not in oversized:
+                oversized.add(path)
+                problems.append(Problem(
+                    weight.page, f"{path}: {size / 1024:.0f} KB exceeds the asset budget of {budget.max_asset_kb} KB"
+                ))
+
+        previous = baseline.get(weight.page)
+        if not previous or weight.total <= previous["total"] * (1 + budget.max_growth):
+            continue
+        growth = weight.total - previous["total"]
+        # Name the assets responsible: new ones and grown ones, largest first
+        old_assets = previous.get("assets", {})
+        changes = sorted(
+            (
+                (size - old_assets.get(stable_name(path), 0), path)
+                for path, size in weight.assets.items()
+                if size > old_assets.get(stable_name(path), 0)
+            ),
+            reverse=True,
+        )
+        if weight.html - previous.get("html", 0) >= 1024:
+            changes.append((weight.html - previous.get("html", 0), f"{weight.page} (HTML)"))
+            changes.sort(reverse=True)
+        culprits = ", ".join(f"{path} +{delta / 1024:.0f} KB" for delta, path in changes[:5])
+        problems.append(Problem(
+            weight.page,
+            f"grew {growth / 1024:.0f} KB to {weight.total / 1024:.0f} KB "
+            f"(+{growth / previous['total']:.0%}, budget +{budget.max_growth:.0%}): {culprits}",
+        ))
+    return problems
+
+
+def print_report(weights: List[PageWeight], baseline: Dict, top: int = 10):
+    print(f"{'KB':>8} {'Δ KB':>7} {'assets':>6}  page")
+    for weight in sorted(weights, key=lambda w: -w.total):
+        previous = baseline.get(weight.page)
+        delta = f"{(weight.total - previous['total']) / 1024:+7.0f}" if previous else f"{'new':>7}"
+        print(f"{weight.total / 1024:8.0f} {delta} {len(weight.assets):6d}  {weight.page}")
+
+    figures = {}
+    for weight in weights:
+        for path, size in weight.assets.items():
+            if "site_libs" not in path and "search-index" not in path:
+                figures[path] = size
+    if figures:
+        print("\nHeaviest figures and downloads:")
+        for path, size in sorted(figures.items(), key=lambda item: -item[1])[:top]:
+            print(f"{size / 1024:8.0f}  {path}")
+
+
+def save_baseline(path, weights: List[PageWeight]):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(to_baseline(weights), f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Report page weights and check them against the budget")
+    parser.add_argument(
+        "--output-dir",
+        default=None,
+        help="Rendered book (default: $QUARTO_PROJECT_OUTPUT_DIR or project.output-dir)",
+    )
+    parser.add_argument("--baseline", default=None, help="Baseline JSON (default: [budget] baseline)")
+    parser.add_argument("--update-baseline", action="store_true", help="Store the current weights as baseline")
+    parser.add_argument("--fail", action="store_true", help="Exit with code 1 on budget problems")
+    parser.add_argument("--quiet", action="store_true", help="Only print budget problems")
+    args = parser.parse_args()
+
+    if not Path(QUARTO_CONFIG).exists():
+        print(f"Error: {QUARTO_CONFIG} not found. Please run from project root.")
+        sys.exit(1)
+
+    if not post_render_enabled(__file__):
+        print(f"Skipping {Path(__file__).name} (not in fast-preview.post-render)")
+        sys.exit(0)
+
+    budget = load_config().budget
+    baseline_path = args.baseline or budget.baseline
+    output_dir = Path(
+        args.output_dir
+        or os.environ.get("QUARTO_PROJECT_OUTPUT_DIR")
+        or (load_quarto_config().get("project") or {}).get("output-dir", "_book")
+    )
+    weights = analyze(output_dir)
+    if not weights:
+        print(f"No HTML pages in {output_dir}, page weights not checked")
+        sys.exit(0)
+
+    if args.update_baseline:
+        save_baseline(baseline_path, weights)
+        print(f"✓ Stored weights of {len(weights)} pages in {baseline_path}")
+        sys.exit(0)
+
+    baseline = load_baseline(baseline_path)
+    if not args.quiet:
+        print_report(weights, baseline)
+    problems = check_budgets(weights, baseline, budget)
+    fail = args.fail or budget.on_regression == "fail"
+    marker = "❌" if fail else "⚠️"
+    for problem in problems:
+        print(f"{marker} {problem}")
+    if not baseline:
+        print(f"No baseline in {baseline_path}; store one with --update-baseline")
+    total = sum(weight.total for weight in weights)
+    print(f"\n{'✓' if not problems else marker} {len(weights)} pages, {total / 1024 / 1024:.1f} MB, "
+          f"{len(problems)} budget problem(s)")
+    if problems and fail:
+        sys.exit(1)
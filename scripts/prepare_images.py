@@ -1,12 +1,17 @@
 from functools import partial
 import os
 from lxml import etree
+from PIL import Image
 import subprocess
 import multiprocessing
 import re
+import sys
 from pathlib import Path
-from typing import Dict, Any, Optional
-from config import load_config, Settings
+from typing import Dict, Any, List, Optional, Set
+from config import load_config, ExportProfile, Settings
+from image_cache import ImageCache, linked_images
+from discovery import AnnotationMatcher, discover, make_discovery_index
+from output_manifest import output_manifest_path, record_outputs, tracked_files
 
 
 def parse_css_file(css_path):
@@ -131,56 +136,217 @@ def get_layer_name(element, nsmap: Dict[str, str], style_keys):
     return None
 
 
+SHAPE_TYPES = ["path", "circle", "ellipse", "rect"]
+XML_NAMESPACE = "{http://www.w3.org/XML/1998/namespace}"
+
+
+def streamed_start_tag(element, parent):
+    """Attributes and new namespace declarations for etree.xmlfile.element()"""
+    # xmlfile does not bind the reserved xml prefix itself (it would emit ns0:space)
+    attrib = {
+        (f"xml:{name[len(XML_NAMESPACE):]}" if name.startswith(XML_NAMESPACE) else name): value
+        for name, value in element.attrib.items()
+    }
+    # Declare only namespaces not already in scope
+    parent_nsmap = parent.nsmap if parent is not None else {}
+    nsmap = {
+        prefix: uri for prefix, uri in element.nsmap.items()
+        if parent_nsmap.get(prefix) != uri
+    }
+    # The last prefix mapped to a URI wins, keep the default namespace unprefixed
+    nsmap = dict(sorted(nsmap.items(), key=lambda item: item[0] is None))
+    return attrib, nsmap
+
+
+def flush_before_child(xf, parent, child):
+    """Write text preceding child inside parent and free the written sibling
+
+    Text before the first child is parent.text, otherwise the tail of the
+    previous sibling. The previous sibling is already serialized, so it is
+    removed from the tree to keep memory flat.
+    """
+    previous = child.getprevious()
+    if previous is None:
+        if parent.text:
+            xf.write(parent.text)
+        return
+    if previous.tail:
+        xf.write(previous.tail)
+    parent.remove(previous)
+
+
+def is_relative_href(href: str) -> bool:
+    """Check whether an <image> link is a path relative to the SVG"""
+    return not href.startswith("/") and not re.match(r"[A-Za-z][\w+.-]*:", href)
+
+
 def apply_style_to_file(
     file_path: str,
     styles: Dict[str, Dict[str, Any]],
     nsmap: Dict[str, str],
     output_postfix: str = "styled",
+    output_dir: Optional[str] = None,
 ):
-    xml_model = etree.parse(file_path)
-    styled_elements = 0
-
-    # Find all path elements
-    for path_object in xml_model.findall(".//svg:path", namespaces=nsmap):
-        layer_name = get_layer_name(path_object, nsmap, styles.keys())
-        if layer_name and layer_name in styles:
-            path_object.attrib["style"] = format_style_xml(styles[layer_name])
-            styled_elements += 1
-        else:
-            if layer_name:
-                print(
-                    f"Warning: No style defined for layer '{layer_name}' in {file_path}"
-                )
-
-    # Also process circles, ellipses, and rects if present
-    for shape_type in ["circle", "ellipse", "rect"]:
-        for shape_object in xml_model.findall(f".//svg:{shape_type}", namespaces=nsmap):
-            layer_name = get_layer_name(shape_object, nsmap, styles.keys())
-            if layer_name and layer_name in styles:
-                shape_object.attrib["style"] = format_style_xml(styles[layer_name])
-                styled_elements += 1
-
-    print(f"Styled {styled_elements} elements in {file_path}")
+    """Apply layer styles to shapes and write <name>_<postfix>.svg
+
+    The result goes to output_dir (default: next to file_path); relative
+    <image> links are rewritten so they still resolve from there.
+
+    The document is streamed: iterparse reads it, etree.xmlfile writes each
+    element as soon as it starts, and written elements are removed from the
+    tree. Nothing is re-indented, so large embedded <image> payloads are
+    copied once and per-worker memory does not grow with the SVG size.
+    """
+    # Resolve qualified names once
+    label_attr = f"{{{nsmap['inkscape']}}}label"
+    path_tag = f"{{{nsmap['svg']}}}path"
+    shape_tags = {f"{{{nsmap['svg']}}}{shape_type}" for shape_type in SHAPE_TYPES}
+    image_tag = f"{{{nsmap['svg']}}}image"
+    href_attrs = (f"{{{nsmap['xlink']}}}href", "href")
+    style_keys = styles.keys()
+    formatted_styles = {name: format_style_xml(style) for name, style in styles.items()}
 
     # Create output path with absolute path
     file_path = os.path.abspath(file_path)
     base_name = os.path.basename(file_path).rsplit(".", 1)[0]
     output_filename = f"{base_name}_{output_postfix}.svg"
-    output_filepath = os.path.join(os.path.dirname(file_path), output_filename)
+    source_dir = os.path.dirname(file_path)
+    output_dir = os.path.abspath(output_dir) if output_dir else source_dir
+    os.makedirs(output_dir, exist_ok=True)
+    output_filepath = os.path.join(output_dir, output_filename)
 
-    # Write styled SVG
-    xml_model.write(
-        output_filepath, pretty_print=True, xml_declaration=True, encoding="UTF-8"
-    )
+    styled_elements = 0
+    # Open elements: (element, xmlfile context manager)
+    stack = []
+
+    # Unbuffered: the default output buffer keeps growing for documents with
+    # large payloads instead of streaming them to disk
+    with etree.xmlfile(output_filepath, encoding="UTF-8", buffered=False) as xf:
+        xf.write_declaration()
+        for event, element in etree.iterparse(
+            file_path, events=("start", "end", "comment", "pi"), huge_tree=True
+        ):
+            if event == "end":
+                # Trailing text: after the last child, or the whole text of a leaf
+                last_child = element[-1] if len(element) else None
+                text = last_child.tail if last_child is not None else element.text
+                if text:
+                    xf.write(text)
+                context = stack.pop()[1]
+                context.__exit__(None, None, None)
+                element.clear(keep_tail=True)
+                continue
+
+            parent = stack[-1][0] if stack else None
+            if parent is not None:
+                flush_before_child(xf, parent, element)
+
+            if event in ("comment", "pi"):
+                xf.write(element, with_tail=False)
+                continue
+
+            if element.tag in shape_tags:
+                layer_name = get_layer_name(element, nsmap, style_keys)
+                if layer_name and layer_name in formatted_styles:
+                    element.attrib["style"] = formatted_styles[layer_name]
+                    styled_elements += 1
+                elif layer_name and element.tag == path_tag:
+                    print(
+                        f"Warning: No style defined for layer '{layer_name}' in {file_path}"
+                    )
+
+            if element.tag == image_tag and output_dir != source_dir:
+                for attr in href_attrs:
+                    href = element.attrib.get(attr)
+                    if href and is_relative_href(href):
+                        element.attrib[attr] = Path(
+                            os.path.relpath(os.path.join(source_dir, href), output_dir)
+                        ).as_posix()
+
+            attrib, element_nsmap = streamed_start_tag(element, parent)
+            context = xf.element(element.tag, attrib=attrib, nsmap=element_nsmap)
+            context.__enter__()
+            stack.append((element, context))
+
+    print(f"Styled {styled_elements} elements in {file_path}")
     return output_filepath
 
 
+def iter_svg_images(file_path, nsmap: Dict[str, str]):
+    """Yield the attributes of every <image> element, streaming the SVG"""
+    image_tag = f"{{{nsmap['svg']}}}image"
+    for _, element in etree.iterparse(file_path, events=("end",), huge_tree=True):
+        if element.tag == image_tag:
+            yield dict(element.attrib)
+        # Free processed elements
+        element.clear(keep_tail=True)
+        parent = element.getparent()
+        if parent is not None:
+            while element.getprevious() is not None:
+                parent.remove(element.getprevious())
+
+
+class ExportError(Exception):
+    """Inkscape export failed after all attempts"""
+
+
+def run_inkscape(
+    args, output_paths, timeout: Optional[float] = None, retries: int = 0
+):
+    """Run an Inkscape export and verify that it produced output_paths
+
+    output_paths is a single path or a list of paths written by one run.
+    A run that exceeds timeout is killed and retried, as is a run that exits
+    with an error or does not (re)write every output file. Raises ExportError
+    with the captured stderr once all retries are exhausted.
+    """
+    expected = [output_paths] if isinstance(output_paths, str) else list(output_paths)
+
+    def output_stamp(path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    error = ""
+    for attempt in range(retries + 1):
+        if attempt:
+            print(f"Retrying ({attempt}/{retries}): {expected[0]}")
+        before = [output_stamp(path) for path in expected]
+        try:
+            # subprocess.run kills the child when the timeout expires
+            result = subprocess.run(args, capture_output=True, text=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            error = f"timed out after {timeout}s"
+            continue
+        except OSError as e:
+            raise ExportError(f"cannot run {args[0]}: {e}") from e
+
+        stderr = (result.stderr or "").strip()
+        missing = [
+            os.path.basename(path)
+            for path, old_stamp in zip(expected, before)
+            if (new_stamp := output_stamp(path)) is None or new_stamp[1] == 0 or new_stamp == old_stamp
+        ]
+        if result.returncode != 0:
+            error = f"exit code {result.returncode}: {stderr[-500:]}"
+        elif missing:
+            error = f"no output written for {', '.join(missing)}: {stderr[-500:]}"
+        else:
+            return output_paths
+
+    raise ExportError(f"{os.path.basename(expected[0])}: {error}")
+
+
 def export_svg_to_png(
     file_path,
     inkscape_executable: str = "inkscape",
     output_filename: Optional[str] = None,
     dpi: int = 300,
     suffix: str = "",
+    timeout: Optional[float] = None,
+    retries: int = 0,
 ):
     """Export SVG file to PNG using Inkscape"""
 
@@ -208,7 +374,39 @@ def export_svg_to_png(
     ]
 
     print(f"Exporting {file_path} to {output_path}")
-    subprocess.call(args)
+    return run_inkscape(args, output_path, timeout=timeout, retries=retries)
+
+
+def element_export_names(
+    output_filename,
+    filetype: str = "png",
+    export_id_only: bool = True,
+    export_with_context: bool = True,
+    suffix: str = '',
+    annotated_suffix: str = '',
+):
+    """Return [(filename, id_only)] of the exports for one element
+
+    When both exports map to the same file name the with-context export
+    would overwrite the id-only one, so the id-only export is dropped.
+    """
+    # Build filename with suffixes
+    full_suffix = suffix
+    if annotated_suffix:
+        full_suffix = f"{suffix}_{annotated_suffix}" if suffix else annotated_suffix
+
+    exports = []
+    # Export with surrounding elements (for context) if requested
+    if export_with_context:
+        filename_context = f'{output_filename}_{annotated_suffix}.{filetype}' if annotated_suffix else f'{output_filename}_{suffix}.{filetype}'
+        exports.append((filename_context, False))
+
+    # Export only the specified element if requested
+    if export_id_only:
+        filename = f'{output_filename}_{full_suffix}.{filetype}' if full_suffix else f'{output_filename}.{filetype}'
+        if not exports or exports[0][0] != filename:
+            exports.append((filename, True))
+    return exports
 
 
 def export_svg_element(
@@ -221,25 +419,23 @@ def export_svg_element(
     export_id_only: bool = True,
     export_with_context: bool = True,
     suffix: str = '',
-    annotated_suffix: str = ''
+    annotated_suffix: str = '',
+    timeout: Optional[float] = None,
+    retries: int = 0,
 ):
-    """Export specific element from SVG by ID"""
+    """Export specific element from SVG by ID, return the written file paths"""
 
     # Ensure absolute path
     file_path = os.path.abspath(file_path)
     output_path = os.path.dirname(file_path)
+    outputs = []
 
-    # Build filename with suffixes
-    full_suffix = suffix
-    if annotated_suffix:
-        full_suffix = f"{suffix}_{annotated_suffix}" if suffix else annotated_suffix
-    
-    # Export only the specified element if requested
-    if export_id_only:
-        filename = f'{output_filename}_{full_suffix}.{filetype}' if full_suffix else f'{output_filename}.{filetype}'
+    for filename, id_only in element_export_names(
+        output_filename, filetype, export_id_only, export_with_context, suffix, annotated_suffix
+    ):
         args = [
             inkscape_executable,
-            "--export-id-only",
+            *(["--export-id-only"] if id_only else []),
             f"--export-id={img_id}",
             f"--export-type={filetype}",
             f"--export-dpi={dpi}",
@@ -247,111 +443,402 @@ def export_svg_element(
             file_path,
         ]
         print(" ".join(args))
-        subprocess.call(args)
+        outputs.append(
+            run_inkscape(args, os.path.join(output_path, filename), timeout=timeout, retries=retries)
+        )
 
-    # Export with surrounding elements (for context) if requested
-    if export_with_context:
-        filename_context = f'{output_filename}_{annotated_suffix}.{filetype}' if annotated_suffix else f'{output_filename}_{suffix}.{filetype}'
-        args = [
-            inkscape_executable,
-            f"--export-id={img_id}",
-            f"--export-type={filetype}",
-            f"--export-dpi={dpi}",
-            f"--export-filename={os.path.join(output_path, filename_context)}",
-            file_path,
-        ]
-        subprocess.call(args)
+    return outputs
 
 
-def svg_to_png_by_images(
+def export_output_dir(
+    file_path, profile: ExportProfile, profiles_dir: str = "_exports", source_path=None
+):
+    """Directory receiving the exports of file_path for an export profile
+
+    Without a separate tree exports go next to file_path. Separate trees
+    mirror the layout of source_path (default: file_path): img/a/b.svg
+    exports to <profiles_dir>/<profile>/img/a/.
+    """
+    if not profile.separate_tree:
+        return os.path.dirname(os.path.abspath(file_path))
+    source_dir = os.path.dirname(os.path.abspath(source_path or file_path))
+    return os.path.join(os.path.abspath(profiles_dir), profile.name, os.path.relpath(source_dir))
+
+
+def composite_layers(base_path, overlay_path, output_path):
+    """Alpha-blend an overlay-only render over a base-only render of the same area"""
+    with Image.open(base_path) as base, Image.open(overlay_path) as overlay:
+        if base.size != overlay.size:
+            raise ExportError(
+                f"{os.path.basename(output_path)}: base {base.size} and "
+                f"overlay {overlay.size} renders differ in size"
+            )
+        Image.alpha_composite(base.convert("RGBA"), overlay.convert("RGBA")).save(output_path)
+    return output_path
+
+
+def image_opacities(file_path, image_ids) -> Dict[str, str]:
+    """Effective opacity of the given <image> elements (style over attribute, default 1)"""
+    wanted = set(image_ids)
+    opacities = {img_id: "1" for img_id in wanted}
+    for _, element in etree.iterparse(file_path, events=("end",), huge_tree=True):
+        if etree.QName(element).localname == "image" and element.get("id") in wanted:
+            style = {
+                key.strip(): value.strip()
+                for key, _, value in (
+                    declaration.partition(":") for declaration in (element.get("style") or "").split(";")
+                )
+            }
+            opacities[element.get("id")] = style.get("opacity") or element.get("opacity") or "1"
+    return opacities
+
+
+def export_actions(img_id, filetype, dpi, output_path):
+    return [
+        f"export-id:{img_id}",
+        f"export-type:{filetype}",
+        f"export-dpi:{dpi}",
+        f"export-filename:{output_path}",
+        "export-do",
+    ]
+
+
+def export_svg_images(
     file_path,
-    nsmap: Dict[str, str],
+    images,
+    profiles: List[ExportProfile],
+    profiles_dir: str = "_exports",
     inkscape_executable: str = "inkscape",
     filetype: str = "png",
-    dpi: int = 300,
     export_id_only: bool = True,
     export_with_context: bool = True,
     annotated_suffix: str = '',
+    timeout: Optional[float] = None,
+    retries: int = 0,
+    context_mode: str = "composite",
+    source_path=None,
+    protected=(),
 ):
-    """Export each embedded image from SVG to separate PNG"""
-    xml_model = etree.parse(file_path)
-    for image_object in xml_model.findall(".//svg:image", namespaces=nsmap):
+    """Export [(element id, output name)] for every profile in one Inkscape run
+
+    The document is loaded once and every export is issued through
+    --actions; timeout applies per export. Returns the written file paths.
+
+    With context_mode="composite" (PNG only) the with-context export is not
+    rendered by Inkscape: the image is rendered alone (its id-only output, or
+    a temporary base when that output is not written), the overlays are
+    rendered alone over the image area (the images made transparent), and
+    the two are alpha-blended. The embedded raster is rasterized once per
+    profile however many outputs use it, and the overlay render skips it.
+    Vector content placed below an image ends up drawn over it in this mode.
+
+    An export whose path is in protected (source images: the rasters the
+    SVG links to, files tracked by git) is skipped with a warning rather
+    than overwriting the source, e.g. an id-only imageN.png next to the SVG.
+    """
+    file_path = os.path.abspath(file_path)
+    protected = {os.path.abspath(path) for path in protected}
+    composite = context_mode == "composite" and export_with_context and filetype == "png"
+    # Ids of the images hidden for the overlay renders
+    hidden = []
+    context_actions = []
+    overlay_actions = []
+    id_only_actions = []
+    outputs = []
+    # (base, overlay, output) renders to blend, and temporary renders
+    compositions = []
+    temporary = []
+
+    for img_id, output_filename in images:
+        names = element_export_names(
+            output_filename, filetype, export_id_only, export_with_context,
+            annotated_suffix=annotated_suffix,
+        )
+        for profile in profiles:
+            output_dir = export_output_dir(file_path, profile, profiles_dir, source_path)
+            os.makedirs(output_dir, exist_ok=True)
+            paths = {id_only: os.path.join(output_dir, filename) for filename, id_only in names}
+            for id_only, output_path in list(paths.items()):
+                if output_path in protected:
+                    print(f"⚠️  Not exporting {output_path}: it would overwrite a source image")
+                    del paths[id_only]
+
+            if not (composite and False in paths):
+                for id_only, output_path in paths.items():
+                    actions = id_only_actions if id_only else context_actions
+                    actions += export_actions(img_id, filetype, profile.dpi, output_path)
+                    outputs.append(output_path)
+                continue
+
+            if img_id not in hidden:
+                hidden.append(img_id)
+            context_path = paths[False]
+            stem = os.path.splitext(context_path)[0]
+            # The id-only output is the base when it is written; otherwise
+            # (same name as the with-context export) a temporary base is
+            base_path = paths.get(True) or f"{stem}.base.png"
+            overlay_path = f"{stem}.overlay.png"
+            overlay_actions += export_actions(img_id, filetype, profile.dpi, overlay_path)
+            id_only_actions += export_actions(img_id, filetype, profile.dpi, base_path)
+            compositions.append((base_path, overlay_path, context_path))
+            temporary += [overlay_path] if True in paths else [overlay_path, base_path]
+            outputs += paths.values()
+
+    if not outputs:
+        return outputs
+
+    rendered = [path for path in outputs if path not in {c for _, _, c in compositions}]
+    rendered += [path for path in temporary if path not in rendered]
+    if overlay_actions:
+        # Overlay-only renders: hide the images while rendering their areas,
+        # then give each its own opacity back for the id-only renders
+        opacities = image_opacities(file_path, hidden)
+        context_actions += [
+            f"select-by-id:{','.join(hidden)}", "object-set-property:opacity,0",
+            *overlay_actions,
+            *(action for img_id in hidden for action in (
+                f"select-by-id:{img_id}", f"object-set-property:opacity,{opacities[img_id]}",
+            )),
+            "select-clear",
+        ]
+
+    # export-id-only is a switch: issue all with-context exports before it
+    actions = context_actions + (["export-id-only"] + id_only_actions if id_only_actions else [])
+    args = [inkscape_executable, f"--actions={';'.join(actions)}", file_path]
+    print(f"Exporting {len(outputs)} files from {file_path} "
+          f"({', '.join(f'{p.name}@{p.dpi}dpi' for p in profiles)}"
+          f"{', composited' if compositions else ''})")
+    try:
+        run_inkscape(
+            args, rendered,
+            timeout=timeout * len(rendered) if timeout else None,
+            retries=retries,
+        )
+        for base_path, overlay_path, context_path in compositions:
+            composite_layers(base_path, overlay_path, context_path)
+    finally:
+        for path in temporary:
+            if os.path.exists(path):
+                os.remove(path)
+    return outputs
+
+
+def svg_image_names(file_path, nsmap: Dict[str, str], warn: bool = True):
+    """Return [(element id, output name)] of the embedded images of an SVG"""
+    href_attr_name = f"{{{nsmap['xlink']}}}href"
+    label_attr_name = f"{{{nsmap['inkscape']}}}label"
+    images = []
+    for image_attrib in iter_svg_images(file_path, nsmap):
         # Try to get the original image filename from xlink:href
-        href_attr = image_object.attrib.get(f"{{{nsmap['xlink']}}}href", "")
-        if href_attr:
+        href_attr = image_attrib.get(href_attr_name, "") or image_attrib.get("href", "")
+        if href_attr and not href_attr.startswith("data:"):
             # Extract base filename without extension
             image_name = os.path.splitext(os.path.basename(href_attr))[0]
         else:
-            # Fallback to inkscape:label or id
+            # Embedded rasters (data: URIs) have no file name:
+            # fallback to inkscape:label or id
             try:
-                image_name = image_object.attrib[f"{{{nsmap['inkscape']}}}label"]
+                image_name = image_attrib[label_attr_name]
             except KeyError:
                 # Use id as last fallback
-                image_name = image_object.attrib.get("id", "unnamed")
-                print(
-                    f"Warning: No xlink:href or inkscape:label for image in {file_path}, using id: {image_name}"
-                )
+                image_name = image_attrib.get("id", "unnamed")
+                if warn:
+                    print(
+                        f"Warning: No xlink:href or inkscape:label for image in {file_path}, using id: {image_name}"
+                    )
+        images.append((image_attrib["id"], str(image_name)))
+    return images
+
+
+def svg_to_png_by_images(
+    file_path,
+    nsmap: Dict[str, str],
+    inkscape_executable: str = "inkscape",
+    filetype: str = "png",
+    dpi: int = 300,
+    export_id_only: bool = True,
+    export_with_context: bool = True,
+    annotated_suffix: str = '',
+    timeout: Optional[float] = None,
+    retries: int = 0,
+    profiles: Optional[List[ExportProfile]] = None,
+    profiles_dir: str = "_exports",
+    context_mode: str = "composite",
+    source_path=None,
+):
+    """Export each embedded image from SVG to separate PNG, return the written file paths
+
+    Without profiles a single export at dpi is written next to the SVG.
+    source_path is the original annotation file when file_path is a
+    derived copy; export profile trees mirror its location.
+    """
+    if not profiles:
+        profiles = [ExportProfile(name="default", dpi=dpi, separate_tree=False)]
+
+    images = svg_image_names(file_path, nsmap)
+    protected = set(linked_images(file_path, nsmap)) | set(tracked_files(Path.cwd().resolve()))
+    if source_path is not None:
+        protected.update(linked_images(source_path, nsmap))
+    outputs = export_svg_images(
+        file_path,
+        images,
+        profiles,
+        profiles_dir=profiles_dir,
+        inkscape_executable=inkscape_executable,
+        filetype=filetype,
+        export_id_only=export_id_only,
+        export_with_context=export_with_context,
+        annotated_suffix=annotated_suffix,
+        timeout=timeout,
+        retries=retries,
+        context_mode=context_mode,
+        source_path=source_path,
+        protected=protected,
+    )
+    for img_id, image_name in images:
+        print(f"Exported image: {image_name} (id: {img_id})")
+    return outputs
 
-        export_svg_element(
-            file_path,
-            image_object.attrib["id"],
-            str(image_name),
-            inkscape_executable=inkscape_executable,
-            filetype=filetype,
-            dpi=dpi,
-            export_id_only=export_id_only,
-            export_with_context=export_with_context,
-            annotated_suffix=annotated_suffix,
-        )
-        print(f"Exported image: {image_name} (id: {image_object.attrib['id']})")
 
 def process_annotation_file(
-    svg_file_path, config: Settings, styles: Dict[str, Dict[str, Any]]
+    svg_file_path,
+    config: Settings,
+    styles: Dict[str, Dict[str, Any]],
+    cache: Optional[ImageCache] = None,
 ):
-    """Process a single annotation SVG file: apply styles and export to PNG"""
+    """Process a single annotation SVG file: apply styles and export to PNG
+
+    Returns the list of generated files. With a cache, unchanged inputs are
+    served from it and Inkscape is not called. Raises on any failure.
+    """
     print(f"\nProcessing: {svg_file_path}")
 
+    cache_key = None
+    if cache is not None:
+        cache_key = cache.compute_key(svg_file_path, config, styles)
+        restored = cache.restore(cache_key, svg_file_path)
+        if restored is not None:
+            print(f"Restored {len(restored)} cached outputs for {svg_file_path}")
+            return restored
+
     nsmap = config.get_nsmap()
 
     # Apply styles
     styled_svg_path = apply_style_to_file(
-        svg_file_path, styles, nsmap, output_postfix=config.processing.styled_postfix
+        svg_file_path, styles, nsmap,
+        output_postfix=config.processing.styled_postfix,
+        output_dir=config.get_output_dir(svg_file_path),
     )
-
+    outputs = [styled_svg_path]
 
     # If the SVG contains embedded images, export them separately
+    outputs += svg_to_png_by_images(
+        styled_svg_path,
+        nsmap,
+        inkscape_executable=config.inkscape.executable,
+        filetype=config.inkscape.default_export_format,
+        dpi=config.inkscape.default_dpi,
+        export_id_only=config.export.export_id_only,
+        export_with_context=config.export.export_with_context,
+        annotated_suffix=config.processing.annotated_suffix,
+        timeout=config.inkscape.timeout,
+        retries=config.inkscape.retries,
+        profiles=config.get_export_profiles(),
+        profiles_dir=config.export.profiles_dir,
+        context_mode=config.export.context_mode,
+        source_path=svg_file_path,
+    )
+    if len(outputs) == 1:
+        print(f"No embedded images to export in {svg_file_path}")
+
+    outputs = list(dict.fromkeys(outputs))
+    if cache is not None:
+        cache.store(cache_key, svg_file_path, outputs)
+    return outputs
+
+
+def make_image_cache(config: Settings, cache_dir: Optional[str] = None) -> Optional[ImageCache]:
+    """Create the image cache from an explicit directory or the configuration"""
+    cache_dir = cache_dir or config.cache.get_image_cache_dir()
+    if not cache_dir:
+        return None
+    cache = ImageCache(cache_dir, inkscape_executable=config.inkscape.executable)
+    # Resolve the tool version once instead of once per worker
+    print(f"Image cache: {cache_dir} (tool: {cache.tool_version})")
+    return cache
+
+
+def process_annotation_job(svg_file_path, **kwargs):
+    """Pool worker: process one file, return (path, outputs, error message)"""
     try:
-        svg_to_png_by_images(
-            styled_svg_path,
-            nsmap,
-            inkscape_executable=config.inkscape.executable,
-            filetype=config.inkscape.default_export_format,
-            dpi=config.inkscape.default_dpi,
-            export_id_only=config.export.export_id_only,
-            export_with_context=config.export.export_with_context,
-            annotated_suffix=config.processing.annotated_suffix,
-        )
+        return svg_file_path, process_annotation_file(svg_file_path, **kwargs), None
     except Exception as e:
-        print(f"No embedded images to export or error: {e}")
+        return svg_file_path, [], f"{type(e).__name__}: {e}"
+
+
+def report_failures(failures) -> bool:
+    """Print a summary of failed annotation files, return True if there were none"""
+    if not failures:
+        return True
+    print(f"\n❌ {len(failures)} annotation file(s) failed:")
+    for svg_file_path, error in failures:
+        print(f"  - {svg_file_path}: {error}")
+    return False
+
+
+def find_annotation_files(base_folder, config: Settings, use_index: bool = True):
+    """Find all annotation SVG files below base_folder
+
+    With use_index the directory listing is reused from the discovery index
+    for every directory that did not change since the last run.
+    """
+    index = make_discovery_index(config) if use_index else None
+    matcher = AnnotationMatcher.from_config(config)
+    return [path for path, selected, _ in discover(base_folder, matcher, index) if selected]
+
+
+def list_annotation_files(base_folder, config: Settings, include_dirs: Optional[Set[str]] = None):
+    """Print every SVG below base_folder and whether it would be processed"""
+    index = make_discovery_index(config)
+    matcher = AnnotationMatcher.from_config(config)
+    results = discover(base_folder, matcher, index)
+    if include_dirs is not None:
+        include_dirs = {os.path.normpath(d) for d in include_dirs}
+
+    selected_count = 0
+    for path, selected, reason in results:
+        if not path.endswith(".svg"):
+            continue
+        if selected and include_dirs is not None and os.path.normpath(os.path.dirname(path)) not in include_dirs:
+            selected, reason = False, "outside the rendered chapters"
+        selected_count += selected
+        print(f"{'process' if selected else 'skip   '}  {path}: {reason}")
+    print(f"\n{selected_count} annotation files would be processed "
+          f"({index.rescanned} of {len(index.dirs)} directories rescanned)")
 
 
 def update_all_annotations(
-    base_folder, config: Settings, styles: Dict[str, Dict[str, Any]]
+    base_folder,
+    config: Settings,
+    styles: Dict[str, Dict[str, Any]],
+    include_dirs: Optional[Set[str]] = None,
+    cache: Optional[ImageCache] = None,
 ):
-    """Find and process all annotation SVG files in the project"""
-    annotation_patterns = config.processing.annotation_patterns
-
-    annotation_files = []
-    for root, dirs, files in os.walk(base_folder):
-        for file in files:
-            if (
-                any(pattern in file for pattern in annotation_patterns)
-                and config.processing.styled_postfix not in file
-            ):
-                file_path = os.path.join(root, file)
-                annotation_files.append(file_path)
+    """Find and process all annotation SVG files in the project
+
+    If include_dirs is given, only annotations located in those directories
+    are processed. Returns a list of (file, error) for failed files.
+    """
+    annotation_files = find_annotation_files(base_folder, config)
+    if include_dirs is not None:
+        include_dirs = {os.path.normpath(d) for d in include_dirs}
+        annotation_files = [
+            f for f in annotation_files
+            if os.path.normpath(os.path.dirname(f)) in include_dirs
+        ]
+        print(f"Restricting image preparation to {len(annotation_files)} annotation files")
     
-    worker = partial(process_annotation_file, config=config, styles=styles)
+    worker = partial(process_annotation_job, config=config, styles=styles, cache=cache)
     
     num_processes = multiprocessing.cpu_count()
     if config.processing.max_processes > 0:
@@ -359,8 +846,58 @@ def update_all_annotations(
     
     print(f'Run image preparation with {num_processes} processes')
     
+    failures = []
+    produced = []
     with multiprocessing.Pool(processes=num_processes) as pool:
-        pool.map(worker, annotation_files)
+        for svg_file_path, outputs, error in pool.imap_unordered(worker, annotation_files):
+            if error:
+                failures.append((svg_file_path, error))
+            else:
+                produced.append((svg_file_path, outputs))
+
+    # Record outputs for clean_generated_images.py
+    record_outputs(output_manifest_path(config), produced, config.get_nsmap())
+
+    print(f"\n✓ Processed {len(annotation_files) - len(failures)} of {len(annotation_files)} annotation files")
+    return failures
+
+
+def manage_cache(
+    base_folder,
+    config: Settings,
+    styles: Dict[str, Dict[str, Any]],
+    cache: ImageCache,
+    action: str,
+    max_age_days: Optional[float] = None,
+    max_size_mb: Optional[float] = None,
+) -> bool:
+    """Run a cache maintenance action (check, verify, prune), return success"""
+    if action == "verify":
+        corrupt = cache.verify(remove_corrupt=True)
+        for key in corrupt:
+            print(f"Removed corrupt cache entry: {key}")
+        print(f"✓ Verified {len(cache.iter_keys())} cache entries, removed {len(corrupt)}")
+        return True
+
+    keys = {
+        svg_path: cache.compute_key(svg_path, config, styles)
+        for svg_path in find_annotation_files(base_folder, config)
+    }
+
+    if action == "check":
+        missing = [svg_path for svg_path, key in keys.items() if not cache.has(key)]
+        for svg_path in missing:
+            print(f"Not cached: {svg_path}")
+        print(f"{len(keys) - len(missing)} of {len(keys)} annotation files cached")
+        return not missing
+
+    removed = cache.prune(
+        keys.values(),
+        max_age_days=max_age_days,
+        max_bytes=int(max_size_mb * 1024 * 1024) if max_size_mb is not None else None,
+    )
+    print(f"✓ Pruned {len(removed)} cache entries, kept {len(cache.iter_keys())}")
+    return True
 
 
 if __name__ == "__main__":
@@ -376,6 +913,36 @@ if __name__ == "__main__":
         default="config.toml",
         help="Configuration TOML file name in styles directory (default: config.toml)",
     )
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="Image cache directory (default: <cache.cache_dir>/images from config)",
+    )
+    parser.add_argument("--no-cache", action="store_true", help="Do not use the image cache")
+    parser.add_argument(
+        "--cache",
+        choices=["check", "verify", "prune"],
+        default=None,
+        help="Cache maintenance instead of processing: check (exit 1 if any annotation "
+             "is not cached), verify (drop corrupt entries), prune (drop stale entries)",
+    )
+    parser.add_argument(
+        "--max-age-days",
+        type=float,
+        default=None,
+        help="With --cache prune, also drop entries not used for this many days",
+    )
+    parser.add_argument(
+        "--max-size-mb",
+        type=float,
+        default=None,
+        help="With --cache prune, drop least recently used entries until the cache fits",
+    )
+    parser.add_argument(
+        "--list",
+        action="store_true",
+        help="Only list the SVG files found and why each would be processed or skipped",
+    )
     args = parser.parse_args()
 
     # Load configuration
@@ -388,11 +955,25 @@ if __name__ == "__main__":
     # Load specified style file
     styles = load_styles(style_file, default_styles=config.get_default_styles())
 
-    if os.path.exists(img_folder):
+    cache = None if args.no_cache else make_image_cache(config, args.cache_dir)
+
+    if args.list:
+        list_annotation_files(img_folder, config)
+    elif args.cache:
+        if cache is None:
+            print("Error: image cache is disabled")
+            sys.exit(1)
+        if not manage_cache(
+            img_folder, config, styles, cache, args.cache, args.max_age_days, args.max_size_mb
+        ):
+            sys.exit(1)
+    elif os.path.exists(img_folder):
         print(f"Using configuration from: styles/{args.config}")
         print(f"Using styles from: styles/{style_file}")
         print(f"Processing folder: {img_folder}")
-        update_all_annotations(img_folder, config, styles)
+        failures = update_all_annotations(img_folder, config, styles, cache=cache)
+        if not report_failures(failures):
+            sys.exit(1)
     else:
         print(f"Image folder not found: {img_folder}")
         print("Please run this script from the project root directory")
@@ -12,38 +12,144 @@ from setup_crossref import main as setup_crossref
 setup_crossref()
 
 # Import functions from prepare_images
-from prepare_images import update_all_annotations, load_styles
+from prepare_images import (
+    update_all_annotations, load_styles, make_image_cache, report_failures
+)
 from config import load_config
+from quarto_project import get_chapters, get_profile_setting
+from catalog import open_catalog
+from validate_book import run_validation
+from fingerprint_assets import load_asset_manifest
+import abbreviations
 
 # Output directory from _quarto.yml
 OUTPUT_DIR = "_book"
 
-def copy_img_to_book():
-    """Copy all files from img/ to _book/img/"""
+def image_trees(config=None):
+    """Return trees overlaid into _book/img, later trees win
+
+    img/ holds the sources, <build_dir>/img the generated files and the
+    html export profile (see [export] in styles/config.toml) its own tree.
+    """
+    source_dir = Path("img")
+    trees = [source_dir]
+    if config is not None:
+        if config.build_dir:
+            trees.append(Path(config.build_dir) / source_dir)
+        for profile in config.get_export_profiles():
+            if profile.name == "html" and profile.separate_tree:
+                trees.append(Path(config.export.profiles_dir) / profile.name / source_dir)
+    return [tree for tree in trees if tree.exists()]
+
+def copy_img_to_book(config=None):
+    """Synchronise _book/img/ with the overlay of img/ and the generated trees
+
+    Only files that are new or changed (size or mtime) are copied, and files
+    no longer present in any tree are removed. Files renamed by the
+    post-render fingerprinting (fingerprint_assets.py) count as present.
+    """
     source_dir = Path("img")
     dest_dir = Path(OUTPUT_DIR) / "img"
     
     if not source_dir.exists():
         print(f"Source directory not found: {source_dir}")
         return
-    
-    # Remove existing _book/img if it exists
+
+    overlay = {}
+    for tree in image_trees(config):
+        for path in tree.rglob("*"):
+            if path.is_file():
+                overlay[path.relative_to(tree)] = path
+
+    # img/... -> fingerprinted copy in the output directory, and the stat the
+    # copy had before it was renamed
+    assets, asset_stats = load_asset_manifest(OUTPUT_DIR)
+    fingerprinted = {}
+    for original, hashed in assets.items():
+        relative_path = Path(original).relative_to(source_dir) if original.startswith("img/") else None
+        if relative_path in overlay and original in asset_stats:
+            fingerprinted[relative_path] = (Path(OUTPUT_DIR) / hashed, asset_stats[original])
+
+    copied = 0
+    for relative_path, path in overlay.items():
+        target = dest_dir / relative_path
+        stat = path.stat()
+        if target.exists():
+            target_stat = target.stat()
+            if target_stat.st_size == stat.st_size and target_stat.st_mtime_ns == stat.st_mtime_ns:
+                continue
+        elif relative_path in fingerprinted:
+            hashed, (size, mtime_ns) = fingerprinted[relative_path]
+            if hashed.exists() and size == stat.st_size and mtime_ns == stat.st_mtime_ns:
+                continue
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(path, target)
+        copied += 1
+
+    removed = 0
+    kept = {hashed for hashed, _ in fingerprinted.values()}
     if dest_dir.exists():
-        shutil.rmtree(dest_dir)
-    
-    # Copy entire img directory to _book
-    shutil.copytree(source_dir, dest_dir)
-    print(f"✓ Copied {source_dir} to {dest_dir}")
-    
-    # Count files for reporting
-    total_files = sum(1 for _ in dest_dir.rglob("*") if _.is_file())
-    print(f"✓ Copied {total_files} files to {dest_dir}")
+        for target in dest_dir.rglob("*"):
+            if target.is_file() and target.relative_to(dest_dir) not in overlay and target not in kept:
+                target.unlink()
+                removed += 1
+
+    print(f"✓ Synchronised {dest_dir} with {', '.join(str(t) for t in image_trees(config))}")
+    print(f"✓ {len(overlay)} files: {copied} copied, {removed} removed")
+
+def get_partial_render_files():
+    """Return files of a partial render, None when the whole book is rendered
+
+    Quarto exports QUARTO_PROJECT_INPUT_FILES (the files being rendered, one
+    per line) and, for a whole-project render, QUARTO_PROJECT_RENDER_ALL to
+    pre-render scripts; build_manifest.py render passes only dirty chapters.
+    """
+    if os.environ.get("QUARTO_PROJECT_RENDER_ALL"):
+        return None
+    files = os.environ.get("QUARTO_PROJECT_INPUT_FILES", "")
+    files = [os.path.relpath(f) for f in files.splitlines() if f.strip()]
+    return files or None
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Quarto pre-render image processing")
+    parser.add_argument(
+        "--images",
+        choices=["full", "cached", "skip"],
+        default=None,
+        help="full: process annotations; cached: only copy existing exports; "
+             "skip: do nothing (default: fast-preview.images of the active profile, or full)",
+    )
+    parser.add_argument(
+        "--skip-validation",
+        action="store_true",
+        help="Do not check cross-references and figures before processing images",
+    )
+    args = parser.parse_args()
+    images_mode = args.images or get_profile_setting("fast-preview", "images", "full")
+
     # Ensure we're in the project root
     if not Path('_quarto.yml').exists():
         print("Error: _quarto.yml not found. Please run from project root.")
         sys.exit(1)
+
+    # Fail in a second on broken references instead of at the end of the render
+    if not args.skip_validation and not run_validation():
+        sys.exit(1)
+
+    # First-use data for build/abbreviations.lua, computed once for all chapters
+    if abbreviations.filter_enabled() and Path(abbreviations.GLOSSARY_CHAPTER).exists():
+        glossary = abbreviations.parse_glossary()
+        first_uses, _, _ = abbreviations.check_abbreviations(get_chapters(), glossary)
+        abbreviations.write_filter_data(
+            abbreviations.DEFAULT_FILTER_DATA, abbreviations.filter_data(glossary, first_uses)
+        )
+        print(f"✓ Abbreviation first uses written to {abbreviations.DEFAULT_FILTER_DATA}")
+
+    if images_mode == "skip":
+        print("Skipping image pre-render (images: skip)")
+        sys.exit(0)
     
     # Load configuration and styles
     config = load_config()
@@ -52,9 +158,21 @@ if __name__ == "__main__":
     
     # First, run image processing to generate annotated files
     img_folder = config.processing.default_folder
-    if os.path.exists(img_folder):
+    if images_mode == "cached":
+        print("Using cached image exports only (images: cached)")
+    elif os.path.exists(img_folder):
         print(f"Processing annotations in {img_folder}...")
-        update_all_annotations(img_folder, config, styles)
+        render_files = get_partial_render_files()
+        include_dirs = None
+        if render_files:
+            with open_catalog(config) as catalog:
+                include_dirs = catalog.image_dirs_for_chapters(render_files)
+        failures = update_all_annotations(
+            img_folder, config, styles,
+            include_dirs=include_dirs, cache=make_image_cache(config),
+        )
+        if not report_failures(failures):
+            sys.exit(1)
     else:
         print(f"Warning: Image folder not found: {img_folder}")
     
@@ -62,4 +180,4 @@ if __name__ == "__main__":
     Path(OUTPUT_DIR).mkdir(exist_ok=True)
     
     # Copy all images to _book
-    copy_img_to_book()
\ No newline at end of file
+    copy_img_to_book(config)
@@ -0,0 +1,71 @@
+"""Helpers for reading the Quarto book configuration (_quarto.yml)"""
+
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import yaml
+
+
+QUARTO_CONFIG = "_quarto.yml"
+
+
+def load_quarto_config(config_path: str = QUARTO_CONFIG) -> Dict[str, Any]:
+    """Load _quarto.yml (or a profile file) as a dictionary"""
+    path = Path(config_path)
+    if not path.exists():
+        return {}
+
+    with open(path, "r", encoding="utf-8") as f:
+        return yaml.safe_load(f) or {}
+
+
+def flatten_chapters(entries: List[Any]) -> List[str]:
+    """Flatten book.chapters (with nested parts) into a list of file paths"""
+    chapters = []
+    for entry in entries or []:
+        if isinstance(entry, str):
+            chapters.append(entry)
+        elif isinstance(entry, dict):
+            if "file" in entry:
+                chapters.append(entry["file"])
+            chapters.extend(flatten_chapters(entry.get("chapters", [])))
+    return chapters
+
+
+def get_chapters(config: Optional[Dict[str, Any]] = None) -> List[str]:
+    """Return chapter paths listed in the book configuration, in book order"""
+    if config is None:
+        config = load_quarto_config()
+    book = config.get("book", {}) or {}
+    chapters = flatten_chapters(book.get("chapters", []))
+    chapters.extend(flatten_chapters(book.get("appendices", [])))
+    return chapters
+
+
+def get_active_profiles() -> List[str]:
+    """Return active Quarto profiles (Quarto exports QUARTO_PROFILE to scripts)"""
+    value = os.environ.get("QUARTO_PROFILE", "")
+    return [profile.strip() for profile in value.split(",") if profile.strip()]
+
+
+def get_profile_setting(section: str, key: str, default: Any = None) -> Any:
+    """Read a custom setting from the first active profile that defines it"""
+    for profile in get_active_profiles():
+        profile_config = load_quarto_config(f"_quarto-{profile}.yml")
+        settings = profile_config.get(section) or {}
+        if key in settings:
+            return settings[key]
+    return default
+
+
+def post_render_enabled(script: str) -> bool:
+    """Whether a post-render script should run under the active profiles
+
+    Quarto concatenates project.post-render of a profile with the one of
+    _quarto.yml, so a profile cannot drop steps. Instead it lists the steps
+    to keep in fast-preview.post-render (see make_fast_profile.py); without
+    that setting every step runs.
+    """
+    keep = get_profile_setting("fast-preview", "post-render")
+    return keep is None or Path(script).name in keep
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""Resolve reviewer comments to source locations in the chapter files.
+
+Comments extracted from the pandoc review copy (see extract_comments.py)
+refer to lines of that copy. This script builds a word-shingle index over
+the chapter sources once, then locates each comment's commented text (or
+its surrounding sentence) by shingle voting and writes a worklist:
+
+    [{"id": "147", "file": "src/...qmd", "line": 12, "score": 0.93,
+      "status": "resolved", "matched_on": "commented_text", ...}, ...]
+
+Score is the fraction of the query's shingles found at the chosen place.
+
+Usage:
+    python scripts/resolve_comments.py corrections/burovik2.md
+    python scripts/resolve_comments.py corrections/burovik2.md -o worklist.json --min-score 0.5
+"""
+
+from __future__ import annotations
+
+import json
+import re
+import sys
+from collections import Counter, defaultdict
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from extract_comments import Comment, CommentExtractor
+from quarto_project import get_chapters
+
+SHINGLE_SIZE = 3
+# Shingles occurring more often than this are too common to locate anything
+MAX_SHINGLE_OCCURRENCES = 40
+# A second candidate scoring this close to the best one makes the result ambiguous
+AMBIGUITY_RATIO = 0.9
+
+WORD_PATTERN = re.compile(r"\w+")
+# Tail of a comment attribute block cut off at the start of a context
+PARTIAL_ATTRIBUTES_PATTERN = re.compile(r"^[^{]*?\}")
+# Token positions are bucketed so that edits since the review still agree
+BUCKET_SIZE = 8
+# Buckets on either side pooled into one candidate passage
+POOL_BUCKETS = 2
+
+# Markup removed before tokenizing: attributes, citations, link targets
+MARKUP_PATTERN = re.compile(r"\{[^}]*\}|\[@[^\]]*\]|@[\w:-]+|\]\([^)]*\)")
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercase words of text with markup removed and ё folded to е"""
+    text = MARKUP_PATTERN.sub(" ", text).lower().replace("ё", "е")
+    return WORD_PATTERN.findall(text)
+
+
+def shingles(tokens: list[str], size: int = SHINGLE_SIZE) -> list[tuple[str, ...]]:
+    return [tuple(tokens[i:i + size]) for i in range(len(tokens) - size + 1)]
+
+
+@dataclass
+class Candidate:
+    """A located passage"""
+
+    file: str
+    line: int
+    score: float
+
+
+@dataclass
+class ResolvedComment:
+    """Worklist entry: a comment and where it applies in the sources"""
+
+    id: str
+    author: str
+    text: str
+    commented_text: str
+    review_line: int
+    section: str
+    file: str | None
+    line: int | None
+    score: float
+    matched_on: str
+    status: str
+    alternatives: list[dict] = field(default_factory=list)
+
+
+class ShingleIndex:
+    """Inverted index of word shingles over the chapter sources"""
+
+    def __init__(self, paths: list[str], size: int = SHINGLE_SIZE):
+        self.size = size
+        self.paths: list[str] = []
+        # Per file: line number of every token
+        self.token_lines: list[list[int]] = []
+        self.postings: dict[tuple[str, ...], list[tuple[int, int]]] = defaultdict(list)
+        for path in paths:
+            self.add_file(path)
+        # Drop boilerplate shingles ("в том числе", table syntax, ...)
+        for shingle in [s for s, p in self.postings.items() if len(p) > MAX_SHINGLE_OCCURRENCES]:
+            del self.postings[shingle]
+
+    def add_file(self, path: str) -> None:
+        file_index = len(self.paths)
+        self.paths.append(path)
+        tokens: list[str] = []
+        lines: list[int] = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line_number, line in enumerate(f, 1):
+                line_tokens = tokenize(line)
+                tokens += line_tokens
+                lines += [line_number] * len(line_tokens)
+        self.token_lines.append(lines)
+        for position, shingle in enumerate(shingles(tokens, self.size)):
+            self.postings[shingle].append((file_index, position))
+
+    def search(self, text: str, limit: int = 3) -> list[Candidate]:
+        """Return the best locations of text, best first
+
+        Every shared shingle votes for the position where the query would
+        start in the source; votes on nearby start positions are pooled.
+        """
+        query = shingles(tokenize(text), self.size)
+        if not query:
+            return []
+        votes: Counter[tuple[int, int]] = Counter()
+        for offset, shingle in enumerate(query):
+            for file_index, position in self.postings.get(shingle, ()):
+                votes[(file_index, (position - offset) // BUCKET_SIZE)] += 1
+
+        candidates = []
+        taken: set[tuple[int, int]] = set()
+        for (file_index, bucket), _ in votes.most_common():
+            if (file_index, bucket) in taken:
+                continue
+            # Pool the neighbouring buckets of the same passage
+            neighbours = [(file_index, b) for b in range(bucket - POOL_BUCKETS, bucket + POOL_BUCKETS + 1)]
+            total = sum(votes.get(place, 0) for place in neighbours if place not in taken)
+            taken.update(neighbours)
+            lines = self.token_lines[file_index]
+            start = min(max(bucket * BUCKET_SIZE, 0), len(lines) - 1)
+            candidates.append(Candidate(self.paths[file_index], lines[start], min(total / len(query), 1.0)))
+            if len(candidates) >= limit:
+                break
+        return sorted(candidates, key=lambda c: -c.score)
+
+
+def resolve_comment(comment: Comment, index: ShingleIndex, min_score: float) -> ResolvedComment:
+    """Locate a comment by its commented text, falling back to the sentence around it"""
+    best: list[Candidate] = []
+    matched_on = "none"
+    for name, text in (("commented_text", comment.commented_text), ("context", PARTIAL_ATTRIBUTES_PATTERN.sub(" ", comment.context))):
+        candidates = index.search(text)
+        if candidates and (not best or candidates[0].score > best[0].score):
+            best, matched_on = candidates, name
+        if best and best[0].score >= min_score:
+            break
+
+    top = best[0] if best else None
+    if top is None or top.score < min_score:
+        status = "unresolved"
+    elif len(best) > 1 and best[1].score >= top.score * AMBIGUITY_RATIO:
+        status = "ambiguous"
+    else:
+        status = "resolved"
+
+    return ResolvedComment(
+        id=comment.id,
+        author=comment.author,
+        text=comment.text,
+        commented_text=comment.commented_text,
+        review_line=comment.line_number,
+        section=comment.section,
+        file=top.file if top else None,
+        line=top.line if top else None,
+        score=round(top.score, 3) if top else 0.0,
+        matched_on=matched_on,
+        status=status,
+        alternatives=[asdict(c) | {"score": round(c.score, 3)} for c in best[1:]] if status == "ambiguous" else [],
+    )
+
+
+def source_files() -> list[str]:
+    """Chapter sources: chapters from _quarto.yml plus any other src/ documents"""
+    paths = [p for p in get_chapters() if Path(p).is_file()]
+    for path in sorted(Path("src").rglob("*")):
+        if path.suffix in (".qmd", ".md") and path.as_posix() not in paths:
+            paths.append(path.as_posix())
+    return paths
+
+
+def main() -> None:
+    """Main entry point."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Map review comments to source file:line")
+    parser.add_argument("review_file", type=Path, help="Pandoc markdown with track-changes comments")
+    parser.add_argument("-o", "--output", type=Path, default=None,
+                        help="Worklist JSON (default: <review_file>_worklist.json)")
+    parser.add_argument("--min-score", type=float, default=0.25,
+                        help="Minimum score for a comment to count as resolved (default: 0.25)")
+    args = parser.parse_args()
+
+    if not args.review_file.exists():
+        print(f"Error: File {args.review_file} not found", file=sys.stderr)
+        sys.exit(1)
+
+    comments = CommentExtractor().extract_comments(args.review_file.read_text(encoding="utf-8"))
+    index = ShingleIndex(source_files())
+    worklist = [resolve_comment(comment, index, args.min_score) for comment in comments]
+
+    output = args.output or args.review_file.parent / f"{args.review_file.stem}_worklist.json"
+    output.write_text(
+        json.dumps([asdict(item) for item in worklist], ensure_ascii=False, indent=1),
+        encoding="utf-8",
+    )
+
+    statuses = Counter(item.status for item in worklist)
+    print(f"Resolved {statuses['resolved']} of {len(worklist)} comments "
+          f"({statuses['ambiguous']} ambiguous, {statuses['unresolved']} unresolved) "
+          f"against {len(index.paths)} source files")
+    print(f"Worklist saved to: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Snowball stemmer for Russian.
+
+A direct implementation of the Snowball "russian" algorithm
+(https://snowballstem.org/algorithms/russian/stemmer.html), without
+dependencies. build/book-search.js carries a line-by-line port of it so that
+queries in the browser are stemmed exactly like the indexed text: change
+both together.
+"""
+
+VOWELS = "аеиоуыэюя"
+
+PERFECTIVE_GERUND_1 = ("в", "вши", "вшись")
+PERFECTIVE_GERUND_2 = ("ив", "ивши", "ившись", "ыв", "ывши", "ывшись")
+ADJECTIVE = (
+    "ее", "ие", "ые", "ое", "ими", "ыми", "ей", "ий", "ый", "ой", "ем", "им", "ым", "ом",
+    "его", "ого", "ему", "ому", "их", "ых", "ую", "юю", "ая", "яя", "ою", "ею",
+)
+PARTICIPLE_1 = ("ем", "нн", "вш", "ющ", "щ")
+PARTICIPLE_2 = ("ивш", "ывш", "ующ")
+REFLEXIVE = ("ся", "сь")
+VERB_1 = (
+    "ла", "на", "ете", "йте", "ли", "й", "л", "ем", "н", "ло", "но", "ет", "ют", "ны", "ть",
+    "ешь", "нно",
+)
+VERB_2 = (
+    "ила", "ыла", "ена", "ейте", "уйте", "ите", "или", "ыли", "ей", "уй", "ил", "ыл", "им",
+    "ым", "ен", "ило", "ыло", "ено", "ят", "ует", "уют", "ит", "ыт", "ены", "ить", "ыть",
+    "ишь", "ую", "ю",
+)
+NOUN = (
+    "а", "ев", "ов", "ие", "ье", "е", "иями", "ями", "ами", "еи", "ии", "и", "ией", "ей", "ой",
+    "ий", "й", "иям", "ям", "ием", "ем", "ам", "ом", "о", "у", "ах", "иях", "ях", "ы", "ь",
+    "ию", "ью", "ю", "ия", "ья", "я",
+)
+SUPERLATIVE = ("ейш", "ейше")
+DERIVATIONAL = ("ост", "ость")
+
+
+def regions(word: str):
+    """Start of RV and R2"""
+    rv = r1 = r2 = len(word)
+    for i, char in enumerate(word):
+        if char in VOWELS:
+            rv = i + 1
+            break
+    for i in range(1, len(word)):
+        if word[i - 1] in VOWELS and word[i] not in VOWELS:
+            r1 = i + 1
+            break
+    for i in range(r1 + 1, len(word)):
+        if word[i - 1] in VOWELS and word[i] not in VOWELS:
+            r2 = i + 1
+            break
+    return rv, r2
+
+
+def remove_suffix(word: str, start: int, suffixes, after_a_ya=()):
+    """Remove the longest of suffixes / after_a_ya lying at or after start
+
+    after_a_ya suffixes only count when preceded by "а" or "я" (which stays).
+    As in Snowball, only the longest matching suffix is tried. Returns None if
+    nothing is removed.
+    """
+    best = ""
+    for suffix in (*suffixes, *after_a_ya):
+        if len(suffix) > len(best) and word.endswith(suffix) and len(word) - len(suffix) >= start:
+            best = suffix
+    if not best:
+        return None
+    stem = word[:-len(best)]
+    if best not in suffixes and not (len(stem) > start and stem[-1] in "ая"):
+        return None
+    return stem
+
+
+def stem(word: str) -> str:
+    """Stem a lowercase Russian word"""
+    word = word.replace("ё", "е")
+    rv, r2 = regions(word)
+    if rv >= len(word):
+        return word
+
+    # Step 1
+    result = remove_suffix(word, rv, PERFECTIVE_GERUND_2, PERFECTIVE_GERUND_1)
+    if result is None:
+        word = remove_suffix(word, rv, REFLEXIVE) or word
+        result = remove_suffix(word, rv, ADJECTIVE)
+        if result is not None:
+            # Adjectival: an adjective ending optionally preceded by a participle ending
+            result = remove_suffix(result, rv, PARTICIPLE_2, PARTICIPLE_1) or result
+        else:
+            result = remove_suffix(word, rv, VERB_2, VERB_1)
+            if result is None:
+                result = remove_suffix(word, rv, NOUN)
+    word = result if result is not None else word
+
+    # Step 2
+    if word.endswith("и") and len(word) - 1 >= rv:
+        word = word[:-1]
+
+    # Step 3
+    word = remove_suffix(word, max(r2, rv), DERIVATIONAL) or word
+
+    # Step 4
+    if word.endswith("нн") and len(word) - 2 >= rv:
+        word = word[:-1]
+    else:
+        result = remove_suffix(word, rv, SUPERLATIVE)
+        if result is not None:
+            word = result[:-1] if result.endswith("нн") and len(result) - 2 >= rv else result
+        elif word.endswith("ь") and len(word) - 1 >= rv:
+            word = word[:-1]
+    return word
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Compact sharded search index for the HTML book (post-render).
+
+Quarto's search.json holds the full text of every chapter and is downloaded
+whole on the first search. This script builds a compact index from the
+rendered HTML instead:
+
+- documents: sections (with their anchors), figure captions and the
+  glossary entries of src/Abbrevations.qmd
+- terms: Russian Snowball stems (russian_stemmer.py) → posting lists
+  [[document, weight], ...]; title, caption and abbreviation words weigh
+  more, repeated words saturate
+- shards: postings split by the first two letters of the stem
+
+Layout in the output directory:
+
+    search-index/index.json           pages, documents, stop words, shard names
+    search-index/shards/<prefix>.json {stem: postings}
+    search-index/snippets/<n>.json    result snippets, SNIPPET_BLOCK documents each
+    search-index/book-search.js       loader (from build/book-search.js)
+
+The loader fetches index.json once and then only the shards of the query
+terms, so the download no longer grows with the whole book. It is added to
+every page; BookSearch.search(query) returns ranked results, and inputs
+marked data-book-search get a result list. _quarto.yml includes such an
+input in every page (build/book-search.html) and turns Quarto's own search
+off, so search.json is no longer built or fetched.
+
+Usage (run by Quarto as post-render; standalone after quarto render):
+    python scripts/search_index.py
+    python scripts/search_index.py --output-dir _book
+"""
+
+import json
+import os
+import re
+import shutil
+import sys
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+from lxml import html as lxml_html
+
+from abbreviations import GLOSSARY_CHAPTER, parse_glossary
+from quarto_project import QUARTO_CONFIG, load_quarto_config, post_render_enabled
+from russian_stemmer import stem
+
+INDEX_VERSION = 1
+INDEX_DIR = "search-index"
+LOADER_SOURCE = "build/book-search.js"
+LOADER_NAME = "book-search.js"
+SHARD_PREFIX_LENGTH = 2
+SNIPPET_LENGTH = 120
+# Snippets are only fetched for displayed results, in blocks of documents
+SNIPPET_BLOCK = 64
+TITLE_WEIGHT = 5
+CAPTION_WEIGHT = 3
+ABBREVIATION_WEIGHT = 10
+TERM_COUNT_CAP = 3
+WORD_PATTERN = re.compile(r"\w+")
+STOP_WORDS = frozenset(
+    "а без более бы был была были было быть в вам вас весь во вот все всех вы где да даже для до его "
+    "ее если есть еще же за и из или им их к как ко когда который кто ли либо между мы на над него "
+    "нее нет ни них но о об однако он она они оно от по под при про с со так также такой там те то "
+    "того тоже той только том ту у уже чем что чтобы эта эти это этого этой этом"
+    .split()
+)
+
+
+class Document(NamedTuple):
+    page: int
+    anchor: str
+    title: str
+    kind: str  # "s" section, "f" figure, "a" abbreviation
+    snippet: str
+
+
+def terms_of(text: str) -> List[str]:
+    """Stems of the indexable words of text"""
+    words = WORD_PATTERN.findall(text.lower().replace("ё", "е"))
+    return [stem(word) for word in words if word not in STOP_WORDS and (len(word) > 1 or word.isdigit())]
+
+
+def shard_name(term: str) -> str:
+    """Shard of a term: code points of its first letters ("кишк" -> "043a-0438")"""
+    return "-".join(f"{ord(char):04x}" for char in term[:SHARD_PREFIX_LENGTH])
+
+
+def element_text(element, skip=("section", "script", "style", "nav")) -> str:
+    """Text of element without nested sections and non-content elements"""
+    parts = [element.text or ""]
+    for child in element:
+        if isinstance(child.tag, str) and child.tag not in skip:
+            parts.append(element_text(child, skip))
+        parts.append(child.tail or "")
+    return " ".join(" ".join(parts).split())
+
+
+def snippet(text: str) -> str:
+    return text if len(text) <= SNIPPET_LENGTH else text[:SNIPPET_LENGTH].rsplit(" ", 1)[0] + "…"
+
+
+class IndexBuilder:
+    """Collects documents and weighted postings"""
+
+    def __init__(self):
+        self.pages: List[List[str]] = []
+        self.documents: List[Document] = []
+        self.postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+
+    def add(self, document: Document, weighted_texts):
+        doc_id = len(self.documents)
+        self.documents.append(document)
+        for text, weight in weighted_texts:
+            # Saturate repeated terms so long sections do not outrank exact title hits
+            for term, count in Counter(terms_of(text)).items():
+                self.postings[term][doc_id] = self.postings[term].get(doc_id, 0) + weight * min(count, TERM_COUNT_CAP)
+
+    def add_page(self, path: Path, href: str):
+        """Index the sections and figure captions of a rendered page"""
+        # Quarto writes UTF-8; do not guess from the (possibly missing) meta tag
+        tree = lxml_html.parse(str(path), parser=lxml_html.HTMLParser(encoding="utf-8"))
+        main = tree.find(".//main")
+        if main is None:
+            main = tree.getroot().find("body")
+        if main is None:
+            return
+        page_title = " ".join(main.xpath("string(.//h1[1])").split()) or " ".join(
+            tree.getroot().xpath("string(//title)").split()
+        )
+
+        page = len(self.pages)
+        self.pages.append([href, page_title])
+
+        # Text before the first section belongs to the page itself
+        lead = element_text(main, skip=("section", "script", "style", "nav", "header"))
+        self.add(Document(page, "", "", "s", snippet(lead)), [(page_title, TITLE_WEIGHT), (lead, 1)])
+
+        for section in main.iter("section"):
+            section_id = section.get("id")
+            heading = section.find("./*[1]")
+            if not section_id or heading is None or not re.fullmatch(r"h[1-6]", str(heading.tag)):
+                continue
+            heading_text = " ".join(heading.text_content().split())
+            body = element_text(section, skip=("section", "script", "style", "nav", heading.tag))
+            self.add(
+                Document(page, section_id, heading_text, "s", snippet(body)),
+                [(heading_text, TITLE_WEIGHT), (body, 1)],
+            )
+
+        for figure in main.xpath('.//*[starts-with(@id, "fig-")]'):
+            captions = figure.xpath('.//figcaption | .//*[contains(@class, "caption")]')
+            caption = " ".join(captions[0].text_content().split()) if captions else ""
+            if caption:
+                self.add(
+                    Document(page, figure.get("id"), caption, "f", ""),
+                    [(caption, CAPTION_WEIGHT)],
+                )
+
+    def add_glossary(self, glossary_path: str, href: str):
+        """Index every abbreviation of the glossary as its own document"""
+        pages = [page for page, (page_href, _) in enumerate(self.pages) if page_href == href]
+        if pages:
+            page = pages[0]
+        else:
+            page = len(self.pages)
+            self.pages.append([href, ""])
+        for abbreviation in parse_glossary(glossary_path):
+            title = f"{abbreviation.term} — {abbreviation.expansion}"
+            self.add(
+                Document(page, "", title, "a", ""),
+                [(abbreviation.term, ABBREVIATION_WEIGHT), (abbreviation.expansion, CAPTION_WEIGHT)],
+            )
+
+    def write(self, index_dir: Path):
+        """Write index.json and the shards, replacing a previous index"""
+        if index_dir.exists():
+            shutil.rmtree(index_dir)
+        (index_dir / "shards").mkdir(parents=True)
+        (index_dir / "snippets").mkdir()
+
+        shards: Dict[str, Dict[str, List[List[int]]]] = defaultdict(dict)
+        for term, documents in self.postings.items():
+            shards[shard_name(term)][term] = sorted(documents.items())
+        for name, terms in shards.items():
+            with open(index_dir / "shards" / f"{name}.json", "w", encoding="utf-8") as f:
+                json.dump(terms, f, ensure_ascii=False, separators=(",", ":"))
+
+        for block in range(0, len(self.documents), SNIPPET_BLOCK):
+            with open(index_dir / "snippets" / f"{block // SNIPPET_BLOCK}.json", "w", encoding="utf-8") as f:
+                json.dump(
+                    [document.snippet for document in self.documents[block:block + SNIPPET_BLOCK]],
+                    f, ensure_ascii=False, separators=(",", ":"),
+                )
+
+        manifest = {
+            "version": INDEX_VERSION,
+            "prefix": SHARD_PREFIX_LENGTH,
+            "snippetBlock": SNIPPET_BLOCK,
+            "stopWords": sorted(STOP_WORDS),
+            "pages": self.pages,
+            "documents": [[document.page, document.anchor, document.title, document.kind]
+                          for document in self.documents],
+            "shards": sorted(shards),
+        }
+        with open(index_dir / "index.json", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, separators=(",", ":"))
+        return len(shards)
+
+
+def output_href(source: str) -> str:
+    """Rendered page of a source file, relative to the output directory"""
+    return Path(source).with_suffix(".html").as_posix()
+
+
+def inject_loader(page: Path, output_dir: Path):
+    """Add the loader script to a page (once), with a path relative to the page"""
+    text = page.read_text(encoding="utf-8")
+    if LOADER_NAME in text or "</body>" not in text:
+        return
+    src = Path(os.path.relpath(output_dir / INDEX_DIR / LOADER_NAME, page.parent)).as_posix()
+    text = text.replace("</body>", f'<script src="{src}" defer></script>\n</body>', 1)
+    page.write_text(text, encoding="utf-8")
+
+
+def build_search_index(output_dir: Path, inject: bool = True) -> Optional[int]:
+    """Index every HTML page of output_dir; returns the number of documents, None without HTML"""
+    pages = sorted(
+        page for page in output_dir.rglob("*.html")
+        if INDEX_DIR not in page.relative_to(output_dir).parts and "site_libs" not in page.parts
+    )
+    if not pages:
+        return None
+
+    builder = IndexBuilder()
+    for page in pages:
+        builder.add_page(page, page.relative_to(output_dir).as_posix())
+    if Path(GLOSSARY_CHAPTER).is_file():
+        builder.add_glossary(GLOSSARY_CHAPTER, output_href(GLOSSARY_CHAPTER))
+
+    index_dir = output_dir / INDEX_DIR
+    shard_count = builder.write(index_dir)
+    shutil.copyfile(LOADER_SOURCE, index_dir / LOADER_NAME)
+    if inject:
+        for page in pages:
+            inject_loader(page, output_dir)
+
+    size = sum(path.stat().st_size for path in index_dir.rglob("*.json"))
+    manifest_size = (index_dir / "index.json").stat().st_size
+    print(f"✓ Search index: {len(builder.documents)} documents, {len(builder.postings)} terms "
+          f"in {shard_count} shards ({size / 1024:.0f} KB, index.json {manifest_size / 1024:.0f} KB) "
+          f"→ {index_dir}")
+    return len(builder.documents)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build the sharded search index of the HTML book")
+    parser.add_argument(
+        "--output-dir",
+        default=None,
+        help="Rendered book (default: $QUARTO_PROJECT_OUTPUT_DIR or project.output-dir)",
+    )
+    parser.add_argument("--no-inject", action="store_true", help="Do not add the loader to the pages")
+    args = parser.parse_args()
+
+    if not Path(QUARTO_CONFIG).exists():
+        print(f"Error: {QUARTO_CONFIG} not found. Please run from project root.")
+        sys.exit(1)
+
+    if not post_render_enabled(__file__):
+        print(f"Skipping {Path(__file__).name} (not in fast-preview.post-render)")
+        sys.exit(0)
+
+    output_dir = Path(
+        args.output_dir
+        or os.environ.get("QUARTO_PROJECT_OUTPUT_DIR")
+        or (load_quarto_config().get("project") or {}).get("output-dir", "_book")
+    )
+    if build_search_index(output_dir, inject=not args.no_inject) is None:
+        print(f"No HTML pages in {output_dir}, search index not built")
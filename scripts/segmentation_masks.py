@@ -0,0 +1,633 @@
+#!/usr/bin/env python3
+"""
+Segmentation masks from the annotation layers, for a teaching dataset.
+
+Each annotation SVG draws labelled regions (mucosa, tumor, lymph_node, ...)
+over one or more embedded MRI/CT slices. For every embedded <image> this
+script writes a label mask on the image's own pixel grid:
+
+- the layer of a shape is resolved with get_layer_name (as when styling);
+  class ids follow img/layers.txt, then the remaining classes of the
+  stylesheet in alphabetical order; 0 is background. Shapes of other layers
+  ("Слой 1", arrows, distances) are skipped
+- paths, rects, circles and ellipses are flattened to polygons, mapped
+  through the SVG transforms and the image placement into pixel space and
+  filled (nonzero or evenodd fill-rule) with a vectorised scanline: the
+  crossings of all edges with all pixel rows are computed at once and the
+  winding numbers accumulated with a cumulative sum, no per-pixel Python
+- layers the stylesheet draws as outlines only (fill: none, e.g.
+  mesorectal_fascia) are rasterised as a band of the stroke width instead
+- shapes are painted in document order, later ones on top
+
+Masks are written as <output-dir>/<svg path>/<image>.png (8-bit, pixel =
+class id) and .npz (array "labels"), with legend.json (id → layer) and
+dataset.json (every mask with its source and class pixel counts). Files are
+processed in parallel; a file is skipped when the content hash of the SVG,
+its linked rasters and the legend matches the one recorded in meta.json.
+
+Usage:
+    python scripts/segmentation_masks.py
+    python scripts/segmentation_masks.py --output-dir dataset --format npz
+"""
+
+import base64
+import hashlib
+import io
+import json
+import math
+import multiprocessing
+import os
+import re
+import sys
+from functools import partial
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from lxml import etree
+from PIL import Image
+
+from config import load_config, Settings
+from image_cache import hash_file, linked_images
+from prepare_images import find_annotation_files, get_layer_name, is_relative_href, load_styles
+from quarto_project import QUARTO_CONFIG
+
+MASK_FORMAT = 1
+LAYERS_FILE = "layers.txt"
+LEGEND_FILE = "legend.json"
+DATASET_FILE = "dataset.json"
+META_FILE = "meta.json"
+CURVE_SEGMENTS = 16
+# "- tumor: Контур опухоли" or "- наружный сфинктер: external_sphincter"
+LAYER_LINE_PATTERN = re.compile(r"^-\s*([^:]+?)\s*(?::\s*(.*?))?\s*$")
+LAYER_NAME_PATTERN = re.compile(r"^[a-z][a-z0-9_]*$")
+PATH_TOKEN_PATTERN = re.compile(r"[MmLlHhVvCcSsQqTtAaZz]|[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+TRANSFORM_PATTERN = re.compile(r"(matrix|translate|scale|rotate|skewX|skewY)\s*\(([^)]*)\)")
+NUMBER_PATTERN = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+PATH_ARGUMENTS = {"M": 2, "L": 2, "H": 1, "V": 1, "C": 6, "S": 4, "Q": 4, "T": 2, "A": 7, "Z": 0}
+
+
+class LayerClass(NamedTuple):
+    id: int
+    name: str
+    description: str
+    outline: bool  # drawn as a stroke only
+
+
+# Geometry
+
+
+def parse_transform(value: Optional[str]) -> np.ndarray:
+    """3×3 affine matrix of an SVG transform attribute"""
+    matrix = np.eye(3)
+    for name, arguments in TRANSFORM_PATTERN.findall(value or ""):
+        a = [float(n) for n in NUMBER_PATTERN.findall(arguments)]
+        if name == "matrix" and len(a) == 6:
+            step = np.array([[a[0], a[2], a[4]], [a[1], a[3], a[5]], [0, 0, 1]])
+        elif name == "translate" and a:
+            step = np.array([[1, 0, a[0]], [0, 1, a[1] if len(a) > 1 else 0], [0, 0, 1]])
+        elif name == "scale" and a:
+            step = np.diag([a[0], a[1] if len(a) > 1 else a[0], 1])
+        elif name == "rotate" and a:
+            angle = math.radians(a[0])
+            cx, cy = (a[1], a[2]) if len(a) == 3 else (0, 0)
+            cos, sin = math.cos(angle), math.sin(angle)
+            step = np.array([
+                [cos, -sin, cx - cos * cx + sin * cy],
+                [sin, cos, cy - sin * cx - cos * cy],
+                [0, 0, 1],
+            ])
+        elif name == "skewX" and a:
+            step = np.array([[1, math.tan(math.radians(a[0])), 0], [0, 1, 0], [0, 0, 1]])
+        elif name == "skewY" and a:
+            step = np.array([[1, 0, 0], [math.tan(math.radians(a[0])), 1, 0], [0, 0, 1]])
+        else:
+            continue
+        matrix = matrix @ step
+    return matrix
+
+
+def element_transform(element) -> np.ndarray:
+    """Transform from the element's user space to the root user space"""
+    matrix = np.eye(3)
+    while element is not None:
+        if isinstance(element.tag, str):
+            matrix = parse_transform(element.get("transform")) @ matrix
+        element = element.getparent()
+    return matrix
+
+
+def apply_transform(matrix: np.ndarray, points: np.ndarray) -> np.ndarray:
+    return points @ matrix[:2, :2].T + matrix[:2, 2]
+
+
+def bezier(points: np.ndarray) -> np.ndarray:
+    """Flatten a Bézier curve given by its control points (start excluded)"""
+    t = np.linspace(0, 1, CURVE_SEGMENTS + 1)[1:, None]
+    degree = len(points) - 1
+    weights = [math.comb(degree, k) * (1 - t) ** (degree - k) * t ** k for k in range(degree + 1)]
+    return sum(w * p for w, p in zip(weights, points))
+
+
+def arc(start, rx, ry, rotation, large_arc, sweep, end) -> np.ndarray:
+    """Flatten an elliptical arc (SVG endpoint parameterisation, start excluded)"""
+    if rx == 0 or ry == 0 or np.allclose(start, end):
+        return np.array([end])
+    rx, ry = abs(rx), abs(ry)
+    phi = math.radians(rotation)
+    cos, sin = math.cos(phi), math.sin(phi)
+    dx, dy = (start - end) / 2
+    x1 = cos * dx + sin * dy
+    y1 = -sin * dx + cos * dy
+    scale = x1 ** 2 / rx ** 2 + y1 ** 2 / ry ** 2
+    if scale > 1:
+        rx, ry = rx * math.sqrt(scale), ry * math.sqrt(scale)
+    numerator = rx ** 2 * ry ** 2 - rx ** 2 * y1 ** 2 - ry ** 2 * x1 ** 2
+    factor = math.sqrt(max(numerator, 0) / (rx ** 2 * y1 ** 2 + ry ** 2 * x1 ** 2))
+    if large_arc == sweep:
+        factor = -factor
+    cx1, cy1 = factor * rx * y1 / ry, -factor * ry * x1 / rx
+    center = np.array([cos * cx1 - sin * cy1, sin * cx1 + cos * cy1]) + (start + end) / 2
+    theta = math.atan2((y1 - cy1) / ry, (x1 - cx1) / rx)
+    delta = math.atan2((-y1 - cy1) / ry, (-x1 - cx1) / rx) - theta
+    if sweep and delta < 0:
+        delta += 2 * math.pi
+    elif not sweep and delta > 0:
+        delta -= 2 * math.pi
+    angles = theta + delta * np.linspace(0, 1, CURVE_SEGMENTS + 1)[1:]
+    ellipse = np.stack([rx * np.cos(angles), ry * np.sin(angles)], axis=1)
+    return ellipse @ np.array([[cos, sin], [-sin, cos]]) + center
+
+
+def path_subpaths(d: str) -> List[Tuple[np.ndarray, bool]]:
+    """Flatten SVG path data to (points, closed) subpaths in user units"""
+    tokens = PATH_TOKEN_PATTERN.findall(d or "")
+    subpaths = []
+    points: List[np.ndarray] = []
+    current = np.zeros(2)
+    start = np.zeros(2)
+    last_control = None
+    last_shape = None
+    command = None
+    i = 0
+
+    def finish(closed):
+        if len(points) > 1:
+            subpaths.append((np.vstack(points), closed))
+
+    while i < len(tokens):
+        if tokens[i].isalpha():
+            command = tokens[i]
+            i += 1
+            if command in "Zz":
+                finish(True)
+                points = []
+                current = start.copy()
+                last_control = None
+                continue
+        if command is None:
+            break
+        count = PATH_ARGUMENTS[command.upper()]
+        if count == 0 or i + count > len(tokens) or any(token.isalpha() for token in tokens[i:i + count]):
+            break
+        a = [float(token) for token in tokens[i:i + count]]
+        i += count
+        relative = command.islower()
+        origin = current if relative else np.zeros(2)
+        upper = command.upper()
+        control = None
+
+        if upper == "M":
+            finish(False)
+            current = origin + a
+            start = current.copy()
+            points = [current[None, :]]
+            # Further coordinate pairs are implicit lineto
+            command = "l" if relative else "L"
+            last_control = None
+            continue
+        if not points:
+            points = [current[None, :]]
+        if upper == "L":
+            new = origin + a
+            segment = new[None, :]
+        elif upper == "H":
+            new = np.array([a[0] + (current[0] if relative else 0), current[1]])
+            segment = new[None, :]
+        elif upper == "V":
+            new = np.array([current[0], a[0] + (current[1] if relative else 0)])
+            segment = new[None, :]
+        elif upper in ("C", "S"):
+            if upper == "C":
+                c1, c2, new = origin + a[0:2], origin + a[2:4], origin + a[4:6]
+            else:
+                c1 = 2 * current - last_control if last_control is not None and last_shape == "C" else current
+                c2, new = origin + a[0:2], origin + a[2:4]
+            segment = bezier(np.array([current, c1, c2, new]))
+            control = c2
+        elif upper in ("Q", "T"):
+            if upper == "Q":
+                c1, new = origin + a[0:2], origin + a[2:4]
+            else:
+                c1 = 2 * current - last_control if last_control is not None and last_shape == "Q" else current
+                new = origin + a[0:2]
+            segment = bezier(np.array([current, c1, new]))
+            control = c1
+        else:
+            new = origin + a[5:7]
+            segment = arc(current, a[0], a[1], a[2], bool(a[3]), bool(a[4]), new)
+        points.append(segment)
+        current = new
+        last_control = control
+        last_shape = "C" if upper in "CS" else "Q" if upper in "QT" else None
+    finish(False)
+    return subpaths
+
+
+def shape_subpaths(element) -> List[Tuple[np.ndarray, bool]]:
+    """Flattened outline of a path, rect, circle or ellipse in its user units"""
+    tag = etree.QName(element).localname
+    number = lambda name: float(NUMBER_PATTERN.match(element.get(name, "0") or "0").group(0))  # noqa: E731
+    if tag == "path":
+        return path_subpaths(element.get("d"))
+    if tag == "rect":
+        x, y, width, height = number("x"), number("y"), number("width"), number("height")
+        corners = np.array([[x, y], [x + width, y], [x + width, y + height], [x, y + height]])
+        return [(corners, True)]
+    if tag in ("circle", "ellipse"):
+        rx = number("r") if tag == "circle" else number("rx")
+        ry = number("r") if tag == "circle" else number("ry")
+        angles = np.linspace(0, 2 * math.pi, 4 * CURVE_SEGMENTS, endpoint=False)
+        outline = np.stack([number("cx") + rx * np.cos(angles), number("cy") + ry * np.sin(angles)], axis=1)
+        return [(outline, True)]
+    return []
+
+
+# Rasterisation
+
+
+def fill_polygons(polygons: List[np.ndarray], height: int, width: int, evenodd: bool = False) -> np.ndarray:
+    """Boolean mask of the pixels whose centres lie inside the polygons"""
+    edges = [
+        np.hstack([polygon, np.roll(polygon, -1, axis=0)])
+        for polygon in polygons if len(polygon) > 2
+    ]
+    if not edges:
+        return np.zeros((height, width), dtype=bool)
+    edges = np.vstack(edges)
+    x0, y0, x1, y1 = edges.T
+    edges = edges[y0 != y1]
+    x0, y0, x1, y1 = edges.T
+    direction = np.where(y1 > y0, 1, -1)
+    # Rows whose pixel centre y + 0.5 lies in [min(y0, y1), max(y0, y1))
+    first = np.clip(np.ceil(np.minimum(y0, y1) - 0.5), 0, height).astype(np.int64)
+    last = np.clip(np.ceil(np.maximum(y0, y1) - 0.5), 0, height).astype(np.int64)
+    counts = last - first
+    edge_index = np.repeat(np.arange(len(edges)), counts)
+    rows = first[edge_index] + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    centre = rows + 0.5
+    x = x0[edge_index] + (centre - y0[edge_index]) * (
+        (x1 - x0)[edge_index] / (y1 - y0)[edge_index]
+    )
+    # The crossing toggles every pixel whose centre lies right of it
+    columns = np.clip(np.ceil(x - 0.5), 0, width).astype(np.int64)
+    winding = np.zeros((height, width + 1), dtype=np.int32)
+    np.add.at(winding, (rows, columns), 1 if evenodd else direction[edge_index])
+    winding = np.cumsum(winding, axis=1)[:, :width]
+    return (winding % 2 == 1) if evenodd else (winding != 0)
+
+
+def stroke_polylines(polylines: List[np.ndarray], height: int, width: int, line_width: float) -> np.ndarray:
+    """Boolean mask of the pixels within line_width / 2 of the polylines"""
+    mask = np.zeros((height, width), dtype=bool)
+    segments = [np.hstack([polyline[:-1], polyline[1:]]) for polyline in polylines if len(polyline) > 1]
+    if not segments:
+        return mask
+    segments = np.vstack(segments)
+    start, end = segments[:, :2], segments[:, 2:]
+    # Sample every segment at half-pixel spacing, then stamp a disc at each sample
+    steps = np.maximum(np.ceil(np.linalg.norm(end - start, axis=1) * 2), 1).astype(np.int64)
+    segment_index = np.repeat(np.arange(len(segments)), steps + 1)
+    t = (np.arange(len(segment_index)) - np.repeat(np.cumsum(steps + 1) - (steps + 1), steps + 1)) / steps[segment_index]
+    samples = start[segment_index] + t[:, None] * (end - start)[segment_index]
+
+    radius = max(line_width / 2, 0.5)
+    reach = int(math.ceil(radius))
+    oy, ox = np.mgrid[-reach:reach + 1, -reach:reach + 1]
+    disc = (ox ** 2 + oy ** 2) <= radius ** 2
+    ox, oy = ox[disc], oy[disc]
+    columns = (np.floor(samples[:, 0])[:, None] + ox[None, :]).astype(np.int64).ravel()
+    rows = (np.floor(samples[:, 1])[:, None] + oy[None, :]).astype(np.int64).ravel()
+    inside = (rows >= 0) & (rows < height) & (columns >= 0) & (columns < width)
+    mask[rows[inside], columns[inside]] = True
+    return mask
+
+
+# Legend and documents
+
+
+def load_legend(layers_path, styles: Dict[str, Dict[str, Any]]) -> List[LayerClass]:
+    """Classes of img/layers.txt, then the other stylesheet classes"""
+    described: Dict[str, str] = {}
+    try:
+        lines = Path(layers_path).read_text(encoding="utf-8").splitlines()
+    except OSError:
+        lines = []
+    for line in lines:
+        match = LAYER_LINE_PATTERN.match(line.strip())
+        if not match:
+            continue
+        left, right = match.group(1), match.group(2) or ""
+        # Either side of the colon may carry the layer name
+        if LAYER_NAME_PATTERN.match(left):
+            described.setdefault(left, right)
+        elif LAYER_NAME_PATTERN.match(right):
+            described.setdefault(right, left)
+    names = list(described) + sorted(
+        name for name in styles if name not in described and LAYER_NAME_PATTERN.match(name)
+    )
+    return [
+        LayerClass(index, name, described.get(name, ""), is_outline(styles.get(name, {})))
+        for index, name in enumerate(names, start=1)
+    ]
+
+
+def is_outline(style: Dict[str, Any]) -> bool:
+    return str(style.get("fill", "")).strip() == "none" and str(style.get("stroke", "none")).strip() != "none"
+
+
+def stroke_width(style: Dict[str, Any], viewport: Tuple[float, float]) -> float:
+    """Stroke width in root user units (percentages of the normalised viewport diagonal)"""
+    value = str(style.get("stroke-width", "1")).strip()
+    number = NUMBER_PATTERN.match(value)
+    if number is None:
+        return 1.0
+    width = float(number.group(0))
+    if value.endswith("%"):
+        return width / 100 * math.hypot(*viewport) / math.sqrt(2)
+    return width
+
+
+def viewport_size(root) -> Tuple[float, float]:
+    view_box = [float(n) for n in NUMBER_PATTERN.findall(root.get("viewBox", ""))]
+    if len(view_box) == 4:
+        return view_box[2], view_box[3]
+    width = NUMBER_PATTERN.match(root.get("width", "") or "")
+    height = NUMBER_PATTERN.match(root.get("height", "") or "")
+    return (float(width.group(0)) if width else 100.0, float(height.group(0)) if height else 100.0)
+
+
+def open_embedded(href: str, svg_dir: str) -> Optional[Image.Image]:
+    if href.startswith("data:"):
+        try:
+            return Image.open(io.BytesIO(base64.b64decode(href.split(",", 1)[1])))
+        except (IndexError, ValueError, OSError):
+            return None
+    if not is_relative_href(href):
+        return None
+    try:
+        return Image.open(os.path.join(svg_dir, href))
+    except OSError:
+        return None
+
+
+def image_placement(element, pixel_size: Tuple[int, int]) -> np.ndarray:
+    """Matrix from image pixel coordinates to root user space"""
+    number = lambda name: float(NUMBER_PATTERN.match(element.get(name, "0") or "0").group(0))  # noqa: E731
+    x, y = number("x"), number("y")
+    pixels_x, pixels_y = pixel_size
+    width = number("width") or pixels_x
+    height = number("height") or pixels_y
+    scale_x, scale_y = width / pixels_x, height / pixels_y
+    aspect = (element.get("preserveAspectRatio") or "xMidYMid meet").split()
+    if aspect[0] != "none":
+        scale = max(scale_x, scale_y) if aspect[-1] == "slice" else min(scale_x, scale_y)
+        align = aspect[0]
+        fraction_x = {"xMin": 0, "xMid": 0.5, "xMax": 1}.get(align[:4], 0.5)
+        fraction_y = {"YMin": 0, "YMid": 0.5, "YMax": 1}.get(align[4:], 0.5)
+        x += (width - pixels_x * scale) * fraction_x
+        y += (height - pixels_y * scale) * fraction_y
+        scale_x = scale_y = scale
+    placement = np.array([[scale_x, 0, x], [0, scale_y, y], [0, 0, 1]])
+    return element_transform(element) @ placement
+
+
+class Shape(NamedTuple):
+    class_id: int
+    subpaths: List[Tuple[np.ndarray, bool]]  # root user units
+    evenodd: bool
+    outline_width: float  # root user units, 0 for filled regions
+
+
+def collect_shapes(tree, nsmap, styles, legend: List[LayerClass], viewport) -> Tuple[List[Shape], Dict[str, int]]:
+    """Labelled shapes in document order, and the skipped layers with their shape counts"""
+    classes = {layer.name: layer for layer in legend}
+    shape_tags = {f"{{{nsmap['svg']}}}{name}" for name in ("path", "rect", "circle", "ellipse")}
+    shapes, skipped = [], {}
+    for element in tree.iter(*shape_tags):
+        if element.xpath("ancestor::*[local-name()='defs' or local-name()='clipPath' or local-name()='mask']"):
+            continue
+        layer_name = get_layer_name(element, nsmap, styles.keys())
+        layer = classes.get(layer_name)
+        if layer is None:
+            skipped[layer_name or "(none)"] = skipped.get(layer_name or "(none)", 0) + 1
+            continue
+        matrix = element_transform(element)
+        subpaths = [(apply_transform(matrix, points), closed) for points, closed in shape_subpaths(element)]
+        style = element.get("style", "")
+        evenodd = "fill-rule:evenodd" in style.replace(" ", "") or element.get("fill-rule") == "evenodd"
+        outline_width = stroke_width(styles.get(layer.name, {}), viewport) if layer.outline else 0.0
+        shapes.append(Shape(layer.id, subpaths, evenodd, outline_width))
+    return shapes, skipped
+
+
+def rasterize(shapes: List[Shape], pixel_to_user: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+    """Label mask of the shapes on an image's pixel grid (uint8, 0 = background)"""
+    width, height = size
+    user_to_pixel = np.linalg.inv(pixel_to_user)
+    # Lengths scale by the square root of the determinant for non-uniform scaling
+    pixels_per_unit = math.sqrt(abs(np.linalg.det(user_to_pixel[:2, :2])))
+    labels = np.zeros((height, width), dtype=np.uint8)
+    for shape in shapes:
+        subpaths = [(apply_transform(user_to_pixel, points), closed) for points, closed in shape.subpaths]
+        if shape.outline_width:
+            polylines = [np.vstack([p, p[:1]]) if closed else p for p, closed in subpaths]
+            mask = stroke_polylines(polylines, height, width, shape.outline_width * pixels_per_unit)
+        else:
+            mask = fill_polygons([p for p, _ in subpaths], height, width, shape.evenodd)
+        labels[mask] = shape.class_id
+    return labels
+
+
+def masks_key(svg_path, nsmap, legend: List[LayerClass], styles) -> str:
+    svg_dir = os.path.dirname(os.path.abspath(svg_path))
+    parts = {
+        "format": MASK_FORMAT,
+        "svg": hash_file(svg_path),
+        "linked": {os.path.relpath(path, svg_dir): hash_file(path) for path in linked_images(svg_path, nsmap)},
+        "legend": [list(layer) for layer in legend],
+        "outlines": {layer.name: styles.get(layer.name, {}).get("stroke-width") for layer in legend if layer.outline},
+    }
+    encoded = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def mask_dir(svg_path, output_dir: Path) -> Path:
+    return output_dir / Path(os.path.relpath(svg_path)).with_suffix("")
+
+
+def export_masks(svg_path, output_dir: Path, nsmap, styles, legend: List[LayerClass], formats) -> Dict[str, Any]:
+    """Write the masks of one annotation SVG (unless cached), return its meta record"""
+    target = mask_dir(svg_path, output_dir)
+    key = masks_key(svg_path, nsmap, legend, styles)
+    try:
+        with open(target / META_FILE, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("key") == key and all((target / name).exists() for mask in meta["masks"] for name in mask["files"]):
+            meta["cached"] = True
+            return meta
+    except (OSError, json.JSONDecodeError, KeyError):
+        pass
+
+    tree = etree.parse(svg_path, etree.XMLParser(huge_tree=True))
+    shapes, skipped = collect_shapes(tree, nsmap, styles, legend, viewport_size(tree.getroot()))
+    svg_dir = os.path.dirname(os.path.abspath(svg_path))
+    target.mkdir(parents=True, exist_ok=True)
+    masks = []
+    used_names = set()
+    for element in tree.iter(f"{{{nsmap['svg']}}}image"):
+        href = element.get(f"{{{nsmap['xlink']}}}href") or element.get("href") or ""
+        image = open_embedded(href, svg_dir)
+        if image is None:
+            print(f"Warning: cannot open image {href[:60]} in {svg_path}")
+            continue
+        size = image.size
+        image.close()
+        name = Path(href).stem if not href.startswith("data:") else element.get("id", "image")
+        while name in used_names:
+            name += "_"
+        used_names.add(name)
+
+        labels = rasterize(shapes, image_placement(element, size), size)
+        files = []
+        if "png" in formats:
+            Image.fromarray(labels, mode="L").save(target / f"{name}.png", optimize=True)
+            files.append(f"{name}.png")
+        if "npz" in formats:
+            np.savez_compressed(target / f"{name}.npz", labels=labels)
+            files.append(f"{name}.npz")
+        ids, counts = np.unique(labels, return_counts=True)
+        masks.append({
+            "image": href if not href.startswith("data:") else f"data:#{element.get('id', '')}",
+            "size": list(size),
+            "files": files,
+            "pixels": {int(i): int(c) for i, c in zip(ids, counts) if i},
+        })
+
+    meta = {
+        "key": key,
+        "source": Path(os.path.relpath(svg_path)).as_posix(),
+        "masks": masks,
+        "skipped_layers": skipped,
+    }
+    with open(target / META_FILE, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=1)
+    meta["cached"] = False
+    return meta
+
+
+def export_job(svg_path, **kwargs):
+    """Pool worker: export one file, return (path, meta, error message)"""
+    try:
+        return svg_path, export_masks(svg_path, **kwargs), None
+    except Exception as e:
+        return svg_path, None, f"{type(e).__name__}: {e}"
+
+
+def export_dataset(config: Settings, output_dir: Path, formats=("png", "npz")) -> List[Tuple[str, str]]:
+    """Export the masks of every annotation SVG; returns (file, error) for failures"""
+    styles = load_styles(config.processing.default_style_file, default_styles=config.get_default_styles())
+    base_folder = config.processing.default_folder
+    legend = load_legend(Path(base_folder) / LAYERS_FILE, styles)
+    nsmap = config.get_nsmap()
+    annotation_files = find_annotation_files(base_folder, config)
+
+    worker = partial(
+        export_job, output_dir=output_dir, nsmap=nsmap, styles=styles, legend=legend, formats=formats
+    )
+    num_processes = min(len(annotation_files), multiprocessing.cpu_count()) or 1
+    if config.processing.max_processes > 0:
+        num_processes = min(num_processes, config.processing.max_processes)
+    with multiprocessing.Pool(processes=num_processes) as pool:
+        results = sorted(pool.imap_unordered(worker, annotation_files))
+
+    failures = [(path, error) for path, _, error in results if error]
+    records = [meta for _, meta, error in results if not error]
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with open(output_dir / LEGEND_FILE, "w", encoding="utf-8") as f:
+        json.dump(
+            {"background": 0, "classes": [
+                {"id": layer.id, "name": layer.name, "description": layer.description,
+                 "kind": "outline" if layer.outline else "region"}
+                for layer in legend
+            ]},
+            f, ensure_ascii=False, indent=1,
+        )
+    with open(output_dir / DATASET_FILE, "w", encoding="utf-8") as f:
+        json.dump(
+            [
+                {
+                    "source": meta["source"],
+                    "image": mask["image"],
+                    "size": mask["size"],
+                    "files": [
+                        (mask_dir(meta["source"], output_dir) / name).relative_to(output_dir).as_posix()
+                        for name in mask["files"]
+                    ],
+                    "pixels": mask["pixels"],
+                }
+                for meta in records for mask in meta["masks"]
+            ],
+            f, ensure_ascii=False, indent=1,
+        )
+
+    skipped: Dict[str, int] = {}
+    for meta in records:
+        for layer, count in meta["skipped_layers"].items():
+            skipped[layer] = skipped.get(layer, 0) + count
+    if skipped:
+        print("Layers without a class (not in the masks): "
+              + ", ".join(f"{layer} ({count})" for layer, count in sorted(skipped.items())))
+    cached = sum(meta["cached"] for meta in records)
+    count = sum(len(meta["masks"]) for meta in records)
+    print(f"✓ {count} masks from {len(records)} annotation files in {output_dir} "
+          f"({cached} files unchanged, {len(legend)} classes in {LEGEND_FILE})")
+    return failures
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export annotation layers as segmentation masks")
+    parser.add_argument(
+        "--output-dir",
+        default=None,
+        help="Dataset directory (default: <build_dir>/masks)",
+    )
+    parser.add_argument("--format", choices=["png", "npz", "both"], default="both", help="Mask file format")
+    parser.add_argument("--config", default="config.toml", help="Configuration TOML file name")
+    args = parser.parse_args()
+
+    if not Path(QUARTO_CONFIG).exists():
+        print(f"Error: {QUARTO_CONFIG} not found. Please run from project root.")
+        sys.exit(1)
+
+    config = load_config(args.config)
+    output_dir = Path(args.output_dir or os.path.join(config.build_dir or ".", "masks"))
+    formats = ("png", "npz") if args.format == "both" else (args.format,)
+    failures = export_dataset(config, output_dir, formats)
+    for svg_path, error in failures:
+        print(f"❌ {svg_path}: {error}")
+    if failures:
+        sys.exit(1)
@@ -54,13 +54,19 @@ def update_quarto_config(crossref_path):
     with open(config_path, 'r', encoding='utf-8') as f:
         config = yaml.safe_load(f)
     
-    # Update the filters section
+    # Update the filters section, keeping the other (Lua) filters in place
+    other_filters = [
+        f for f in config.get('filters') or []
+        if os.path.basename(str(f)) != 'pandoc-crossref'
+    ]
     if crossref_path:
-        config['filters'] = [crossref_path]
+        config['filters'] = [crossref_path] + other_filters
         print(f"Setting pandoc-crossref path to: {crossref_path}")
     else:
         # If no path found, remove the filter (will use Quarto's built-in crossref)
-        if 'filters' in config:
+        if other_filters:
+            config['filters'] = other_filters
+        elif 'filters' in config:
             del config['filters']
         print("Warning: pandoc-crossref not found, using Quarto's built-in crossref")
     
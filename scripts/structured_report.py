@@ -0,0 +1,516 @@
+#!/usr/bin/env python3
+"""
+Structured MRI staging reports of primary rectal cancer, rendered in bulk
+from case records (teaching cases, audits).
+
+The template is src/Structured-Report-Primary-MRI-Staging.qmd itself: its
+title and its **key elements** in order become the sections of the report.
+Each section is bound to typed fields of StagingCase (morphology, distance
+from the anal verge, extramural spread, CRM, nodes, EMVI, T/N category, ...);
+compiling fails if the chapter and the schema drift apart, so a section added
+to the chapter must be given fields here.
+
+Records come from JSONL (one object per line) or CSV (one column per field,
+lists separated by ";", empty cells omitted) and are streamed: each one is
+validated, rendered with the template compiled once and written as
+<output-dir>/<case_id>.<md|html|docx>, so memory does not grow with the
+number of cases. Invalid records are reported with their file and line and
+every problem found, type errors as well as clinical inconsistencies
+(T3c with 2 mm of extramural spread, N0 with suspicious nodes, ...), and
+are not rendered. summary.csv lists the staging of the rendered cases.
+
+DOCX is written directly (no pandoc) with the styles of the book's
+reference document (custom-reference-doc.docx); the parts shared by all
+reports are packaged and compressed once and only word/document.xml is
+added per case.
+
+Usage:
+    python scripts/structured_report.py cases.jsonl
+    python scripts/structured_report.py cases.csv --format md docx --output-dir reports
+    python scripts/structured_report.py cases.csv --check
+    python scripts/structured_report.py --schema
+"""
+
+import csv
+import html
+import io
+import json
+import os
+import re
+import sys
+import zipfile
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Literal, NamedTuple, Optional, Tuple
+from xml.sax.saxutils import escape
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+
+from config import load_config
+from quarto_project import QUARTO_CONFIG
+
+TEMPLATE_SOURCE = "src/Structured-Report-Primary-MRI-Staging.qmd"
+REFERENCE_DOC = "custom-reference-doc.docx"
+SUMMARY_FILE = "summary.csv"
+FORMATS = ("md", "html", "docx")
+# Tumour or node at most this far from the mesorectal fascia: fascia involved (CRM+)
+MRF_MARGIN_MM = 1.0
+# Lower edge at most this far from the anal verge: low rectal cancer, sphincter complex assessed
+LOW_RECTUM_MM = 50.0
+SECTION_PATTERN = re.compile(r"^\*\*(?P<label>[^*]+?):?\*\*")
+
+
+class StagingCase(BaseModel):
+    """One case record"""
+
+    model_config = ConfigDict(extra="forbid", str_strip_whitespace=True)
+
+    case_id: str = Field(min_length=1, pattern=r"^[\w.-]+$")
+    morphology: Literal["polypoid", "semicircular", "subcircular", "circular", "mucinous", "diffuse-infiltrative"]
+    distance_anal_verge_mm: float = Field(ge=0, le=200)
+    # Negative: the lower edge is below the upper edge of m. puborectalis
+    distance_puborectalis_mm: float = Field(ge=-100, le=200)
+    peritoneal_reflection: Literal["above", "at", "below"]
+    length_mm: float = Field(gt=0, le=300)
+    extramural_spread: bool
+    extramural_depth_mm: Optional[float] = Field(None, ge=0, le=100)
+    crm_distance_mm: float = Field(ge=0)
+    suspicious_nodes: int = Field(0, ge=0)
+    tumour_deposits: int = Field(0, ge=0)
+    node_crm_distance_mm: Optional[float] = Field(None, ge=0)
+    # Derived from the distances when omitted; checked against them otherwise
+    mrf_involved: Optional[bool] = None
+    emvi: bool
+    extrafascial_nodes: List[
+        Literal["obturator", "internal-iliac", "external-iliac", "common-iliac", "inguinal", "other"]
+    ] = Field(default_factory=list)
+    sphincter_invasion: Optional[Literal["none", "internal", "intersphincteric", "external", "levator"]] = None
+    benign_findings: str = ""
+    t_category: Literal["T1", "T2", "T3a", "T3b", "T3c", "T3d", "T4a", "T4b"]
+    n_category: Literal["N0", "N1a", "N1b", "N1c", "N2a", "N2b"]
+
+
+def t3_substage(depth: float) -> str:
+    """T3 substage of an extramural depth in mm (< 1, 1–5, 5–15, > 15)"""
+    return "T3a" if depth < 1 else "T3b" if depth <= 5 else "T3c" if depth <= 15 else "T3d"
+
+
+def n_category(nodes: int, deposits: int) -> str:
+    """N category of the suspicious regional nodes and tumour deposits"""
+    if not nodes:
+        return "N1c" if deposits else "N0"
+    return "N1a" if nodes == 1 else "N1b" if nodes <= 3 else "N2a" if nodes <= 6 else "N2b"
+
+
+def mrf_distance(case: StagingCase) -> float:
+    """Minimum distance from tumour, nodes or deposits to the mesorectal fascia"""
+    if case.node_crm_distance_mm is None:
+        return case.crm_distance_mm
+    return min(case.crm_distance_mm, case.node_crm_distance_mm)
+
+
+def consistency_errors(case: StagingCase) -> List[str]:
+    """Clinical contradictions between fields of a well-typed record"""
+    errors = []
+    depth = case.extramural_depth_mm
+    if case.extramural_spread and depth is None:
+        errors.append("extramural_depth_mm: required when extramural_spread is true")
+    if not case.extramural_spread and depth:
+        errors.append("extramural_depth_mm: given although extramural_spread is false")
+
+    t = case.t_category
+    if t in ("T1", "T2") and case.extramural_spread:
+        errors.append(f"t_category: {t} contradicts extramural_spread")
+    if t.startswith("T3"):
+        if not case.extramural_spread:
+            errors.append(f"t_category: {t} requires extramural_spread")
+        elif depth is not None and t3_substage(depth) != t:
+            errors.append(f"t_category: {t} contradicts the extramural depth of {depth:g} mm ({t3_substage(depth)})")
+
+    expected = n_category(case.suspicious_nodes, case.tumour_deposits)
+    if case.n_category != expected:
+        errors.append(
+            f"n_category: {case.n_category} contradicts {case.suspicious_nodes} suspicious nodes "
+            f"and {case.tumour_deposits} deposits ({expected})"
+        )
+    if case.node_crm_distance_mm is not None and not (case.suspicious_nodes or case.tumour_deposits):
+        errors.append("node_crm_distance_mm: given without suspicious nodes or deposits")
+
+    involved = mrf_distance(case) <= MRF_MARGIN_MM
+    if case.mrf_involved is not None and case.mrf_involved != involved:
+        errors.append(
+            f"mrf_involved: {str(case.mrf_involved).lower()} contradicts the minimum distance of "
+            f"{mrf_distance(case):g} mm to the mesorectal fascia (involved at ≤ {MRF_MARGIN_MM:g} mm)"
+        )
+    if case.distance_anal_verge_mm <= LOW_RECTUM_MM and case.sphincter_invasion is None:
+        errors.append(
+            f"sphincter_invasion: required for low rectal cancer (≤ {LOW_RECTUM_MM:g} mm from the anal verge)"
+        )
+    return errors
+
+
+def validate_case(record: Dict) -> Tuple[Optional[StagingCase], List[str]]:
+    """The case of a raw record, or None and every problem found"""
+    try:
+        case = StagingCase.model_validate(record)
+    except ValidationError as error:
+        return None, [
+            f"{'.'.join(str(part) for part in problem['loc']) or 'record'}: {problem['msg']}"
+            for problem in error.errors()
+        ]
+    errors = consistency_errors(case)
+    return (None if errors else case), errors
+
+
+# Section texts, bound to the labels of the key elements in TEMPLATE_SOURCE
+
+MORPHOLOGY = {
+    "polypoid": "полиповидная",
+    "semicircular": "полуциркулярная",
+    "subcircular": "субциркулярная",
+    "circular": "циркулярная",
+    "mucinous": "муцинозная",
+    "diffuse-infiltrative": "диффузно-инфильтрирующая",
+}
+REFLECTION = {"above": "выше", "at": "на уровне", "below": "ниже"}
+SPHINCTER = {
+    "none": "инвазии нет",
+    "internal": "инвазия внутреннего сфинктера",
+    "intersphincteric": "инвазия межсфинктерного пространства",
+    "external": "инвазия наружного сфинктера",
+    "levator": "инвазия мышцы, поднимающей задний проход",
+}
+EXTRAFASCIAL = {
+    "obturator": "обтураторные",
+    "internal-iliac": "внутренние подвздошные",
+    "external-iliac": "наружные подвздошные",
+    "common-iliac": "общие подвздошные",
+    "inguinal": "паховые",
+    "other": "другой локализации",
+}
+
+
+def mm(value: float) -> str:
+    return f"{value:g} мм".replace(".", ",")
+
+
+def location_text(case: StagingCase) -> str:
+    puborectalis = case.distance_puborectalis_mm
+    level = (
+        f"на {mm(puborectalis)} выше" if puborectalis > 0
+        else "на уровне" if puborectalis == 0
+        else f"на {mm(-puborectalis)} ниже"
+    )
+    return (
+        f"нижний край опухоли в {mm(case.distance_anal_verge_mm)} от анального края, {level} "
+        f"верхнего края m. puborectalis; опухоль {REFLECTION[case.peritoneal_reflection]} "
+        f"брюшинной переходной складки"
+    )
+
+
+def nodes_text(case: StagingCase) -> str:
+    if not (case.suspicious_nodes or case.tumour_deposits):
+        return "подозрительных лимфатических узлов и депозитов нет"
+    text = f"подозрительных лимфатических узлов: {case.suspicious_nodes}, депозитов: {case.tumour_deposits}"
+    if case.node_crm_distance_mm is not None:
+        text += f"; минимальное расстояние до мезоректальной фасции {mm(case.node_crm_distance_mm)}"
+    return text
+
+
+def conclusion_text(case: StagingCase) -> str:
+    crm = "CRM+" if mrf_distance(case) <= MRF_MARGIN_MM else "CRM−"
+    return f"mr{case.t_category} {case.n_category}, EMVI{'+' if case.emvi else '−'}, {crm}"
+
+
+SECTION_TEXTS: Dict[str, Callable[[StagingCase], str]] = {
+    "Морфологические характеристики опухоли": lambda c: f"{MORPHOLOGY[c.morphology]} форма роста",
+    "Анатомическая локализация": location_text,
+    "Размеры опухоли": lambda c: f"вертикальный размер {mm(c.length_mm)}",
+    "Экстрамуральное распространение": lambda c: (
+        f"есть, глубиной {mm(c.extramural_depth_mm)}" if c.extramural_spread
+        else "нет, опухоль в пределах мышечного слоя"
+    ),
+    "Циркумферентный резекционный край": lambda c: (
+        f"минимальное расстояние от опухоли до мезоректальной фасции {mm(c.crm_distance_mm)}"
+    ),
+    "Регионарные лимфатические узлы": nodes_text,
+    "Статус мезоректальной фасции": lambda c: (
+        f"фасция вовлечена (CRM+, ≤ {mm(MRF_MARGIN_MM)})" if mrf_distance(c) <= MRF_MARGIN_MM
+        else "фасция не вовлечена (CRM−)"
+    ),
+    "Сосудистая инвазия": lambda c: "EMVI+" if c.emvi else "EMVI−",
+    "Экстрафасциальные лимфатические узлы": lambda c: (
+        "подозрительные " + ", ".join(EXTRAFASCIAL[station] for station in c.extrafascial_nodes)
+        if c.extrafascial_nodes else "нет"
+    ),
+    "Анальный сфинктерный комплекс": lambda c: (
+        SPHINCTER[c.sphincter_invasion] if c.sphincter_invasion else "не оценивается"
+    ),
+    "Сопутствующие изменения": lambda c: c.benign_findings or "не выявлены",
+}
+CONCLUSION_LABEL = "Заключение"
+
+
+def capitalized(text: str) -> str:
+    return text[:1].upper() + text[1:]
+
+
+class Section(NamedTuple):
+    label: str
+    text: Callable[[StagingCase], str]
+
+
+class ReportTemplate(NamedTuple):
+    title: str
+    sections: List[Section]
+
+
+def compile_template(source: Path = Path(TEMPLATE_SOURCE)) -> ReportTemplate:
+    """Title and key elements of the chapter, each bound to its section text"""
+    title = None
+    sections = []
+    for line in source.read_text(encoding="utf-8").splitlines():
+        if line.startswith("# ") and title is None:
+            title = line[2:].strip()
+        match = SECTION_PATTERN.match(line.strip())
+        if match:
+            label = match.group("label").strip()
+            if label not in SECTION_TEXTS:
+                raise ValueError(f"{source}: section «{label}» has no fields in the report schema")
+            sections.append(Section(label, lambda case, text=SECTION_TEXTS[label]: capitalized(text(case))))
+    missing = set(SECTION_TEXTS) - {section.label for section in sections}
+    if missing:
+        raise ValueError(f"{source}: no section for {', '.join(sorted(missing))}")
+    sections.append(Section(CONCLUSION_LABEL, conclusion_text))
+    return ReportTemplate(title or source.stem, sections)
+
+
+def markdown_report(template: ReportTemplate, case: StagingCase) -> str:
+    lines = [f"# {template.title}", "", f"**Случай:** {case.case_id}", ""]
+    for section in template.sections:
+        lines += [f"**{section.label}:** {section.text(case)}.", ""]
+    return "\n".join(lines)
+
+
+def html_report(template: ReportTemplate, case: StagingCase) -> str:
+    paragraphs = "\n".join(
+        f"<p><strong>{html.escape(section.label)}:</strong> {html.escape(section.text(case))}.</p>"
+        for section in template.sections
+    )
+    return (
+        f'<!DOCTYPE html>\n<html lang="ru">\n<head>\n<meta charset="utf-8">\n'
+        f"<title>{html.escape(case.case_id)} — {html.escape(template.title)}</title>\n</head>\n<body>\n"
+        f"<h1>{html.escape(template.title)}</h1>\n"
+        f"<p><strong>Случай:</strong> {html.escape(case.case_id)}</p>\n{paragraphs}\n</body>\n</html>\n"
+    )
+
+
+# DOCX: a minimal WordprocessingML package with the styles of the reference document
+
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+R_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+DOCX_PARTS = {
+    # part → (relationship type, content type)
+    "word/styles.xml": ("styles", "application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"),
+    "word/fontTable.xml": (
+        "fontTable", "application/vnd.openxmlformats-officedocument.wordprocessingml.fontTable+xml"
+    ),
+    "word/theme/theme1.xml": ("theme", "application/vnd.openxmlformats-officedocument.theme+xml"),
+}
+
+
+def docx_skeleton(reference_doc: Path = Path(REFERENCE_DOC)) -> bytes:
+    """Package of every part but word/document.xml, compressed once for all reports.
+
+    The style parts come from the reference document; without it Word uses its defaults.
+    """
+    parts = {}
+    if reference_doc.exists():
+        with zipfile.ZipFile(reference_doc) as package:
+            names = set(package.namelist())
+            parts = {part: package.read(part) for part in DOCX_PARTS if part in names}
+    relationships = "".join(
+        f'<Relationship Id="rId{index}" Type="{R_NS}/{DOCX_PARTS[part][0]}" Target="{part[len("word/"):]}"/>'
+        for index, part in enumerate(parts, 1)
+    )
+    overrides = "".join(f'<Override PartName="/{part}" ContentType="{DOCX_PARTS[part][1]}"/>' for part in parts)
+    package_rels = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as package:
+        package.writestr(
+            "[Content_Types].xml",
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/word/document.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+            f"{overrides}</Types>",
+        )
+        package.writestr(
+            "_rels/.rels",
+            f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<Relationships xmlns="{package_rels}">'
+            f'<Relationship Id="rId1" Type="{R_NS}/officeDocument" Target="word/document.xml"/></Relationships>',
+        )
+        package.writestr(
+            "word/_rels/document.xml.rels",
+            f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            f'<Relationships xmlns="{package_rels}">{relationships}</Relationships>',
+        )
+        for part, data in parts.items():
+            package.writestr(part, data)
+    return buffer.getvalue()
+
+
+def docx_paragraph(style: str, *runs: Tuple[str, bool]) -> str:
+    text = "".join(
+        f'<w:r>{"<w:rPr><w:b/></w:rPr>" if bold else ""}<w:t xml:space="preserve">{escape(run)}</w:t></w:r>'
+        for run, bold in runs
+    )
+    return f'<w:p><w:pPr><w:pStyle w:val="{style}"/></w:pPr>{text}</w:p>'
+
+
+def docx_report(template: ReportTemplate, case: StagingCase, skeleton: bytes) -> bytes:
+    body = [
+        docx_paragraph("Title", (template.title, False)),
+        docx_paragraph("BodyText", ("Случай: ", True), (case.case_id, False)),
+    ]
+    body += [
+        docx_paragraph("BodyText", (f"{section.label}: ", True), (f"{section.text(case)}.", False))
+        for section in template.sections
+    ]
+    buffer = io.BytesIO(skeleton)
+    # Appending leaves the compressed parts of the skeleton as they are
+    with zipfile.ZipFile(buffer, "a", zipfile.ZIP_DEFLATED) as package:
+        package.writestr(
+            "word/document.xml",
+            f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            f'<w:document xmlns:w="{W_NS}" xmlns:r="{R_NS}"><w:body>{"".join(body)}</w:body></w:document>',
+        )
+    return buffer.getvalue()
+
+
+def read_records(path: Path) -> Iterator[Tuple[str, Optional[Dict], Optional[str]]]:
+    """(file:line, raw record, parse error) of a JSONL or CSV file, streamed"""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if path.suffix.lower() == ".csv":
+            reader = csv.DictReader(f)
+            list_fields = {
+                name for name, field in StagingCase.model_fields.items()
+                if getattr(field.annotation, "__origin__", None) is list
+            }
+            for row in reader:
+                record = {}
+                for key, value in row.items():
+                    if key is None or value is None or not value.strip():
+                        continue
+                    key = key.strip()
+                    record[key] = [item.strip() for item in value.split(";") if item.strip()] \
+                        if key in list_fields else value
+                yield f"{path}:{reader.line_num}", record, None
+        else:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield f"{path}:{number}", json.loads(line), None
+                except json.JSONDecodeError as error:
+                    yield f"{path}:{number}", None, f"invalid JSON: {error.msg} (column {error.colno})"
+
+
+class RenderResult(NamedTuple):
+    rendered: int
+    invalid: List[Tuple[str, List[str]]]  # (file:line, errors)
+
+
+def render_reports(
+    inputs: List[Path],
+    output_dir: Optional[Path],
+    formats: Tuple[str, ...] = FORMATS,
+    template: Optional[ReportTemplate] = None,
+) -> RenderResult:
+    """Validate every record of the inputs and, with an output_dir, write its reports"""
+    template = template or compile_template()
+    skeleton = docx_skeleton() if "docx" in formats else b""
+    renderers = {
+        "md": lambda case: markdown_report(template, case).encode("utf-8"),
+        "html": lambda case: html_report(template, case).encode("utf-8"),
+        "docx": lambda case: docx_report(template, case, skeleton),
+    }
+    invalid = []
+    seen: Dict[str, str] = {}
+    rendered = 0
+    summary = None
+    if output_dir is not None:
+        output_dir.mkdir(parents=True, exist_ok=True)
+        summary_file = open(output_dir / SUMMARY_FILE, "w", encoding="utf-8", newline="")
+        summary = csv.writer(summary_file)
+        summary.writerow(["case_id", "t_category", "n_category", "emvi", "crm", "source"])
+    try:
+        for inp in inputs:
+            for location, record, problem in read_records(inp):
+                if problem is not None:
+                    invalid.append((location, [problem]))
+                    continue
+                case, errors = validate_case(record)
+                if case is not None and case.case_id in seen:
+                    case, errors = None, [f"case_id: {case.case_id} already used at {seen[case.case_id]}"]
+                if case is None:
+                    invalid.append((location, errors))
+                    continue
+                seen[case.case_id] = location
+                rendered += 1
+                if summary is None:
+                    continue
+                for fmt in formats:
+                    (output_dir / f"{case.case_id}.{fmt}").write_bytes(renderers[fmt](case))
+                summary.writerow([
+                    case.case_id, case.t_category, case.n_category,
+                    "+" if case.emvi else "-", "+" if mrf_distance(case) <= MRF_MARGIN_MM else "-", location,
+                ])
+    finally:
+        if summary is not None:
+            summary_file.close()
+    return RenderResult(rendered, invalid)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Render structured MRI staging reports from case records")
+    parser.add_argument("inputs", nargs="*", type=Path, help="Case records (.jsonl or .csv)")
+    parser.add_argument("--format", nargs="+", choices=FORMATS, default=list(FORMATS), help="Report formats")
+    parser.add_argument(
+        "--output-dir",
+        default=None,
+        help="Report directory (default: <build_dir>/reports)",
+    )
+    parser.add_argument("--check", action="store_true", help="Only validate the records")
+    parser.add_argument("--schema", action="store_true", help="Print the JSON schema of a case record")
+    args = parser.parse_args()
+
+    if args.schema:
+        print(json.dumps(StagingCase.model_json_schema(), ensure_ascii=False, indent=2))
+        sys.exit(0)
+    if not args.inputs:
+        parser.error("no case records given")
+    if not Path(QUARTO_CONFIG).exists():
+        print(f"Error: {QUARTO_CONFIG} not found. Please run from project root.")
+        sys.exit(1)
+    for inp in args.inputs:
+        if not inp.is_file():
+            print(f"Error: {inp} not found")
+            sys.exit(1)
+
+    output_dir = None
+    if not args.check:
+        output_dir = Path(args.output_dir or os.path.join(load_config().build_dir or ".", "reports"))
+    result = render_reports(args.inputs, output_dir, tuple(dict.fromkeys(args.format)))
+    for location, errors in result.invalid:
+        print(f"❌ {location}")
+        for error in errors:
+            print(f"   {error}")
+    action = "valid" if args.check else f"rendered to {output_dir} ({', '.join(args.format)})"
+    print(f"{'⚠️' if result.invalid else '✓'} {result.rendered} cases {action}, {len(result.invalid)} invalid")
+    if result.invalid:
+        sys.exit(1)
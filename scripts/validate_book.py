@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Fast cross-reference and figure validator for the book.
+
+Scans every chapter listed in _quarto.yml in one parallel pass and reports,
+with file:line:
+- labels ({#fig-...}, {#tbl-...}, {#sec-...}, {#eq-...}) defined more than once
+- @fig-/@tbl-/@sec-/@eq- references to labels that are not defined
+- images that exist neither in the project nor among the outputs the image
+  pipeline will generate from the annotation SVGs of their directory
+
+Fenced code blocks are skipped. Runs in well under a second, so the
+pre-render calls it before any image work and fails early.
+
+Usage:
+    python scripts/validate_book.py
+"""
+
+import multiprocessing
+import os
+import re
+import sys
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from build_manifest import (
+    CROSSREF_PATTERN,
+    IMAGE_REF_PATTERN,
+    LABEL_DEF_PATTERN,
+    resolve_image_path,
+)
+from config import load_config, Settings
+from discovery import AnnotationMatcher
+from quarto_project import QUARTO_CONFIG, get_chapters
+
+CELL_LABEL_PATTERN = re.compile(r"^#\|\s*label:\s*((?:fig|tbl|sec|eq)-[\w-]+)")
+FENCE_PATTERN = re.compile(r"^\s*(```|~~~)")
+
+
+class Problem(NamedTuple):
+    path: str
+    line: int
+    message: str
+
+    def __str__(self):
+        return f"{self.path}:{self.line}: {self.message}"
+
+
+def scan_chapter(chapter: str) -> Dict[str, List[Tuple[str, int]]]:
+    """Return label definitions, references and image refs of a chapter with line numbers"""
+    result = {"labels": [], "refs": [], "images": []}
+    path = Path(chapter)
+    if not path.is_file():
+        return result
+
+    in_fence = None
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            fence = FENCE_PATTERN.match(line)
+            if fence:
+                marker = fence.group(1)
+                if in_fence is None:
+                    in_fence = marker
+                    # Executable cells declare labels in #| options
+                    continue
+                if marker == in_fence:
+                    in_fence = None
+                    continue
+            if in_fence is not None:
+                cell_label = CELL_LABEL_PATTERN.match(line)
+                if cell_label:
+                    result["labels"].append((cell_label.group(1), line_number))
+                continue
+
+            result["labels"] += [(label, line_number) for label in LABEL_DEF_PATTERN.findall(line)]
+            result["refs"] += [(label, line_number) for label in CROSSREF_PATTERN.findall(line)]
+            for match in IMAGE_REF_PATTERN.finditer(line):
+                ref = (match.group(1) or match.group(2)).split("#")[0].split("?")[0]
+                if ref and "://" not in ref and not ref.startswith("data:"):
+                    result["images"].append((ref, line_number))
+    return result
+
+
+def expected_outputs(directory: Path, config: Settings) -> Set[str]:
+    """File names the image pipeline generates from the annotations in directory"""
+    # Imported here: only needed when a referenced image does not exist yet
+    from prepare_images import element_export_names, svg_image_names
+
+    image_folder = Path(config.processing.default_folder).resolve()
+    matcher = AnnotationMatcher.from_config(config)
+    names = set()
+    if not directory.is_dir():
+        return names
+    for source in sorted(directory.iterdir()):
+        try:
+            relative_path = source.resolve().relative_to(image_folder).as_posix()
+        except ValueError:
+            relative_path = source.name
+        if not matcher.match(relative_path)[0]:
+            continue
+        names.add(f"{source.stem}_{config.processing.styled_postfix}.svg")
+        for _, image_name in svg_image_names(str(source), config.get_nsmap(), warn=False):
+            names.update(
+                filename for filename, _ in element_export_names(
+                    image_name,
+                    config.inkscape.default_export_format,
+                    config.export.export_id_only,
+                    config.export.export_with_context,
+                    annotated_suffix=config.processing.annotated_suffix,
+                )
+            )
+    return names
+
+
+def validate(chapters: List[str], config: Optional[Settings] = None, processes: int = 0) -> List[Problem]:
+    """Validate the given chapters, return the problems found"""
+    config = config or load_config()
+    processes = processes or min(len(chapters), multiprocessing.cpu_count(), 8)
+    if processes > 1:
+        with multiprocessing.Pool(processes=processes) as pool:
+            scans = pool.map(scan_chapter, chapters)
+    else:
+        scans = [scan_chapter(chapter) for chapter in chapters]
+
+    problems = []
+    definitions: Dict[str, List[Tuple[str, int]]] = defaultdict(list)
+    for chapter, scan in zip(chapters, scans):
+        if not Path(chapter).is_file():
+            problems.append(Problem(chapter, 0, f"chapter listed in {QUARTO_CONFIG} does not exist"))
+        for label, line in scan["labels"]:
+            definitions[label].append((chapter, line))
+
+    for label, places in definitions.items():
+        first_chapter, first_line = places[0]
+        for chapter, line in places[1:]:
+            problems.append(Problem(
+                chapter, line, f"duplicate label {{#{label}}} (first defined at {first_chapter}:{first_line})"
+            ))
+
+    outputs_by_dir: Dict[Path, Set[str]] = {}
+    for chapter, scan in zip(chapters, scans):
+        for label, line in scan["refs"]:
+            if label not in definitions:
+                problems.append(Problem(chapter, line, f"reference to undefined label @{label}"))
+
+        for ref, line in scan["images"]:
+            image = resolve_image_path(ref, chapter)
+            if image.exists():
+                continue
+            if image.parent not in outputs_by_dir:
+                outputs_by_dir[image.parent] = expected_outputs(image.parent, config)
+            if image.name not in outputs_by_dir[image.parent]:
+                problems.append(Problem(
+                    chapter, line, f"image {ref} does not exist and is not generated from an annotation"
+                ))
+
+    return sorted(problems)
+
+
+def run_validation(config: Optional[Settings] = None) -> bool:
+    """Validate all chapters and print the problems, return True if there are none"""
+    chapters = get_chapters()
+    problems = validate(chapters, config)
+    for problem in problems:
+        print(f"❌ {problem}")
+    if problems:
+        print(f"\n❌ {len(problems)} problem(s) in {len(chapters)} chapters")
+        return False
+    print(f"✓ Cross-references and figures valid in {len(chapters)} chapters")
+    return True
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Validate cross-references and figures")
+    parser.add_argument("--config", default="config.toml", help="Configuration TOML file name")
+    args = parser.parse_args()
+
+    if not Path(QUARTO_CONFIG).exists():
+        print(f"Error: {QUARTO_CONFIG} not found. Please run from project root.")
+        sys.exit(1)
+
+    if not run_validation(load_config(args.config)):
+        sys.exit(1)
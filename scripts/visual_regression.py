@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Visual regression check of the raster exports of the image pipeline.
+
+A change to styles/annotation.css, the layer list or the Inkscape version
+can alter every exported figure. `update` stores a golden thumbnail of each
+raster output recorded in <cache_dir>/image-outputs.json (see
+output_manifest.py) under build/visual-golden/, together with the size and
+content hash of the full export. `check` compares the current exports with
+them:
+
+- outputs whose content hash is unchanged are skipped without decoding
+- the others are downsampled to the golden thumbnail size in a process pool
+  and compared per pixel with NumPy: max and mean delta, and the share of
+  pixels changed by more than --tolerance levels
+- a figure regresses when that share exceeds --max-changed, its pixel size
+  changed, or it is missing; new outputs are listed
+
+The differences are written to an HTML contact sheet (golden, current and a
+heat map of changed pixels side by side) in <cache_dir>/visual-diff/.
+
+Usage:
+    python scripts/visual_regression.py update   # accept the current exports
+    python scripts/visual_regression.py check    # exit 1 on regressions
+"""
+
+import html
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from config import load_config, Settings
+from image_cache import hash_file
+from output_manifest import load_outputs, output_manifest_path
+from quarto_project import QUARTO_CONFIG
+
+GOLDEN_DIR = "build/visual-golden"
+GOLDEN_INDEX = "index.json"
+GOLDEN_VERSION = 1
+DIFF_DIR = "visual-diff"
+THUMBNAIL_SIZE = 256
+RASTER_SUFFIXES = {".png", ".jpg", ".jpeg", ".webp"}
+DEFAULT_TOLERANCE = 16
+DEFAULT_MAX_CHANGED = 0.001
+
+
+class Comparison(NamedTuple):
+    output: str
+    status: str  # "unchanged", "changed", "regressed", "resized", "missing", "new"
+    max_delta: int = 0
+    mean_delta: float = 0.0
+    changed_ratio: float = 0.0
+
+
+def golden_thumbnail_path(golden_dir: Path, output: str) -> Path:
+    return golden_dir / f"{output}.png"
+
+
+def raster_outputs(config: Settings) -> List[str]:
+    """Raster exports recorded by prepare_images.py that exist on disk"""
+    outputs = {
+        output
+        for source_outputs in load_outputs(output_manifest_path(config)).values()
+        for output in source_outputs
+        if Path(output).suffix.lower() in RASTER_SUFFIXES
+    }
+    return sorted(output for output in outputs if os.path.isfile(output))
+
+
+def thumbnail(path, size: Optional[Tuple[int, int]] = None) -> Image.Image:
+    """RGB thumbnail, composited on white, of at most THUMBNAIL_SIZE px (or exactly size)"""
+    with Image.open(path) as image:
+        image.draft("RGB", size or (THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        image = image.convert("RGBA")
+    flat = Image.new("RGBA", image.size, (255, 255, 255, 255))
+    flat.alpha_composite(image)
+    flat = flat.convert("RGB")
+    if size:
+        return flat.resize(size, Image.Resampling.BOX)
+    flat.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.Resampling.BOX)
+    return flat
+
+
+def pixel_delta(golden: np.ndarray, current: np.ndarray) -> np.ndarray:
+    """Largest per-channel difference of each pixel, 0-255"""
+    return np.abs(golden.astype(np.int16) - current.astype(np.int16)).max(axis=2)
+
+
+def compare_job(args) -> Tuple[Comparison, Optional[np.ndarray]]:
+    """Pool worker: compare one export with its golden thumbnail"""
+    output, golden_path, tolerance, max_changed = args
+    golden = np.asarray(Image.open(golden_path).convert("RGB"))
+    current = np.asarray(thumbnail(output, (golden.shape[1], golden.shape[0])))
+    delta = pixel_delta(golden, current)
+    changed_ratio = float((delta > tolerance).mean())
+    status = "regressed" if changed_ratio > max_changed else "changed"
+    comparison = Comparison(output, status, int(delta.max()), float(delta.mean()), changed_ratio)
+    return comparison, delta if changed_ratio > 0 else None
+
+
+class GoldenSet:
+    """Golden thumbnails and the size and hash of the export each was made from"""
+
+    def __init__(self, golden_dir):
+        self.golden_dir = Path(golden_dir)
+        self.entries: Dict[str, Dict] = {}
+        try:
+            with open(self.golden_dir / GOLDEN_INDEX, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return
+        if data.get("version") == GOLDEN_VERSION:
+            self.entries = data.get("outputs", {})
+
+    def save(self):
+        self.golden_dir.mkdir(parents=True, exist_ok=True)
+        path = self.golden_dir / GOLDEN_INDEX
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"version": GOLDEN_VERSION, "outputs": dict(sorted(self.entries.items()))},
+                f, ensure_ascii=False, indent=1,
+            )
+        os.replace(tmp_path, path)
+
+    def update(self, outputs: List[str]) -> int:
+        """Store thumbnails of outputs that changed, drop the others; return the number written"""
+        written = 0
+        for output in outputs:
+            sha256 = hash_file(output)
+            entry = self.entries.get(output)
+            target = golden_thumbnail_path(self.golden_dir, output)
+            if entry and entry["sha256"] == sha256 and target.exists():
+                continue
+            with Image.open(output) as image:
+                size = list(image.size)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            thumbnail(output).save(target, optimize=True)
+            self.entries[output] = {"sha256": sha256, "size": size}
+            written += 1
+        for output in set(self.entries) - set(outputs):
+            golden_thumbnail_path(self.golden_dir, output).unlink(missing_ok=True)
+            del self.entries[output]
+        self.save()
+        return written
+
+
+def compare(
+    golden: GoldenSet,
+    outputs: List[str],
+    tolerance: int = DEFAULT_TOLERANCE,
+    max_changed: float = DEFAULT_MAX_CHANGED,
+    processes: int = 0,
+) -> Tuple[List[Comparison], Dict[str, np.ndarray]]:
+    """Compare outputs with the golden set; returns comparisons and delta maps of changed figures"""
+    comparisons = []
+    jobs = []
+    for output in outputs:
+        entry = golden.entries.get(output)
+        if entry is None:
+            comparisons.append(Comparison(output, "new"))
+            continue
+        if hash_file(output) == entry["sha256"]:
+            comparisons.append(Comparison(output, "unchanged"))
+            continue
+        with Image.open(output) as image:
+            if list(image.size) != entry["size"]:
+                comparisons.append(Comparison(output, "resized"))
+                continue
+        jobs.append((output, str(golden_thumbnail_path(golden.golden_dir, output)), tolerance, max_changed))
+    comparisons += [Comparison(output, "missing") for output in sorted(set(golden.entries) - set(outputs))]
+
+    processes = processes or min(len(jobs), multiprocessing.cpu_count(), 8)
+    if processes > 1:
+        with multiprocessing.Pool(processes=processes) as pool:
+            results = pool.map(compare_job, jobs, chunksize=4)
+    else:
+        results = [compare_job(job) for job in jobs]
+    deltas = {}
+    for comparison, delta in results:
+        comparisons.append(comparison)
+        if delta is not None:
+            deltas[comparison.output] = delta
+    return comparisons, deltas
+
+
+def heat_map(golden_path: Path, delta: np.ndarray, tolerance: int) -> Image.Image:
+    """Dimmed golden thumbnail with changed pixels in red (brighter = larger change)"""
+    base = np.asarray(Image.open(golden_path).convert("L"), dtype=np.float32) * 0.4 + 153
+    rgb = np.repeat(base[:, :, None], 3, axis=2)
+    changed = delta > tolerance
+    rgb[changed] = np.stack(
+        [np.full(changed.sum(), 255.0), 200.0 - 0.78 * delta[changed], 200.0 - 0.78 * delta[changed]], axis=1
+    )
+    return Image.fromarray(rgb.clip(0, 255).astype(np.uint8))
+
+
+def write_contact_sheet(
+    report_dir: Path, golden: GoldenSet, comparisons: List[Comparison], deltas: Dict[str, np.ndarray], tolerance: int
+) -> Path:
+    """HTML page with golden, current and heat map of each difference"""
+    if report_dir.exists():
+        shutil.rmtree(report_dir)
+    report_dir.mkdir(parents=True)
+    order = {"missing": 0, "resized": 1, "regressed": 2, "changed": 3, "new": 4}
+    rows = []
+    for index, comparison in enumerate(sorted(
+        (c for c in comparisons if c.status != "unchanged"),
+        key=lambda c: (order[c.status], -c.changed_ratio, c.output),
+    )):
+        cells = []
+        golden_path = golden_thumbnail_path(golden.golden_dir, comparison.output)
+        if golden_path.exists():
+            shutil.copyfile(golden_path, report_dir / f"{index}-golden.png")
+            cells.append(f'<img src="{index}-golden.png">')
+        else:
+            cells.append("")
+        if os.path.isfile(comparison.output):
+            thumbnail(comparison.output).save(report_dir / f"{index}-current.png")
+            cells.append(f'<img src="{index}-current.png">')
+        else:
+            cells.append("")
+        if comparison.output in deltas:
+            heat_map(golden_path, deltas[comparison.output], tolerance).save(report_dir / f"{index}-diff.png")
+            cells.append(f'<img src="{index}-diff.png">')
+        else:
+            cells.append("")
+        metrics = (
+            f"max Δ {comparison.max_delta}, mean Δ {comparison.mean_delta:.2f}, "
+            f"changed {comparison.changed_ratio:.3%}"
+            if comparison.status in ("changed", "regressed") else ""
+        )
+        rows.append(
+            f'<tr class="{comparison.status}"><td><b>{comparison.status}</b><br>'
+            f"<code>{html.escape(comparison.output)}</code><br>{metrics}</td>"
+            + "".join(f"<td>{cell}</td>" for cell in cells) + "</tr>"
+        )
+    page = report_dir / "index.html"
+    page.write_text(
+        "<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>Visual regression</title>\n<style>"
+        "body{font-family:sans-serif}td{vertical-align:top;padding:4px}img{max-width:256px;border:1px solid #ccc}"
+        ".regressed td:first-child,.missing td:first-child,.resized td:first-child{color:#b00}"
+        "</style></head><body>\n"
+        f"<h1>Visual regression: {len(rows)} differences</h1>\n"
+        "<table><tr><th>Export</th><th>Golden</th><th>Current</th><th>Changed pixels</th></tr>\n"
+        + "\n".join(rows) + "\n</table></body></html>\n",
+        encoding="utf-8",
+    )
+    return page
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare exported figures with golden thumbnails")
+    parser.add_argument("command", choices=["check", "update"])
+    parser.add_argument("--golden-dir", default=GOLDEN_DIR, help=f"Golden thumbnails (default: {GOLDEN_DIR})")
+    parser.add_argument(
+        "--tolerance",
+        type=int,
+        default=DEFAULT_TOLERANCE,
+        help=f"Per-channel difference (0-255) below which a pixel counts as unchanged (default: {DEFAULT_TOLERANCE})",
+    )
+    parser.add_argument(
+        "--max-changed",
+        type=float,
+        default=DEFAULT_MAX_CHANGED,
+        help=f"Share of changed pixels above which a figure regresses (default: {DEFAULT_MAX_CHANGED})",
+    )
+    parser.add_argument("--config", default="config.toml", help="Configuration TOML file name")
+    args = parser.parse_args()
+
+    if not Path(QUARTO_CONFIG).exists():
+        print(f"Error: {QUARTO_CONFIG} not found. Please run from project root.")
+        sys.exit(1)
+
+    config = load_config(args.config)
+    outputs = raster_outputs(config)
+    if not outputs:
+        print(f"No raster exports recorded in {output_manifest_path(config)}; run prepare_images.py first")
+        sys.exit(1)
+    golden = GoldenSet(args.golden_dir)
+
+    if args.command == "update":
+        written = golden.update(outputs)
+        print(f"✓ {len(outputs)} golden thumbnails in {args.golden_dir} ({written} updated)")
+        sys.exit(0)
+
+    if not golden.entries:
+        print(f"No golden thumbnails in {args.golden_dir}; create them with `update`")
+        sys.exit(1)
+    comparisons, deltas = compare(golden, outputs, args.tolerance, args.max_changed)
+    counts: Dict[str, int] = {}
+    for comparison in comparisons:
+        counts[comparison.status] = counts.get(comparison.status, 0) + 1
+        if comparison.status in ("regressed", "resized", "missing"):
+            print(f"❌ {comparison.output}: {comparison.status}"
+                  + (f" ({comparison.changed_ratio:.2%} of pixels changed)" if comparison.status == "regressed" else ""))
+    summary = ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+    failed = any(counts.get(status) for status in ("regressed", "resized", "missing"))
+    if len(comparisons) > counts.get("unchanged", 0):
+        page = write_contact_sheet(Path(config.cache.cache_dir) / DIFF_DIR, golden, comparisons, deltas, args.tolerance)
+        print(f"Contact sheet: {page}")
+    print(f"{'❌' if failed else '✓'} {len(comparisons)} exports: {summary}")
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,98 @@
+"""Shared fixtures: a throwaway project with one annotation and a fake Inkscape"""
+
+import stat
+import sys
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+from config import Settings
+
+FAKE_INKSCAPE = '''#!{python}
+"""Writes a small PNG for every export and logs it, like inkscape --actions"""
+import os
+import sys
+
+from PIL import Image
+
+LOG = {log!r}
+
+
+def export(path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    Image.new("RGBA", (4, 4), (200, 0, 0, 255)).save(path)
+    with open(LOG, "a", encoding="utf-8") as f:
+        f.write(path + "\\n")
+
+
+for arg in sys.argv[1:]:
+    if arg == "--version":
+        print("Inkscape 1.3 (fake)")
+    elif arg.startswith("--actions="):
+        target = None
+        for action in arg[len("--actions="):].split(";"):
+            if action.startswith("export-filename:"):
+                target = action.split(":", 1)[1]
+            elif action == "export-do":
+                export(target)
+    elif arg.startswith("--export-filename="):
+        export(arg.split("=", 1)[1])
+'''
+
+ANNOTATION_SVG = """<?xml version="1.0" encoding="UTF-8"?>
+<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink"
+     xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape" width="40" height="40">
+  <image id="image1" xlink:href="image1.png" x="0" y="0" width="40" height="40"/>
+  <g inkscape:label="tumor"><path d="M 5 5 L 20 5 L 20 20 Z"/></g>
+</svg>
+"""
+
+
+class FakeInkscape:
+    def __init__(self, directory: Path):
+        self.path = directory / "inkscape"
+        self.log = directory / "inkscape.log"
+        self.path.write_text(FAKE_INKSCAPE.format(python=sys.executable, log=str(self.log)), encoding="utf-8")
+        self.path.chmod(self.path.stat().st_mode | stat.S_IXUSR)
+
+    def exports(self):
+        """Paths exported so far"""
+        if not self.log.exists():
+            return []
+        return self.log.read_text(encoding="utf-8").splitlines()
+
+
+@pytest.fixture
+def fake_inkscape(tmp_path):
+    directory = tmp_path / "bin"
+    directory.mkdir()
+    return FakeInkscape(directory)
+
+
+def write_annotation(directory: Path, svg: str = ANNOTATION_SVG) -> Path:
+    """An annotation SVG linking image1.png, created next to it"""
+    directory.mkdir(parents=True, exist_ok=True)
+    Image.new("RGB", (40, 40), (90, 90, 90)).save(directory / "image1.png")
+    svg_path = directory / "annotation.svg"
+    svg_path.write_text(svg, encoding="utf-8")
+    return svg_path
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    """Project root (the working directory) holding img/a/annotation.svg"""
+    root = tmp_path / "project"
+    write_annotation(root / "img" / "a")
+    monkeypatch.chdir(root)
+    return root
+
+
+@pytest.fixture
+def settings(fake_inkscape):
+    """Exports next to the sources at one resolution, through the fake Inkscape"""
+    return Settings(
+        inkscape={"executable": str(fake_inkscape.path), "timeout": 30, "retries": 0},
+        export={"profiles": []},
+        build_dir="",
+    )
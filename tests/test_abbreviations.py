@@ -0,0 +1,95 @@
+"""Abbreviations: whole-word matching, glossary parsing and first uses"""
+
+import pytest
+
+from abbreviations import (
+    AhoCorasick,
+    Use,
+    check_abbreviations,
+    filter_data,
+    filter_enabled,
+    find_terms,
+    parse_glossary,
+)
+
+GLOSSARY = """# Сокращения
+
+МРТ — магнитно-резонансная томография
+ВР-МРТ — МРТ высокого разрешения
+КТ, СКТ — компьютерная томография
+"""
+
+INTRODUCTION = """---
+title: Введение
+---
+
+Для оценки используют МРТ и ВР-МРТ.
+
+```
+КТ в блоке кода не считается
+```
+
+Перед КТ [@smith2020] выполняют УЗИ, стадия II.
+"""
+
+METHODS = """# Методы
+
+СКТ и МРТ выполнены всем пациентам.
+"""
+
+
+@pytest.fixture
+def chapters(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "src").mkdir()
+    for name, text in (("Abbrevations.qmd", GLOSSARY), ("Introduction.qmd", INTRODUCTION), ("Methods.qmd", METHODS)):
+        (tmp_path / "src" / name).write_text(text, encoding="utf-8")
+    return ["src/Introduction.qmd", "src/Methods.qmd", "src/Abbrevations.qmd"]
+
+
+def test_matcher_reports_overlapping_occurrences():
+    automaton = AhoCorasick(["МРТ", "ВР-МРТ", "ТТ"])
+    assert sorted(automaton.iter_matches("ВР-МРТТ")) == [(0, "ВР-МРТ"), (3, "МРТ"), (5, "ТТ")]
+
+
+def test_find_terms_is_leftmost_longest_on_word_boundaries():
+    automaton = AhoCorasick(["МРТ", "ВР-МРТ", "КТ"])
+    assert find_terms(automaton, "ВР-МРТ, МРТ и КТ") == [(0, "ВР-МРТ"), (8, "МРТ"), (14, "КТ")]
+    # Inside a word is not a use
+    assert find_terms(automaton, "СКТ МРТ_1 КТ2") == []
+
+
+def test_parse_glossary(chapters):
+    glossary = parse_glossary("src/Abbrevations.qmd")
+    assert [(a.term, a.line) for a in glossary] == [("МРТ", 3), ("ВР-МРТ", 4), ("КТ", 5), ("СКТ", 5)]
+    assert glossary[2].expansion == glossary[3].expansion == "компьютерная томография"
+
+
+def test_first_uses_skip_code_and_glossary(chapters):
+    glossary = parse_glossary("src/Abbrevations.qmd")
+    first_uses, counts, undefined = check_abbreviations(chapters, glossary, "src/Abbrevations.qmd")
+    assert first_uses == {
+        "МРТ": Use("МРТ", "src/Introduction.qmd", 5, 23),
+        "ВР-МРТ": Use("ВР-МРТ", "src/Introduction.qmd", 5, 29),
+        "КТ": Use("КТ", "src/Introduction.qmd", 11, 7),
+        "СКТ": Use("СКТ", "src/Methods.qmd", 3, 1),
+    }
+    assert counts == {"МРТ": 2, "ВР-МРТ": 1, "КТ": 1, "СКТ": 1}
+    # Roman numerals and citation keys are not abbreviations
+    assert sorted(undefined) == ["УЗИ"]
+
+
+def test_filter_data_lists_used_terms_only(chapters):
+    glossary = parse_glossary("src/Abbrevations.qmd")
+    first_uses, _, _ = check_abbreviations(chapters[1:], glossary, "src/Abbrevations.qmd")
+    data = filter_data(glossary, first_uses)
+    assert data["terms"] == {
+        "МРТ": {"expansion": "магнитно-резонансная томография", "chapter": "src/Methods.qmd"},
+        "СКТ": {"expansion": "компьютерная томография", "chapter": "src/Methods.qmd"},
+    }
+
+
+def test_filter_enabled():
+    assert filter_enabled({"filters": ["build/abbreviations.lua"]})
+    assert not filter_enabled({"filters": ["build/other.lua"]})
+    assert not filter_enabled({})
@@ -0,0 +1,105 @@
+"""Corrections: locating targets, rejecting unsafe edits and idempotent re-runs"""
+
+from pathlib import Path
+
+import pytest
+
+from apply_corrections import Correction, apply_corrections, parse_report, plan_edits
+
+CHAPTER = """# Введение
+
+Опухоль выявляется у пациентов высокого риска.
+Их обследуют по протоколу.
+Повышением заболевания объясняется рост числа случаев.
+"""
+
+REPORT = """# Отчёт о правках
+
+## src/Introduction.qmd
+
+- Строка 3: "высокого риска" → "высокого риска развития"
+- "Повышением заболевания" → "Повышением риска заболевания"
+✅ Строка 4: "Их обследуют" → "Их обследуют ежегодно"
+"""
+
+
+@pytest.fixture
+def chapter(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / "src" / "Introduction.qmd"
+    path.parent.mkdir()
+    path.write_text(CHAPTER, encoding="utf-8")
+    return path
+
+
+def test_parse_report_reads_hints_and_done_marks(tmp_path):
+    report = tmp_path / "report.md"
+    report.write_text(REPORT, encoding="utf-8")
+    corrections = parse_report(report)
+    assert [(c.file, c.line, c.done) for c in corrections] == [
+        ("src/Introduction.qmd", 3, False),
+        ("src/Introduction.qmd", None, False),
+        ("src/Introduction.qmd", 4, True),
+    ]
+
+
+def test_applying_the_same_report_twice_leaves_the_file_unchanged(chapter, tmp_path):
+    report = tmp_path / "report.md"
+    report.write_text(REPORT, encoding="utf-8")
+
+    applied, rejected, already_applied = apply_corrections(parse_report(report), diff=False)
+    assert (applied, rejected, len(already_applied)) == (2, [], 1)
+    fixed = chapter.read_text(encoding="utf-8")
+    assert "высокого риска развития." in fixed
+    assert "Повышением риска заболевания" in fixed
+
+    applied, rejected, already_applied = apply_corrections(parse_report(report), diff=False)
+    assert (applied, rejected, len(already_applied)) == (0, [], 3)
+    assert chapter.read_text(encoding="utf-8") == fixed
+
+
+def test_target_inside_its_replacement_counts_as_applied():
+    text = "у пациентов высокого риска развития и высокого риска."
+    correction = Correction("a.qmd", "высокого риска", "высокого риска развития", line=1)
+    spans, rejected, applied = plan_edits(text, [correction])
+    # Only the occurrence outside the replacement is edited
+    start = text.rindex("высокого риска")
+    assert [(s, e) for s, e, _ in spans] == [(start, start + len("высокого риска"))]
+    assert rejected == [] and applied == []
+
+    spans, rejected, applied = plan_edits("у пациентов высокого риска развития.", [correction])
+    assert spans == [] and rejected == [] and applied == [correction]
+
+
+def test_short_target_needs_a_line_hint():
+    text = "Их обследуют.\nВсе их данные.\n"
+    spans, rejected, _ = plan_edits(text, [Correction("a.qmd", "Их", "Пациентов")])
+    assert spans == [] and "too short" in rejected[0].reason
+
+    spans, rejected, _ = plan_edits(text, [Correction("a.qmd", "Их", "Пациентов", line=1)])
+    assert [(start, end) for start, end, _ in spans] == [(0, 2)] and rejected == []
+
+
+def test_whole_words_only():
+    spans, rejected, _ = plan_edits("них и их", [Correction("a.qmd", "их", "его", line=1)])
+    assert [(start, end) for start, end, _ in spans] == [(6, 8)]
+
+
+def test_ambiguous_and_overlapping_edits_are_rejected():
+    text = "первая стадия опухоли; вторая стадия опухоли"
+    spans, rejected, _ = plan_edits(text, [Correction("a.qmd", "стадия опухоли", "стадия")])
+    assert spans == [] and rejected[0].reason.startswith("ambiguous: 2 occurrences")
+
+    spans, rejected, _ = plan_edits(text, [
+        Correction("a.qmd", "первая стадия", "I стадия"),
+        Correction("a.qmd", "стадия опухоли;", "стадия;"),
+    ])
+    assert spans == [] and all("conflicts" in item.reason for item in rejected)
+
+
+def test_missing_target_is_rejected(chapter):
+    applied, rejected, _ = apply_corrections(
+        [Correction("Introduction.qmd", "несуществующий фрагмент", "текст")], diff=False
+    )
+    assert applied == 0 and rejected[0].reason == "target not found (text changed)"
+    assert Path(chapter).read_text(encoding="utf-8") == CHAPTER
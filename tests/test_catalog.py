@@ -0,0 +1,62 @@
+"""Catalog: stale outputs are decided by input hashes, not mtimes"""
+
+import os
+from pathlib import Path
+
+from PIL import Image
+
+from catalog import open_catalog
+from image_cache import ImageCache
+from output_manifest import load_inputs, output_manifest_path, record_outputs
+from prepare_images import process_annotation_file
+
+STYLES = {"tumor": {"fill": "#ff0000", "stroke": "none"}}
+
+
+def export(settings, cache):
+    outputs = process_annotation_file("img/a/annotation.svg", settings, STYLES, cache=cache)
+    record_outputs(output_manifest_path(settings), [("img/a/annotation.svg", outputs)], settings.get_nsmap())
+    return outputs
+
+
+def stale(settings):
+    with open_catalog(settings) as catalog:
+        return catalog.stale_outputs()
+
+
+def test_inputs_are_recorded_with_the_outputs(project, settings, tmp_path):
+    export(settings, ImageCache(tmp_path / "cache"))
+    inputs = load_inputs(output_manifest_path(settings))
+    assert sorted(inputs["img/a/annotation.svg"]) == ["img/a/annotation.svg", "img/a/image1.png"]
+
+
+def test_restored_outputs_with_old_mtimes_are_not_stale(project, settings, tmp_path):
+    cache = ImageCache(tmp_path / "cache")
+    outputs = export(settings, cache)
+    assert stale(settings) == []
+
+    # A CI checkout: sources get fresh mtimes, restored outputs keep the cached ones
+    for path in outputs:
+        os.remove(path)
+    old = os.stat("img/a/annotation.svg").st_mtime - 3600
+    for entry_file in cache.entry_dir(cache.compute_key("img/a/annotation.svg", settings, STYLES)).iterdir():
+        os.utime(entry_file, (old, old))
+    Path("img/a/annotation.svg").touch()
+    Path("img/a/image1.png").touch()
+    export(settings, cache)
+    assert all(os.stat(path).st_mtime < os.stat("img/a/annotation.svg").st_mtime for path in outputs)
+    assert stale(settings) == []
+
+
+def test_changed_linked_image_makes_outputs_stale(project, settings, tmp_path):
+    outputs = export(settings, ImageCache(tmp_path / "cache"))
+    Image.new("RGB", (40, 40), (10, 10, 10)).save("img/a/image1.png")
+    reasons = {output: reason for _, output, reason in stale(settings)}
+    assert sorted(reasons) == sorted(os.path.relpath(path) for path in outputs)
+    assert all("img/a/image1.png" in reason for reason in reasons.values())
+
+
+def test_missing_output_is_stale(project, settings, tmp_path):
+    outputs = export(settings, ImageCache(tmp_path / "cache"))
+    os.remove(outputs[0])
+    assert stale(settings) == [("img/a/annotation.svg", os.path.relpath(outputs[0]), "output missing")]
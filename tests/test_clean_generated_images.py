@@ -0,0 +1,30 @@
+"""Cleaning: recorded outputs are removed, skipped ones stay recorded"""
+
+from pathlib import Path
+
+from clean_generated_images import clean_generated_files
+from config import load_config
+from output_manifest import load_inputs, load_outputs, output_manifest_path, record_outputs
+
+
+def test_clean_keeps_records_of_files_it_did_not_remove(project):
+    config = load_config()
+    manifest_path = output_manifest_path(config)
+    Path("img/a/image1_annotated.png").write_bytes(b"png")
+    # A source raster recorded as an output (id-only export named like its source)
+    record_outputs(
+        manifest_path,
+        [("img/a/annotation.svg", ["img/a/image1_annotated.png", "img/a/image1.png"])],
+        config.get_nsmap(),
+    )
+
+    clean_generated_files()
+    assert not Path("img/a/image1_annotated.png").exists()
+    assert Path("img/a/image1.png").exists()
+    assert load_outputs(manifest_path) == {"img/a/annotation.svg": ["img/a/image1.png"]}
+    assert list(load_inputs(manifest_path)) == ["img/a/annotation.svg"]
+
+    # A second run finds the kept record and still does not remove the source
+    clean_generated_files()
+    assert Path("img/a/image1.png").exists()
+    assert load_outputs(manifest_path) == {"img/a/annotation.svg": ["img/a/image1.png"]}
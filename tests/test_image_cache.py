@@ -0,0 +1,159 @@
+"""Image cache: key stability, hits and misses, restore, verify and LRU pruning"""
+
+import os
+import shutil
+import time
+from pathlib import Path
+
+from PIL import Image
+
+from image_cache import CACHE_FORMAT, META_FILE, ImageCache
+from prepare_images import process_annotation_file
+
+STYLES = {"tumor": {"fill": "#ff0000", "stroke": "none"}}
+
+
+def make_cache(tmp_path) -> ImageCache:
+    return ImageCache(tmp_path / "cache", tool_version="Inkscape 1.3 (fake)")
+
+
+def test_key_is_stable(project, settings, tmp_path):
+    key = make_cache(tmp_path).compute_key("img/a/annotation.svg", settings, STYLES)
+    assert make_cache(tmp_path).compute_key("img/a/annotation.svg", settings, STYLES) == key
+    # The same file reached by another spelling of its path
+    assert make_cache(tmp_path).compute_key(os.path.abspath("img/a/annotation.svg"), settings, STYLES) == key
+
+
+def test_key_changes_with_inputs(project, settings, tmp_path):
+    cache = make_cache(tmp_path)
+    key = cache.compute_key("img/a/annotation.svg", settings, STYLES)
+
+    assert cache.compute_key("img/a/annotation.svg", settings, {"tumor": {"fill": "#00ff00"}}) != key
+    other_tool = ImageCache(tmp_path / "cache", tool_version="Inkscape 1.4")
+    assert other_tool.compute_key("img/a/annotation.svg", settings, STYLES) != key
+
+    Image.new("RGB", (40, 40), (10, 10, 10)).save("img/a/image1.png")
+    linked_key = cache.compute_key("img/a/annotation.svg", settings, STYLES)
+    assert linked_key != key
+
+    Path("img/a/annotation.svg").write_text(
+        Path("img/a/annotation.svg").read_text(encoding="utf-8").replace("M 5 5", "M 6 6"), encoding="utf-8"
+    )
+    assert cache.compute_key("img/a/annotation.svg", settings, STYLES) not in (key, linked_key)
+
+
+def test_identical_annotations_in_other_directories_get_their_own_keys(project, settings, tmp_path):
+    shutil.copytree("img/a", "img/b")
+    cache = make_cache(tmp_path)
+    assert cache.compute_key("img/a/annotation.svg", settings, STYLES) != cache.compute_key(
+        "img/b/annotation.svg", settings, STYLES
+    )
+
+
+def test_miss_renders_and_hit_restores_without_inkscape(project, settings, fake_inkscape, tmp_path):
+    cache = make_cache(tmp_path)
+    outputs = process_annotation_file("img/a/annotation.svg", settings, STYLES, cache=cache)
+    exported = fake_inkscape.exports()
+    assert exported
+    assert sorted(os.path.relpath(path) for path in outputs) == [
+        "img/a/annotation_styled.svg", "img/a/image1_annotated.png",
+    ]
+
+    restored = process_annotation_file("img/a/annotation.svg", settings, STYLES, cache=cache)
+    assert fake_inkscape.exports() == exported
+    assert sorted(restored) == sorted(outputs)
+
+    Image.new("RGB", (40, 40), (10, 10, 10)).save("img/a/image1.png")
+    process_annotation_file("img/a/annotation.svg", settings, STYLES, cache=cache)
+    assert len(fake_inkscape.exports()) > len(exported)
+
+
+def test_restore_writes_back_the_stored_outputs(project, settings, tmp_path):
+    cache = make_cache(tmp_path)
+    outputs = process_annotation_file("img/a/annotation.svg", settings, STYLES, cache=cache)
+    contents = {path: Path(path).read_bytes() for path in outputs}
+    for path in outputs:
+        os.remove(path)
+
+    key = cache.compute_key("img/a/annotation.svg", settings, STYLES)
+    restored = cache.restore(key, "img/a/annotation.svg")
+    assert sorted(restored) == sorted(contents)
+    for path, content in contents.items():
+        assert Path(path).read_bytes() == content
+
+    meta = cache.read_meta(key)
+    assert meta["format"] == CACHE_FORMAT
+    assert meta["source"] == "img/a/annotation.svg"
+    assert all(not os.path.isabs(output["path"]) for output in meta["outputs"])
+
+
+def test_restore_keeps_each_annotation_in_its_own_directory(project, settings, tmp_path):
+    shutil.copytree("img/a", "img/b")
+    cache = make_cache(tmp_path)
+    process_annotation_file("img/a/annotation.svg", settings, STYLES, cache=cache)
+    outputs = process_annotation_file("img/b/annotation.svg", settings, STYLES, cache=cache)
+    assert all(os.path.relpath(path).startswith("img/b/") for path in outputs)
+
+
+def test_restore_misses_on_a_missing_entry_file(project, settings, tmp_path):
+    cache = make_cache(tmp_path)
+    process_annotation_file("img/a/annotation.svg", settings, STYLES, cache=cache)
+    key = cache.compute_key("img/a/annotation.svg", settings, STYLES)
+    for cached in cache.entry_dir(key).iterdir():
+        if cached.name != META_FILE:
+            cached.unlink()
+    assert cache.restore(key, "img/a/annotation.svg") is None
+
+
+def test_verify_removes_corrupt_entries(project, settings, tmp_path):
+    cache = make_cache(tmp_path)
+    process_annotation_file("img/a/annotation.svg", settings, STYLES, cache=cache)
+    key = cache.compute_key("img/a/annotation.svg", settings, STYLES)
+    assert cache.verify() == []
+
+    cached = next(path for path in cache.entry_dir(key).iterdir() if path.name != META_FILE)
+    cached.write_bytes(b"garbage")
+    assert cache.verify(remove_corrupt=True) == [key]
+    assert not cache.has(key)
+
+
+def store_entry(cache: ImageCache, tmp_path, key: str, size: int, used: float):
+    """An entry holding one output of size bytes, last used at time used"""
+    output = tmp_path / f"{key}.png"
+    output.write_bytes(b"x" * size)
+    cache.store(key, tmp_path / "annotation.svg", [str(output)])
+    os.utime(cache.entry_dir(key) / META_FILE, (used, used))
+
+
+def test_prune_drops_entries_of_stale_inputs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache = make_cache(tmp_path)
+    now = time.time()
+    for key in ("a", "b", "c"):
+        store_entry(cache, tmp_path, key, 10, now)
+    assert cache.prune(["a", "c"]) == ["b"]
+    assert cache.iter_keys() == ["a", "c"]
+
+
+def test_prune_by_age_uses_last_use(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache = make_cache(tmp_path)
+    now = time.time()
+    store_entry(cache, tmp_path, "old", 10, now - 10 * 86400)
+    store_entry(cache, tmp_path, "recent", 10, now - 86400)
+    assert cache.prune(["old", "recent"], max_age_days=5) == ["old"]
+
+
+def test_prune_by_size_evicts_least_recently_used(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache = make_cache(tmp_path)
+    now = time.time()
+    for age, key in enumerate(("newest", "middle", "oldest")):
+        store_entry(cache, tmp_path, key, 1000, now - age * 3600)
+    live = ["newest", "middle", "oldest"]
+
+    # A restore makes the oldest entry the most recently used one
+    assert cache.restore("oldest", tmp_path / "annotation.svg") is not None
+    removed = cache.prune(live, max_bytes=3000)
+    assert removed == ["middle"]
+    assert cache.iter_keys() == ["newest", "oldest"]
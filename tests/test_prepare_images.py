@@ -0,0 +1,44 @@
+"""Image export: composite and full with-context renders"""
+
+import os
+
+from PIL import Image
+
+from prepare_images import process_annotation_file
+
+STYLES = {"tumor": {"fill": "#ff0000", "stroke": "none"}}
+
+
+def test_composite_skips_the_with_context_render(project, settings, fake_inkscape):
+    assert settings.export.context_mode == "composite"
+    outputs = process_annotation_file("img/a/annotation.svg", settings, STYLES)
+
+    assert sorted(os.path.relpath(path) for path in outputs) == [
+        "img/a/annotation_styled.svg", "img/a/image1_annotated.png",
+    ]
+    exported = sorted(os.path.basename(path) for path in fake_inkscape.exports())
+    assert exported == ["image1_annotated.base.png", "image1_annotated.overlay.png"]
+    # Temporary renders are removed, the blend is written
+    assert sorted(os.listdir("img/a")) == [
+        "annotation.svg", "annotation_styled.svg", "image1.png", "image1_annotated.png",
+    ]
+    with Image.open("img/a/image1_annotated.png") as image:
+        assert image.size == (4, 4)
+
+
+def test_composite_reuses_a_written_id_only_output(project, settings, fake_inkscape):
+    settings.processing.annotated_suffix = ""
+    settings.build_dir = "build"
+    outputs = process_annotation_file("img/a/annotation.svg", settings, STYLES)
+
+    exported = sorted(os.path.basename(path) for path in fake_inkscape.exports())
+    assert exported == ["image1.png", "image1_.overlay.png"]
+    assert sorted(os.path.relpath(path) for path in outputs) == [
+        "build/img/a/annotation_styled.svg", "build/img/a/image1.png", "build/img/a/image1_.png",
+    ]
+
+
+def test_render_mode_renders_the_with_context_export(project, settings, fake_inkscape):
+    settings.export.context_mode = "render"
+    process_annotation_file("img/a/annotation.svg", settings, STYLES)
+    assert [os.path.basename(path) for path in fake_inkscape.exports()] == ["image1_annotated.png"]
@@ -0,0 +1,92 @@
+"""Comment resolution: tokenizing, shingle voting and match status"""
+
+import pytest
+
+from extract_comments import Comment
+from resolve_comments import ShingleIndex, resolve_comment, shingles, tokenize
+
+# Every line holds at least BUCKET_SIZE words, so a located line is the
+# passage's own line or the one before it
+INTRODUCTION = """Опухоль чаще всего выявляется у пациентов из группы высокого риска [@smith2020].
+Их обследуют по утверждённому протоколу раз в год или чаще при жалобах.
+Магнитно-резонансная томография позволяет оценить распространённость процесса и вовлечение соседних органов.
+"""
+
+METHODS = """Компьютерная томография выполнялась всем пациентам до начала лечения в нашем центре.
+Контрастное усиление применялось по показаниям после оценки функции почек у всех больных.
+"""
+
+
+def near(candidate, name: str, line: int) -> bool:
+    return candidate.file.endswith(name) and line - 1 <= candidate.line <= line
+
+
+def comment(commented_text: str, context: str = "") -> Comment:
+    return Comment("7", "Рецензент", "2024-01-01", "Уточнить", commented_text, "Введение", 12, context)
+
+
+@pytest.fixture
+def index(tmp_path):
+    paths = []
+    for name, text in (("Introduction.qmd", INTRODUCTION), ("Methods.qmd", METHODS)):
+        path = tmp_path / name
+        path.write_text(text, encoding="utf-8")
+        paths.append(str(path))
+    return ShingleIndex(paths)
+
+
+def test_tokenize_drops_markup_and_folds_yo():
+    assert tokenize("Ёмкость [@smith2020] {.mark} [текста](ref.qmd)") == ["емкость", "текста"]
+
+
+def test_shingles():
+    assert shingles(["a", "b", "c", "d"]) == [("a", "b", "c"), ("b", "c", "d")]
+    assert shingles(["a", "b"]) == []
+
+
+def test_search_finds_the_file_and_line(index):
+    top = index.search("Магнитно-резонансная томография позволяет оценить распространённость")[0]
+    assert near(top, "Introduction.qmd", 3)
+    assert top.score == 1.0
+
+    top = index.search("применялось по показаниям после оценки функции почек")[0]
+    assert near(top, "Methods.qmd", 2)
+
+
+def test_search_tolerates_edits_since_the_review(index):
+    # One word changed since the review copy: most shingles still vote for the same place
+    top = index.search("контрастное усиление применялось по показаниям после осмотра функции почек")[0]
+    assert near(top, "Methods.qmd", 2)
+    assert 0.3 < top.score < 1.0
+
+
+def test_resolved_comment(index):
+    resolved = resolve_comment(comment("по утверждённому протоколу раз в год"), index, min_score=0.5)
+    assert resolved.status == "resolved" and resolved.matched_on == "commented_text"
+    assert near(resolved, "Introduction.qmd", 2)
+    assert resolved.review_line == 12 and resolved.alternatives == []
+
+
+def test_short_commented_text_falls_back_to_context(index):
+    resolved = resolve_comment(
+        comment("риска", context="} выявляется у пациентов из группы высокого риска"), index, min_score=0.5
+    )
+    assert resolved.status == "resolved" and resolved.matched_on == "context"
+    assert near(resolved, "Introduction.qmd", 1)
+
+
+def test_unresolved_comment(index):
+    resolved = resolve_comment(comment("этого текста нет ни в одной главе"), index, min_score=0.5)
+    assert resolved.status == "unresolved"
+    assert resolved.file is None and resolved.score == 0.0
+
+
+def test_repeated_passage_is_ambiguous(tmp_path):
+    paths = []
+    for name in ("a.qmd", "b.qmd"):
+        path = tmp_path / name
+        path.write_text(METHODS, encoding="utf-8")
+        paths.append(str(path))
+    resolved = resolve_comment(comment("контрастное усиление применялось по показаниям"), ShingleIndex(paths), 0.5)
+    assert resolved.status == "ambiguous"
+    assert [alternative["score"] for alternative in resolved.alternatives] == [resolved.score]
@@ -0,0 +1,108 @@
+"""Search index: terms, shard contents, snippets and loader injection"""
+
+import json
+
+import pytest
+
+from search_index import INDEX_DIR, LOADER_NAME, build_search_index, shard_name, terms_of
+
+PAGE = """<!DOCTYPE html>
+<html><head><title>Введение</title></head>
+<body>
+<main>
+<h1>Введение</h1>
+<p>Обзор методов визуализации.</p>
+<section id="sec-mri" class="level2">
+<h2>Магнитно-резонансная томография</h2>
+<p>Томография выявляет опухоль на ранней стадии.</p>
+<div id="fig-mri" class="quarto-figure">
+<figure><img src="mri.png"><figcaption>Рисунок 1: Опухоль печени</figcaption></figure>
+</div>
+<script>var томография = 1;</script>
+</section>
+</main>
+</body></html>
+"""
+
+GLOSSARY = """# Сокращения
+
+МРТ — магнитно-резонансная томография
+"""
+
+
+@pytest.fixture
+def book(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "build").mkdir()
+    (tmp_path / "build" / "book-search.js").write_text("// loader\n", encoding="utf-8")
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "Abbrevations.qmd").write_text(GLOSSARY, encoding="utf-8")
+    page = tmp_path / "_book" / "src" / "Introduction.html"
+    page.parent.mkdir(parents=True)
+    page.write_text(PAGE, encoding="utf-8")
+    return tmp_path / "_book"
+
+
+def load(path):
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def postings(index_dir, term):
+    return dict(load(index_dir / "shards" / f"{shard_name(term)}.json")[term])
+
+
+def test_terms_drop_stop_words_and_fold_yo():
+    assert terms_of("Опухоль и её размеры") == terms_of("опухоль размеры")
+    assert terms_of("у 5 пациентов") == ["5", terms_of("пациентов")[0]]
+
+
+def test_shard_name():
+    assert shard_name("кишк") == "043a-0438"
+    assert shard_name("к") == "043a"
+
+
+def test_index_documents_and_pages(book):
+    assert build_search_index(book) == 4
+    index = load(book / INDEX_DIR / "index.json")
+    assert index["pages"] == [["src/Introduction.html", "Введение"], ["src/Abbrevations.html", ""]]
+    assert index["documents"] == [
+        [0, "", "", "s"],
+        [0, "sec-mri", "Магнитно-резонансная томография", "s"],
+        [0, "fig-mri", "Рисунок 1: Опухоль печени", "f"],
+        [1, "", "МРТ — магнитно-резонансная томография", "a"],
+    ]
+    assert sorted(index["shards"]) == index["shards"]
+    assert sorted(path.stem for path in (book / INDEX_DIR / "shards").iterdir()) == index["shards"]
+
+
+def test_shards_hold_weighted_postings(book):
+    build_search_index(book)
+    index_dir = book / INDEX_DIR
+    tomography = terms_of("томография")[0]
+    # Section title (5) plus body (1); the page script is not indexed; glossary expansion (3)
+    assert postings(index_dir, tomography) == {1: 5 + 1, 3: 3}
+    # The section body includes its figure caption, which is also a document of its own
+    tumour = terms_of("опухоль")[0]
+    assert postings(index_dir, tumour) == {1: 2, 2: 3}
+    assert postings(index_dir, "мрт") == {3: 10}
+    # Every term is stored in the shard of its first letters only
+    for name in index_dir.joinpath("shards").iterdir():
+        assert all(shard_name(term) == name.stem for term in load(name))
+
+
+def test_snippets_and_loader(book):
+    build_search_index(book)
+    index_dir = book / INDEX_DIR
+    assert load(index_dir / "snippets" / "0.json") == [
+        "Введение Обзор методов визуализации.",
+        "Томография выявляет опухоль на ранней стадии. Рисунок 1: Опухоль печени",
+        "",
+        "",
+    ]
+    assert (index_dir / LOADER_NAME).read_text(encoding="utf-8") == "// loader\n"
+
+    page = book / "src" / "Introduction.html"
+    build_search_index(book)
+    text = page.read_text(encoding="utf-8")
+    assert text.count(LOADER_NAME) == 1
+    assert f'<script src="../{INDEX_DIR}/{LOADER_NAME}" defer></script>' in text